@@ -1,10 +1,12 @@
 import mimetypes
 import os
+import typing
 from operator import itemgetter
 
 from django.core.exceptions import SuspiciousFileOperation
 from django.core.files.uploadedfile import UploadedFile
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import QuerySet
 from rest_framework import serializers, exceptions
 
 from app.utils.models import get_field
@@ -12,11 +14,15 @@ from storage.data_providers.exceptions import ProviderException
 from storage.data_providers.utils import get_data_provider
 
 from storage.models import Node, Mimetype
-from storage.utils import get_node_by_path
+from storage.file_cache import file_cache
+from storage.path_cache import path_cache
+from storage.upload_handlers import StreamedUploadedFile
+from storage.utils import adapt_path, get_node_by_path
 
 
 class NodeSerializer(serializers.ModelSerializer):
     mimetype = serializers.ReadOnlyField(source='mimetype.name', default=None)
+    size = serializers.ReadOnlyField(source='total_size')
     has_preview = serializers.SerializerMethodField()
 
     class Meta:
@@ -39,6 +45,65 @@ class NodeSerializer(serializers.ModelSerializer):
         return False
 
 
+class NodeValuesSerializer:
+    """
+    Read-only NodeSerializer for listings of many nodes.
+
+    Works with rows of QuerySet.values_list (mimetype name is joined in SQL) and builds dicts directly,
+    without DRF fields machinery per node. Representation is the same as NodeSerializer's.
+    """
+    columns = ['name', 'file_type', 'mimetype__name', 'total_size']
+
+    @classmethod
+    def get_rows(cls, queryset: QuerySet) -> QuerySet:
+        return queryset.values_list(*cls.columns)
+
+    @staticmethod
+    def get_ordering_values(row: tuple) -> tuple:
+        """(file_type, name) of row for keyset pagination."""
+        return row[1], row[0]
+
+    @staticmethod
+    def to_representation(row: tuple) -> dict:
+        name, file_type, mimetype, size = row
+        return {
+            'name': name,
+            'file_type': file_type,
+            'mimetype': mimetype,
+            'size': size,
+            'has_preview': False,
+        }
+
+    @classmethod
+    def serialize(cls, rows: typing.Iterable[tuple]) -> typing.List[dict]:
+        return [cls.to_representation(row) for row in rows]
+
+
+class NodeStatSerializer(serializers.Serializer):
+    """Paths to get info about."""
+    paths = serializers.ListField(
+        child=serializers.CharField(allow_blank=True),
+        allow_empty=False,
+        max_length=1000,
+        write_only=True,
+    )
+
+
+class NodeArchiveSerializer(serializers.Serializer):
+    """Query params of directory archive."""
+    compression = serializers.ChoiceField(
+        choices=['store', 'deflate'],
+        default='store',
+        help_text='Store files as is (fast, default) or compress them',
+    )
+    names = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+        max_length=1000,
+        help_text='Names of directory children to archive, whole directory by default',
+    )
+
+
 class NodeCreateSerializer(NodeSerializer):
     file = serializers.FileField(write_only=True)
 
@@ -65,23 +130,140 @@ class NodeCreateSerializer(NodeSerializer):
 
         content_type, _ = mimetypes.guess_type(str(file))
         mimetype, _ = Mimetype.objects.get_or_create(name=content_type or 'application/octet-stream')
-        node = parent_node.add_child(
-            name=file.name,
-            file_type=Node.FileTypeChoices.FILE,
-            size=file.size,
-            mimetype=mimetype,
-        )
+        try:
+            node = parent_node.add_child(
+                name=file.name,
+                file_type=Node.FileTypeChoices.FILE,
+                size=file.size,
+                mimetype=mimetype,
+                # computed by upload handler while request was received
+                content_hash=getattr(file, 'content_hash', ''),
+            )
+        except IntegrityError:
+            raise exceptions.ValidationError({'detail': f'"{file.name}" already exists'})
 
         try:
-            data_provider.upload_file(path=path, uploaded_file=file)
+            if isinstance(file, StreamedUploadedFile):
+                # already written into provider while request was received
+                file.complete()
+            else:
+                data_provider.upload_file(path=path, uploaded_file=file)
         except ProviderException as e:
             raise exceptions.ValidationError(e)
+        file_cache.invalidate(library.pk, node.path)
 
         return node
 
 
+class NodeBatchUploadSerializer(serializers.Serializer):
+    """Upload many files into library directory at once, subdirectories are created if needed."""
+    files = serializers.ListField(
+        child=serializers.FileField(),
+        allow_empty=False,
+        max_length=1000,
+        write_only=True,
+    )
+    paths = serializers.ListField(
+        child=serializers.CharField(allow_blank=True),
+        required=False,
+        max_length=1000,
+        write_only=True,
+        help_text='Directory of every file relative to target directory ("foo/bar"), in order of files',
+    )
+    nodes = NodeSerializer(many=True, read_only=True)
+
+    def validate_paths(self, paths: typing.List[str]) -> typing.List[str]:
+        for path in paths:
+            if any(name in ['.', '..'] for name in path.split('/')):
+                raise exceptions.ValidationError('This path is invalid')
+        return [adapt_path(path).lstrip('/') for path in paths]
+
+    def validate(self, attrs: dict) -> dict:
+        if 'paths' in attrs and len(attrs['paths']) != len(attrs['files']):
+            raise exceptions.ValidationError({'paths': 'Number of paths must be equal to number of files'})
+        return attrs
+
+    @staticmethod
+    def get_mimetypes(names: typing.Set[str]) -> typing.Dict[str, Mimetype]:
+        """Mimetypes by names, missing ones are created."""
+        found = {mimetype.name: mimetype for mimetype in Mimetype.objects.filter(name__in=names)}
+        if names - found.keys():
+            Mimetype.objects.bulk_create([Mimetype(name=name) for name in names - found.keys()])
+            found = {mimetype.name: mimetype for mimetype in Mimetype.objects.filter(name__in=names)}
+        return found
+
+    @staticmethod
+    def remove_written(data_provider, paths: typing.List[str]):
+        """Remove files and directories written by failed upload, files first and subdirectories before parents."""
+        for path in reversed(paths):
+            try:
+                data_provider.rm(path=path)
+            except (ProviderException, OSError):
+                # todo: logging.exception(e)
+                pass
+
+    @transaction.atomic
+    def create(self, validated_data: dict):
+        files: typing.List[UploadedFile] = validated_data['files']
+        paths: typing.List[str] = validated_data.get('paths') or [''] * len(files)
+        library, path = itemgetter('library', 'path')(self.context)
+        data_provider = get_data_provider(library=library)
+
+        try:
+            parent_node = get_node_by_path(
+                library=library,
+                path=path,
+                last_node_type=Node.FileTypeChoices.DIRECTORY,
+            )
+        except Node.DoesNotExist as e:
+            raise exceptions.ValidationError({'detail': str(e)})
+
+        content_types = [mimetypes.guess_type(file.name)[0] or 'application/octet-stream' for file in files]
+        mimetypes_by_name = self.get_mimetypes(set(content_types))
+
+        try:
+            directories, nodes = parent_node.add_descendants([
+                (f'{directory}/{file.name}'.lstrip('/'), {
+                    'size': file.size,
+                    'mimetype': mimetypes_by_name[content_type],
+                    # computed by upload handler while request was received
+                    'content_hash': getattr(file, 'content_hash', ''),
+                })
+                for file, directory, content_type in zip(files, paths, content_types)
+            ])
+        except Node.DoesNotExist as e:
+            raise exceptions.ValidationError({'detail': str(e)})
+        except IntegrityError:
+            raise exceptions.ValidationError({'detail': 'Some files already exist'})
+
+        # nodes are rolled back on failure, so is everything written into provider
+        written = []
+        try:
+            for directory in directories:
+                data_provider.mkdir(target_path=directory.path)
+                written.append(directory.path)
+            for node, file in zip(nodes, files):
+                data_provider.upload_file(path=os.path.dirname(node.path), uploaded_file=file)
+                written.append(node.path)
+        except BaseException as e:
+            self.remove_written(data_provider, written)
+            if isinstance(e, ProviderException):
+                raise exceptions.ValidationError(e)
+            raise
+
+        for directory in directories:
+            path_cache.invalidate(library.pk, directory.path)
+        for node, content_type in zip(nodes, content_types):
+            file_cache.invalidate(library.pk, node.path)
+            # nodes are fetched without related objects, mimetypes are already known
+            node.mimetype = mimetypes_by_name[content_type]
+
+        return {'nodes': nodes}
+
+
 class NodeMoveSerializer(serializers.ModelSerializer):
     target_path = serializers.CharField(required=True, allow_null=False, allow_blank=False, write_only=True)
+    size = serializers.ReadOnlyField(source='total_size')
 
     class Meta:
         model = Node
@@ -106,8 +288,7 @@ class NodeMoveSerializer(serializers.ModelSerializer):
     def update(self, instance: Node, validated_data):
         library, source_path = itemgetter('library', 'path')(self.context)
         target_path = validated_data['target_path']
-        # data_provider = get_data_provider(data_source=library.data_source)
-        # super().update(instance, validated_data)
+        data_provider = get_data_provider(library=library)
 
         try:
             source_node = get_node_by_path(library=library, path=source_path)
@@ -119,27 +300,29 @@ class NodeMoveSerializer(serializers.ModelSerializer):
         except Node.DoesNotExist as e:
             raise exceptions.ValidationError({'path': str(e)})
 
-        print('source:', source_node)
-        print('source parent:', source_node.get_parent())
-        print('target:', target_directory)
-
-        assert target_directory != source_node.get_parent()
+        if target_directory == source_node or target_directory.is_descendant_of(source_node):
+            raise exceptions.ValidationError({'target_path': 'Can not move node into itself'})
 
-        source_node.move(target_directory, pos='sorted-child')
+        source_node_path = source_node.path
+        try:
+            source_node.move(target_directory)
+        except IntegrityError:
+            raise exceptions.ValidationError({'target_path': f'"{source_node.name}" already exists'})
+        path_cache.invalidate(library.pk, source_node_path, recursive=True)
+        file_cache.invalidate(library.pk, source_node_path)
 
-        # try:
-        #     data_provider.move(
-        #         library=library,
-        #         source_path=path,
-        #         target_directory=target_directory,
-        #     )
-        # except ProviderException as e:
-        #     raise exceptions.ValidationError(e)
+        # nodes are rolled back if storage fails to move files
+        try:
+            data_provider.move(path=source_node_path, target_path=target_directory.path)
+        except ProviderException as e:
+            raise exceptions.ValidationError(e)
 
         return self.instance
 
 
 class NodeRenameSerializer(serializers.ModelSerializer):
+    size = serializers.ReadOnlyField(source='total_size')
+
     class Meta:
         model = Node
         fields = [
@@ -160,10 +343,17 @@ class NodeRenameSerializer(serializers.ModelSerializer):
     @transaction.atomic
     def update(self, instance: Node, validated_data):
         library, path = itemgetter('library', 'path')(self.context)
-        name = validated_data['name']
+        name = validated_data.pop('name')
         data_provider = get_data_provider(library=library)
 
-        super().update(instance, validated_data)
+        old_path = instance.path
+        try:
+            # only name, paths and updated_at are saved, stats may be changed concurrently
+            instance.rename(name=name)
+        except IntegrityError:
+            raise exceptions.ValidationError({'name': f'"{name}" already exists'})
+        path_cache.invalidate(library.pk, old_path, recursive=True)
+        file_cache.invalidate(library.pk, old_path)
 
         try:
             data_provider.rename(path=path, name=name)
@@ -199,7 +389,11 @@ class MkDirectorySerializer(NodeSerializer):
         except Node.DoesNotExist as e:
             raise exceptions.ParseError(str(e))
 
-        node = parent_node.add_child(name=name, file_type=Node.FileTypeChoices.DIRECTORY)
+        try:
+            node = parent_node.add_child(name=name, file_type=Node.FileTypeChoices.DIRECTORY)
+        except IntegrityError:
+            raise exceptions.ParseError(f'"{name}" already exists')
+        path_cache.invalidate(library.pk, node.path)
         target_path = os.path.join(path, name)
 
         try:
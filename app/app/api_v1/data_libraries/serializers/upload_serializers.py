@@ -0,0 +1,258 @@
+import mimetypes
+import typing
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from rest_framework import serializers, exceptions
+
+from app.api_v1.data_libraries.serializers.node_serializers import NodeBatchUploadSerializer, NodeSerializer
+from app.utils.models import get_field
+from storage.data_providers.exceptions import FileExistsException, ProviderException
+from storage.data_providers.utils import get_data_provider
+from storage.file_cache import file_cache
+from storage.models import Mimetype, Node, UploadSession
+from storage.utils import get_node_by_path
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Resumable upload: file name and size are sent first, then parts, then upload is completed."""
+    name = serializers.CharField(
+        max_length=get_field(Node, 'name').max_length,
+        label=get_field(Node, 'name').verbose_name,
+    )
+    max_parallel_parts = serializers.SerializerMethodField()
+    parts = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id',
+            'path',
+            'name',
+            'size',
+            'chunk_size',
+            'max_parallel_parts',
+            'parts',
+            'created_at',
+        ]
+        read_only_fields = [
+            'id',
+            'path',
+            'chunk_size',
+            'created_at',
+        ]
+
+    @staticmethod
+    def validate_name(name: str):
+        if name in ['.', '..'] or '/' in name:
+            raise exceptions.ValidationError('This name is invalid')
+        return name
+
+    @staticmethod
+    def validate_size(size: int):
+        if size > settings.STORAGE_UPLOAD_MAX_SIZE:
+            raise exceptions.ValidationError(f'File is too large, maximal size is {settings.STORAGE_UPLOAD_MAX_SIZE}')
+        return size
+
+    @staticmethod
+    def get_max_parallel_parts(instance: UploadSession) -> int:
+        return settings.STORAGE_UPLOAD_MAX_PARALLEL_PARTS
+
+    @staticmethod
+    def get_parts(instance: UploadSession) -> list:
+        """Numbers of uploaded parts."""
+        return sorted(instance.parts.values_list('number', flat=True))
+
+    def create(self, validated_data: dict):
+        library, path = itemgetter('library', 'path')(self.context)
+        name, size = itemgetter('name', 'size')(validated_data)
+        data_provider = get_data_provider(library=library)
+
+        try:
+            parent_node = get_node_by_path(
+                library=library,
+                path=path,
+                last_node_type=Node.FileTypeChoices.DIRECTORY,
+                # node is checked again, when upload is completed
+                lazy=True,
+            )
+        except Node.DoesNotExist as e:
+            raise exceptions.ValidationError({'detail': str(e)})
+
+        if parent_node.get_children().filter(name=name).exists():
+            raise exceptions.ValidationError({'detail': f'"{name}" already exists'})
+
+        try:
+            upload_id = data_provider.create_upload(path=parent_node.path or '/', name=name, size=size)
+        except ProviderException as e:
+            raise exceptions.ValidationError(e)
+
+        return UploadSession.objects.create(
+            library=library,
+            path=parent_node.path,
+            name=name,
+            size=size,
+            chunk_size=max(settings.STORAGE_UPLOAD_CHUNK_SIZE, data_provider.min_upload_chunk_size),
+            provider_upload_id=upload_id,
+        )
+
+
+class MissingPartsError(exceptions.ValidationError):
+    """Upload can not be completed, numbers of missing parts are reported as they are (not as error strings)."""
+
+    def __init__(self, missing_parts: typing.List[int]):
+        super().__init__({'detail': 'Not all parts are uploaded'})
+        self.detail['missing_parts'] = missing_parts
+
+
+class UploadSessionCompleteSerializer(NodeSerializer):
+    """Create node from uploaded parts."""
+
+    @transaction.atomic
+    def create(self, validated_data: dict):
+        session: UploadSession = self.context['session']
+        library = session.library
+        data_provider = get_data_provider(library=library)
+
+        parts = list(session.parts.order_by('number').values_list('number', 'etag'))
+        if len(parts) != session.part_count:
+            uploaded = {number for number, _ in parts}
+            missing = [number for number in range(1, session.part_count + 1) if number not in uploaded]
+            raise MissingPartsError(missing)
+
+        try:
+            parent_node = get_node_by_path(
+                library=library,
+                path=session.path,
+                last_node_type=Node.FileTypeChoices.DIRECTORY,
+            )
+        except Node.DoesNotExist as e:
+            raise exceptions.ValidationError({'detail': str(e)})
+
+        content_type, _ = mimetypes.guess_type(session.name)
+        mimetype, _ = Mimetype.objects.get_or_create(name=content_type or 'application/octet-stream')
+        try:
+            node = parent_node.add_child(
+                name=session.name,
+                file_type=Node.FileTypeChoices.FILE,
+                size=session.size,
+                mimetype=mimetype,
+            )
+        except IntegrityError:
+            raise exceptions.ValidationError({'detail': f'"{session.name}" already exists'})
+
+        try:
+            content_hash = data_provider.complete_upload(
+                upload_id=session.provider_upload_id,
+                path=parent_node.path or '/',
+                name=session.name,
+                parts=parts,
+            )
+        except ProviderException as e:
+            raise exceptions.ValidationError(e)
+        if content_hash:
+            node.content_hash = content_hash
+            node.save(update_fields=['content_hash'])
+
+        session.delete()
+        file_cache.invalidate(library.pk, node.path)
+        return node
+
+
+class NegotiatedFileSerializer(serializers.Serializer):
+    name = serializers.CharField(
+        max_length=get_field(Node, 'name').max_length,
+        label=get_field(Node, 'name').verbose_name,
+    )
+    size = serializers.IntegerField(min_value=0)
+    hash = serializers.RegexField(
+        r'^[0-9a-f]{64}$',
+        help_text='SHA-256 hex digest of content',
+    )
+
+    @staticmethod
+    def validate_name(name: str):
+        return UploadSessionSerializer.validate_name(name)
+
+
+class UploadNegotiationSerializer(serializers.Serializer):
+    """
+    Files are described before upload, files with content, that server already has, are created at once.
+
+    Only files listed in "upload" must be sent then.
+    """
+    files = NegotiatedFileSerializer(many=True, allow_empty=False, write_only=True)
+    created = NodeSerializer(many=True, read_only=True)
+    upload = serializers.ListField(child=serializers.CharField(), read_only=True)
+
+    max_files = 1000
+
+    def validate_files(self, files: typing.List[dict]) -> typing.List[dict]:
+        if len(files) > self.max_files:
+            raise exceptions.ValidationError(f'Ensure this field has no more than {self.max_files} elements.')
+        if len({file['name'] for file in files}) != len(files):
+            raise exceptions.ValidationError('Names of files must be unique')
+        return files
+
+    @transaction.atomic
+    def create(self, validated_data: dict):
+        files: typing.List[dict] = validated_data['files']
+        library, path = itemgetter('library', 'path')(self.context)
+        data_provider = get_data_provider(library=library)
+
+        try:
+            parent_node = get_node_by_path(
+                library=library,
+                path=path,
+                last_node_type=Node.FileTypeChoices.DIRECTORY,
+            )
+        except Node.DoesNotExist as e:
+            raise exceptions.ValidationError({'detail': str(e)})
+
+        existing_name = parent_node.get_children().filter(
+            name__in=[file['name'] for file in files],
+        ).values_list('name', flat=True).first()
+        if existing_name is not None:
+            raise exceptions.ValidationError({'detail': f'"{existing_name}" already exists'})
+
+        linked, upload = [], []
+        try:
+            for file in files:
+                try:
+                    is_linked = data_provider.link_file(
+                        path=parent_node.path or '/',
+                        name=file['name'],
+                        content_hash=file['hash'],
+                        size=file['size'],
+                    )
+                except FileExistsException:
+                    raise exceptions.ValidationError({'detail': f'"{file["name"]}" already exists'})
+                (linked if is_linked else upload).append(file)
+
+            content_types = [mimetypes.guess_type(file['name'])[0] or 'application/octet-stream' for file in linked]
+            mimetypes_by_name = NodeBatchUploadSerializer.get_mimetypes(set(content_types))
+            try:
+                _, nodes = parent_node.add_descendants([
+                    (file['name'], {
+                        'size': file['size'],
+                        'mimetype': mimetypes_by_name[content_type],
+                        'content_hash': file['hash'],
+                    })
+                    for file, content_type in zip(linked, content_types)
+                ])
+            except IntegrityError:
+                raise exceptions.ValidationError({'detail': 'Some files already exist'})
+        except BaseException:
+            # nodes are rolled back, so are linked files
+            NodeBatchUploadSerializer.remove_written(
+                data_provider,
+                [f'{parent_node.path}/{file["name"]}' for file in linked],
+            )
+            raise
+
+        for node, content_type in zip(nodes, content_types):
+            file_cache.invalidate(library.pk, node.path)
+            node.mimetype = mimetypes_by_name[content_type]
+
+        return {'created': nodes, 'upload': [file['name'] for file in upload]}
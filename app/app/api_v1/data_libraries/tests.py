@@ -1,17 +1,32 @@
+import hashlib
+import io
+import json
 import tempfile
 import uuid
+import zipfile
+from datetime import timedelta
 from pathlib import Path
 from unittest import mock
 
 from PIL import Image
+from django.core.files import File
+from django.db import IntegrityError
+from django.db.models import F
+from django.http import HttpResponse, UnreadablePostError
 from django.urls import reverse
+from django.utils.http import http_date
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from accounts.factories import UserFactory
+from app.api_v1.data_libraries.serializers.node_serializers import NodeSerializer, NodeValuesSerializer
+from app.api_v1.utils.pagination import KeysetPagination
 from storage.data_providers.exceptions import ProviderException
+from storage.data_providers.file_storage import FileSystemStorageProvider
+from storage.data_providers.utils import get_data_provider
 from storage.factories import DataSourceFactory, DataLibraryFactory, FileFactory, DirectoryFactory
 from storage.models import DataLibrary, Node
+from storage.path_cache import path_cache
 
 
 class LibraryTests(APITestCase):
@@ -74,16 +89,18 @@ class NodeTests(APITestCase):
     def setUp(self) -> None:
         self.user = UserFactory()
         self.client.force_login(self.user)
+        # ids of nodes of previous tests are reused
+        path_cache.clear()
 
     @staticmethod
-    def to_json(data_library: DataLibrary, current_node: Node, child_nodes=None):
+    def to_json(data_library: DataLibrary, current_node: Node, child_nodes=None, next_cursor=None):
         if child_nodes is None:
-            child_nodes = current_node.get_children()
+            child_nodes = current_node.get_children().order_by('file_type', 'name')
 
         return {
             'current_node': {
                 'file_type': current_node.file_type,
-                'size': current_node.size,
+                'size': current_node.total_size,
                 'name': current_node.name,
                 'mimetype': current_node.mimetype and current_node.mimetype.name,
                 'has_preview': False,
@@ -97,9 +114,10 @@ class NodeTests(APITestCase):
                 'file_type': child.file_type,
                 'has_preview': False,
                 'mimetype': child.mimetype and child.mimetype.name,
-                'size': child.size,
+                'size': child.total_size,
                 'name': child.name,
-            } for child in child_nodes]
+            } for child in child_nodes],
+            'next_cursor': next_cursor,
         }
 
     def test_list_nodes(self):
@@ -125,6 +143,135 @@ class NodeTests(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, response.data)
 
+    def test_list_nodes_pagination(self):
+        """Ensure we can list nodes page by page."""
+        data_library = DataLibraryFactory(owner=self.user)
+        files = [FileFactory(parent=data_library.root_dir, name=name) for name in ['c.txt', 'a.txt', 'b.txt']]
+        directories = [DirectoryFactory(parent=data_library.root_dir, name=name) for name in ['z', 'y']]
+        expected_nodes = [directories[1], directories[0], files[1], files[2], files[0]]
+        url = reverse('api_v1:lib-files', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+
+        nodes = []
+        params = {'limit': 2}
+        for _ in range(3):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+            self.assertLessEqual(len(response.json()['nodes']), 2)
+            nodes += response.json()['nodes']
+            params['cursor'] = response.json()['next_cursor']
+
+        self.assertIsNone(params['cursor'])
+        self.assertListEqual(nodes, self.to_json(data_library, data_library.root_dir, expected_nodes)['nodes'])
+
+        # invalid params
+        cursors = [['file'], ['file', {}], ['file', [1]], [None, 1], [True, 'foo']]
+        for params in [
+            {'limit': 0}, {'limit': 'foo'}, {'limit': 10000}, {'cursor': 'foo'},
+            *[{'cursor': KeysetPagination.encode_cursor(cursor)} for cursor in cursors],
+        ]:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+
+    def test_stream_nodes(self):
+        """Ensure we can list all nodes as streaming JSON."""
+        data_library = DataLibraryFactory(owner=self.user)
+        directory = DirectoryFactory(parent=data_library.root_dir)
+        for _ in range(5):
+            FileFactory(parent=directory)
+        url = reverse('api_v1:lib-files-stream', kwargs={'lib_id': str(data_library.pk), 'path': f'/{directory.name}'})
+
+        with mock.patch('app.api_v1.data_libraries.views.DataLibraryNodeStreamView.chunk_size', 2):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            data = json.loads(b''.join(response.streaming_content))
+
+        directory.refresh_from_db()
+        expected = self.to_json(data_library, directory)
+        del expected['next_cursor']
+        self.assertDictEqual(data, expected)
+
+        # file
+        file = directory.get_children().first()
+        url = reverse('api_v1:lib-files-stream', kwargs={'lib_id': str(data_library.pk), 'path': file.path})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['nodes'][0]['name'], file.name)
+
+        # directory does not exist
+        url = reverse('api_v1:lib-files-stream', kwargs={'lib_id': str(data_library.pk), 'path': '/does-not-exist'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_values_serializer(self):
+        """Ensure NodeValuesSerializer represents nodes the same way NodeSerializer does."""
+        data_library = DataLibraryFactory(owner=self.user)
+        DirectoryFactory(parent=data_library.root_dir)
+        FileFactory(parent=data_library.root_dir)
+        FileFactory(parent=data_library.root_dir, mimetype=None)
+        queryset = data_library.root_dir.get_children().order_by('name')
+
+        self.assertListEqual(
+            NodeValuesSerializer.serialize(NodeValuesSerializer.get_rows(queryset)),
+            list(map(dict, NodeSerializer(queryset, many=True).data)),
+        )
+
+    def test_list_directory_sizes(self):
+        """Ensure directories are listed with size of their content."""
+        data_library = DataLibraryFactory(owner=self.user)
+        directory = DirectoryFactory(parent=data_library.root_dir)
+        FileFactory(parent=directory, size=10)
+        FileFactory(parent=DirectoryFactory(parent=directory), size=20)
+        url = reverse('api_v1:lib-files', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.json()['current_node']['size'], 30)
+        self.assertEqual(response.json()['nodes'][0]['size'], 30)
+
+    def test_list_nodes_etag(self):
+        """Ensure unchanged listings are answered with 304."""
+        data_library = DataLibraryFactory(owner=self.user)
+        directory = DirectoryFactory(parent=data_library.root_dir)
+        url = reverse('api_v1:lib-files', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        etag = response.headers['ETag']
+
+        # session, user, library and current node only
+        with self.assertNumQueries(4):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # descendant is changed
+        file = FileFactory(parent=directory)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        etag = response.headers['ETag']
+
+        file.rename('foobar')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+
+        # another page of the same listing
+        etag = response.headers['ETag']
+        response = self.client.get(url, {'limit': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        response = self.client.get(url, {'limit': '01'}, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # streaming listing
+        url = reverse('api_v1:lib-files-stream', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
     def test_list_file_node(self):
         """Ensure we can list files too."""
         data_library = DataLibraryFactory(owner=self.user)
@@ -135,6 +282,73 @@ class NodeTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
         self.assertDictEqual(response.json(), self.to_json(data_library, current_node=file, child_nodes=[file]))
 
+    def test_stat_nodes(self):
+        """Ensure we can get info about many nodes at once."""
+        data_library = DataLibraryFactory(owner=self.user)
+        directory = DirectoryFactory(parent=data_library.root_dir)
+        file = FileFactory(parent=directory)
+        url = reverse('api_v1:lib-stat', kwargs={'lib_id': str(data_library.pk)})
+        file_path = f'/{directory.name}/{file.name}'
+        data = {'paths': [file_path, '/does-not-exist']}
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertDictEqual(response.json(), {
+            'nodes': {
+                file_path: self.to_json(data_library, file)['current_node'],
+            },
+            'missing': ['/does-not-exist'],
+        })
+
+        # no paths
+        response = self.client.post(url, {'paths': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+
+        # not our data library
+        url = reverse('api_v1:lib-stat', kwargs={'lib_id': str(DataLibraryFactory().pk)})
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, response.data)
+
+    def test_move_node(self):
+        """Ensure node is moved in database and in storage, so it can be downloaded from new path."""
+        with tempfile.TemporaryDirectory() as root_directory:
+            data_source = DataSourceFactory(
+                data_provider_id=FileSystemStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            )
+            data_library = DataLibraryFactory(owner=self.user, data_source=data_source)
+            provider = get_data_provider(data_library)
+            provider.init_provider()
+            provider.init_library()
+            DirectoryFactory(parent=data_library.root_dir, name='foo')
+            provider.mkdir('/foo')
+            FileFactory(parent=data_library.root_dir, name='bar.txt', size=3)
+            Path(provider.get_user_storage().path('bar.txt')).write_bytes(b'bar')
+
+            url = reverse('api_v1:lib-move', kwargs={'lib_id': str(data_library.pk), 'path': '/bar.txt'})
+            response = self.client.put(url, {'target_path': '/foo'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+            self.assertTrue(Node.objects.filter(path='/foo/bar.txt').exists())
+            self.assertFalse(Path(provider.get_user_storage().path('bar.txt')).exists())
+
+            url = reverse('api_v1:lib-download', kwargs={'lib_id': str(data_library.pk), 'path': '/foo/bar.txt'})
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), b'bar')
+
+            # size of directory is the size of its contents, as in listings
+            DirectoryFactory(parent=data_library.root_dir, name='baz')
+            provider.mkdir('/baz')
+            url = reverse('api_v1:lib-move', kwargs={'lib_id': str(data_library.pk), 'path': '/foo'})
+            response = self.client.put(url, {'target_path': '/baz'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+            self.assertEqual(response.json()['size'], 3)
+
+            # node into itself
+            url = reverse('api_v1:lib-move', kwargs={'lib_id': str(data_library.pk), 'path': '/baz'})
+            response = self.client.put(url, {'target_path': '/baz/foo'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+
     def test_rename_node(self):
         """Ensure we can rename node."""
         data_library = DataLibraryFactory(owner=self.user)
@@ -147,6 +361,13 @@ class NodeTests(APITestCase):
         file.refresh_from_db()
         self.assertEqual(file.name, data['name'])
 
+        # name is already taken
+        another_file = FileFactory(parent=data_library.root_dir)
+        url = reverse('api_v1:lib-rename', kwargs={'lib_id': str(data_library.pk), 'path': '/' + another_file.name})
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertDictEqual(response.json(), {'name': '"FooBar" already exists'})
+
         # try to rename root directory
         url = reverse('api_v1:lib-rename', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
         response = self.client.put(url, data, format='json')
@@ -158,6 +379,35 @@ class NodeTests(APITestCase):
         response = self.client.put(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, response.data)
 
+        # size of directory is the size of its contents, as in listings
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        FileFactory(parent=directory, size=7)
+        url = reverse('api_v1:lib-rename', kwargs={'lib_id': str(data_library.pk), 'path': '/foo'})
+        response = self.client.put(url, {'name': 'bar'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.json()['size'], 7)
+
+    def test_rename_keeps_stats(self):
+        """Ensure rename does not overwrite stats of directory, that are changed while request is handled."""
+        data_library = DataLibraryFactory(owner=self.user)
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        url = reverse('api_v1:lib-rename', kwargs={'lib_id': str(data_library.pk), 'path': '/foo'})
+        rename = Node.rename
+
+        def concurrent_rename(node: Node, name: str):
+            # file is uploaded into directory by another request
+            Node.objects.filter(pk=node.pk).update(total_size=F('total_size') + 10, file_count=F('file_count') + 1)
+            rename(node, name=name)
+
+        with mock.patch.object(Node, 'rename', autospec=True, side_effect=concurrent_rename):
+            response = self.client.put(url, {'name': 'bar'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+
+        directory.refresh_from_db()
+        self.assertEqual(directory.name, 'bar')
+        self.assertEqual(directory.total_size, 10)
+        self.assertEqual(directory.file_count, 1)
+
     def test_mkdir(self):
         """Ensure we can create directories."""
         data_library = DataLibraryFactory(owner=self.user)
@@ -178,6 +428,12 @@ class NodeTests(APITestCase):
             'has_preview': False,
         })
 
+        # directory already exists
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        self.assertDictEqual(response.json(), {'detail': '"FooBar" already exists'})
+        self.assertEqual(data_library.root_dir.get_children().count(), 1)
+
         # mkdir with invalid name
         data = {'name': '..'}
         response = self.client.post(url, data, format='json')
@@ -250,6 +506,22 @@ class NodeTests(APITestCase):
                 'size': tmp_path.stat().st_size,
                 'has_preview': False
             })
+            content_hash = hashlib.sha256(tmp_path.read_bytes()).hexdigest()
+            self.assertEqual(Node.objects.get(name=tmp_path.name).content_hash, content_hash)
+
+            # large file goes to temporary file, hash is the same
+            Node.objects.get(name=tmp_path.name).delete()
+            tmp_file.seek(0)
+            with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10):
+                response = self.client.post(url, {'file': tmp_file}, format='multipart')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+            self.assertEqual(Node.objects.get(name=tmp_path.name).content_hash, content_hash)
+
+            # file already exists
+            tmp_file.seek(0)
+            response = self.client.post(url, {'file': tmp_file}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            self.assertDictEqual(response.json(), {'detail': f'"{tmp_path.name}" already exists'})
 
         # library does not exist
         url = reverse('api_v1:lib-upload', kwargs={'lib_id': str(uuid.uuid4()), 'path': '/'})
@@ -279,6 +551,461 @@ class NodeTests(APITestCase):
             self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
             self.assertDictEqual(response.json(), {'detail': 'Incorrect node type'})
 
+    def test_file_upload_streamed(self):
+        """Ensure file is written straight into provider without temporary upload file."""
+        with tempfile.TemporaryDirectory() as root_directory:
+            data_source = DataSourceFactory(
+                data_provider_id=FileSystemStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            )
+            data_library = DataLibraryFactory(owner=self.user, data_source=data_source)
+            provider = get_data_provider(data_library)
+            provider.init_provider()
+            provider.init_library()
+            url = reverse('api_v1:lib-upload', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+
+            upload = io.BytesIO(b'foobar' * 1000)
+            upload.name = 'foo.txt'
+            with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10), \
+                    mock.patch('django.core.files.uploadhandler.TemporaryFileUploadHandler.new_file') as p:
+                response = self.client.post(url, {'file': upload}, format='multipart')
+                p.assert_not_called()
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+
+            node = Node.objects.get(name='foo.txt')
+            self.assertEqual(node.size, 6000)
+            self.assertEqual(node.content_hash, hashlib.sha256(b'foobar' * 1000).hexdigest())
+            self.assertEqual(Path(provider.get_user_storage().path('foo.txt')).read_bytes(), b'foobar' * 1000)
+            self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+            # file exists, request is handled as usual
+            upload.seek(0)
+            response = self.client.post(url, {'file': upload}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+
+            # written file is removed if node is not created
+            upload.seek(0)
+            upload.name = 'bar.txt'
+            with mock.patch('storage.models.Node.add_child', side_effect=IntegrityError):
+                response = self.client.post(url, {'file': upload}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            self.assertFalse(Path(provider.get_user_storage().path('bar.txt')).exists())
+            self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+            # request body can not be read completely
+            upload.seek(0)
+            with mock.patch(
+                    'django.http.multipartparser.MultiPartParser.handle_file_complete',
+                    side_effect=UnreadablePostError,
+            ), self.assertRaises(UnreadablePostError):
+                self.client.post(url, {'file': upload}, format='multipart')
+            self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+    def test_file_upload_batch(self):
+        """Ensure many files are uploaded in one request, missing directories are created."""
+        with tempfile.TemporaryDirectory() as root_directory:
+            data_source = DataSourceFactory(
+                data_provider_id=FileSystemStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            )
+            data_library = DataLibraryFactory(owner=self.user, data_source=data_source)
+            provider = get_data_provider(data_library)
+            provider.init_provider()
+            provider.init_library()
+            DirectoryFactory(parent=data_library.root_dir, name='foo')
+            provider.mkdir('/foo')
+            url = reverse('api_v1:lib-upload-batch', kwargs={'lib_id': str(data_library.pk), 'path': '/foo'})
+
+            def get_files():
+                files = []
+                for name in ['a.txt', 'b.jpg', 'c.txt']:
+                    file = io.BytesIO(name.encode())
+                    file.name = name
+                    files.append(file)
+                return files
+
+            response = self.client.post(
+                url,
+                {'files': get_files(), 'paths': ['', 'bar/baz', '/bar/']},
+                format='multipart',
+            )
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+            self.assertListEqual([node['name'] for node in response.json()['nodes']], ['a.txt', 'b.jpg', 'c.txt'])
+            self.assertEqual(response.json()['nodes'][1]['mimetype'], 'image/jpeg')
+
+            storage = provider.get_user_storage()
+            self.assertEqual(Path(storage.path('foo/a.txt')).read_bytes(), b'a.txt')
+            self.assertEqual(Path(storage.path('foo/bar/baz/b.jpg')).read_bytes(), b'b.jpg')
+            self.assertEqual(Path(storage.path('foo/bar/c.txt')).read_bytes(), b'c.txt')
+            node = Node.objects.get(path='/foo/bar/baz/b.jpg')
+            self.assertEqual(node.content_hash, hashlib.sha256(b'b.jpg').hexdigest())
+            self.assertEqual(
+                Node.objects.values_list('total_size', 'file_count', 'child_count').get(path='/foo'),
+                (15, 3, 2),
+            )
+
+            # files already exist, nothing is created
+            response = self.client.post(url, {'files': get_files()}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            self.assertEqual(Node.objects.filter(root_id=data_library.root_dir_id).count(), 6)
+
+            response = self.client.post(url, {'files': get_files(), 'paths': ['', '../bar', '']}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            response = self.client.post(url, {'files': get_files(), 'paths': ['bar']}, format='multipart')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+
+            # provider fails, written files and directories are removed, so upload can be retried
+            url = reverse('api_v1:lib-upload-batch', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+            data = {'paths': ['qux', 'qux/quux', '']}
+            uploaded = []
+
+            def upload_file(provider_self, **kwargs):
+                if uploaded:
+                    raise ProviderException('No space left on device')
+                uploaded.append(original_upload_file(provider_self, **kwargs))
+
+            original_upload_file = FileSystemStorageProvider.upload_file
+            with mock.patch.object(FileSystemStorageProvider, 'upload_file', autospec=True, side_effect=upload_file):
+                response = self.client.post(url, {'files': get_files(), **data}, format='multipart')
+            self.assertEqual(len(uploaded), 1)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            self.assertFalse(Path(storage.path('qux')).exists())
+            self.assertFalse(Node.objects.filter(path='/qux').exists())
+
+            response = self.client.post(url, {'files': get_files(), **data}, format='multipart')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+
+    def test_upload_negotiation(self):
+        """Ensure files with content, that library already has, are created without upload."""
+        with tempfile.TemporaryDirectory() as root_directory:
+            data_source = DataSourceFactory(
+                data_provider_id=FileSystemStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            )
+            data_library = DataLibraryFactory(owner=self.user, data_source=data_source)
+            provider = get_data_provider(data_library)
+            provider.init_provider()
+            provider.init_library()
+
+            upload = io.BytesIO(b'foobar')
+            upload.name = 'foo.txt'
+            url = reverse('api_v1:lib-upload', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+            response = self.client.post(url, {'file': upload}, format='multipart')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+
+            url = reverse('api_v1:lib-upload-negotiate', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+            files = [
+                {'name': 'copy.txt', 'size': 6, 'hash': hashlib.sha256(b'foobar').hexdigest()},
+                {'name': 'new.txt', 'size': 3, 'hash': hashlib.sha256(b'new').hexdigest()},
+            ]
+            response = self.client.post(url, {'files': files}, format='json')
+            self.assertEqual(status.HTTP_201_CREATED, response.status_code, response.data)
+            data = response.json()
+            self.assertEqual([node['name'] for node in data['created']], ['copy.txt'])
+            self.assertEqual(data['created'][0]['mimetype'], 'text/plain')
+            self.assertEqual(data['upload'], ['new.txt'])
+
+            node = Node.objects.get(path='/copy.txt')
+            self.assertEqual((node.size, node.content_hash), (6, files[0]['hash']))
+            storage = provider.get_user_storage()
+            self.assertEqual(Path(storage.path('copy.txt')).read_bytes(), b'foobar')
+            self.assertEqual(Path(storage.path('copy.txt')).stat().st_ino, Path(storage.path('foo.txt')).stat().st_ino)
+            self.assertFalse(Node.objects.filter(path='/new.txt').exists())
+
+            # file already exists
+            response = self.client.post(url, {'files': files}, format='json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            self.assertEqual(response.json(), {'detail': '"copy.txt" already exists'})
+
+            # size does not match
+            response = self.client.post(url, {'files': [{**files[0], 'name': 'bar.txt', 'size': 5}]}, format='json')
+            self.assertEqual(response.json()['upload'], ['bar.txt'])
+
+            response = self.client.post(url, {'files': [{**files[1], 'hash': 'foo'}]}, format='json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            response = self.client.post(url, {'files': [files[1], files[1]]}, format='json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+
+            # storage has file, that is not in library, it is reported instead of upload
+            Path(storage.path('orphan.txt')).write_bytes(b'orphan')
+            response = self.client.post(url, {'files': [{**files[0], 'name': 'orphan.txt'}]}, format='json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            self.assertEqual(Path(storage.path('orphan.txt')).read_bytes(), b'orphan')
+
+            # nodes are not created, linked files are removed
+            with mock.patch('storage.models.Node.add_descendants', side_effect=IntegrityError):
+                response = self.client.post(url, {'files': [{**files[0], 'name': 'link.txt'}]}, format='json')
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, response.data)
+            self.assertFalse(Path(storage.path('link.txt')).exists())
+
+    def test_upload_session(self):
+        """Ensure files can be uploaded by parts."""
+        data_library = DataLibraryFactory(owner=self.user)
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        url = reverse('api_v1:lib-upload-session-create', kwargs={'lib_id': str(data_library.pk), 'path': '/foo'})
+
+        with self.settings(STORAGE_UPLOAD_CHUNK_SIZE=4, STORAGE_UPLOAD_MAX_PARALLEL_PARTS=2), \
+                mock.patch('app.utils.tests.TestProvider.create_upload', return_value='upload-id') as p:
+            response = self.client.post(url, {'name': 'bar.txt', 'size': 10}, format='json')
+            p.assert_called_once_with(path='/foo', name='bar.txt', size=10)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        data = response.json()
+        self.assertEqual(data['chunk_size'], 4)
+        self.assertEqual(data['max_parallel_parts'], 2)
+        self.assertEqual(data['parts'], [])
+        self.assertFalse(directory.get_children().exists())
+        session_url = reverse(
+            'api_v1:lib-upload-session',
+            kwargs={'lib_id': str(data_library.pk), 'upload_id': data['id']},
+        )
+        complete_url = reverse(
+            'api_v1:lib-upload-session-complete',
+            kwargs={'lib_id': str(data_library.pk), 'upload_id': data['id']},
+        )
+
+        # parts in any order
+        with mock.patch('app.utils.tests.TestProvider.upload_part', return_value='etag') as p:
+            for offset, part in [(8, b'89'), (0, b'0123')]:
+                response = self.client.patch(
+                    session_url, part, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+            p.assert_called_with(upload_id='upload-id', path='/foo', name='bar.txt', number=1, offset=0, data=b'0123')
+        self.assertEqual(response.json()['parts'], [1, 3])
+
+        # invalid offset and part size
+        for offset, part in [(1, b'1234'), (4, b'45'), (12, b'')]:
+            response = self.client.patch(
+                session_url, part, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # not all parts are uploaded
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['missing_parts'], [2])
+
+        response = self.client.patch(
+            session_url, b'4567', content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='4',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+
+        content_hash = hashlib.sha256(b'0123456789').hexdigest()
+        with mock.patch('app.utils.tests.TestProvider.complete_upload', return_value=content_hash) as p:
+            response = self.client.post(complete_url)
+            p.assert_called_once_with(
+                upload_id='upload-id', path='/foo', name='bar.txt', parts=[(1, 'etag'), (2, ''), (3, 'etag')],
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        node = directory.get_children().get()
+        self.assertEqual((node.name, node.size, node.mimetype.name), ('bar.txt', 10, 'text/plain'))
+        self.assertEqual(node.content_hash, content_hash)
+        self.assertEqual(self.client.get(session_url).status_code, status.HTTP_404_NOT_FOUND)
+
+        # file exists
+        response = self.client.post(url, {'name': 'bar.txt', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # too large
+        with self.settings(STORAGE_UPLOAD_MAX_SIZE=9):
+            response = self.client.post(url, {'name': 'baz.txt', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('size', response.json())
+
+        # abort
+        response = self.client.post(url, {'name': 'baz.txt', 'size': 10}, format='json')
+        session_url = reverse(
+            'api_v1:lib-upload-session',
+            kwargs={'lib_id': str(data_library.pk), 'upload_id': response.json()['id']},
+        )
+        with mock.patch('app.utils.tests.TestProvider.abort_upload') as p:
+            response = self.client.delete(session_url)
+            p.assert_called_once_with(upload_id='upload', path='/foo', name='baz.txt')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        # another user's session
+        self.client.force_login(UserFactory())
+        response = self.client.get(complete_url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_download(self):
+        """Ensure we can download files."""
+        data_library = DataLibraryFactory(owner=self.user)
+        file = FileFactory(parent=data_library.root_dir, size=6)
+        url = reverse('api_v1:lib-download', kwargs={'lib_id': str(data_library.pk), 'path': file.path})
+
+        with mock.patch('app.utils.tests.TestProvider.open_file') as p:
+            p.return_value = File(io.BytesIO(b'foobar'), name=file.name)
+            response = self.client.get(url)
+            p.assert_called_once_with(path=file.path, offset=0, length=None)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'foobar')
+        self.assertEqual(response.headers['Content-Type'], file.mimetype.name)
+        self.assertEqual(response.headers['Content-Length'], '6')
+        self.assertEqual(response.headers['Last-Modified'], http_date(file.updated_at.timestamp()))
+
+        # directory
+        directory = DirectoryFactory(parent=data_library.root_dir)
+        url = reverse('api_v1:lib-download', kwargs={'lib_id': str(data_library.pk), 'path': directory.path})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_archive(self):
+        """Ensure directory is downloaded as ZIP archive."""
+        data_library = DataLibraryFactory(owner=self.user)
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        nested_directory = DirectoryFactory(parent=directory, name='bar')
+        FileFactory(parent=directory, name='a.txt', size=3)
+        FileFactory(parent=nested_directory, name='b.txt', size=3)
+        FileFactory(parent=data_library.root_dir, name='c.txt', size=3)
+        url = reverse('api_v1:lib-archive', kwargs={'lib_id': str(data_library.pk), 'path': directory.path})
+
+        def open_file(path, offset=0, length=None):
+            return File(io.BytesIO(path.encode()), name=path)
+
+        for compression, compress_type in [('store', zipfile.ZIP_STORED), ('deflate', zipfile.ZIP_DEFLATED)]:
+            with mock.patch('app.utils.tests.TestProvider.open_file', side_effect=open_file) as p:
+                response = self.client.get(url, {'compression': compression})
+                p.assert_not_called()
+                content = b''.join(response.streaming_content)
+                self.assertEqual(p.call_count, 2)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.headers['Content-Type'], 'application/zip')
+            self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename="foo.zip"')
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                self.assertIsNone(archive.testzip())
+                self.assertEqual(archive.namelist(), ['a.txt', 'bar/', 'bar/b.txt'])
+                self.assertEqual(archive.read('bar/b.txt'), b'/foo/bar/b.txt')
+                self.assertEqual(archive.getinfo('a.txt').compress_type, compress_type)
+
+        # selection
+        url = reverse('api_v1:lib-archive', kwargs={'lib_id': str(data_library.pk), 'path': '/'})
+        with mock.patch('app.utils.tests.TestProvider.open_file', side_effect=open_file):
+            response = self.client.get(url, {'names': ['foo', 'c.txt']})
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.headers['Content-Disposition'], f'attachment; filename="{data_library.name}.zip"')
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertEqual(archive.namelist(), ['c.txt', 'foo/', 'foo/a.txt', 'foo/bar/', 'foo/bar/b.txt'])
+
+        # invalid compression
+        response = self.client.get(url, {'compression': 'foo'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_download_conditional(self):
+        """Ensure unchanged files are answered with 304 without provider access."""
+        data_library = DataLibraryFactory(owner=self.user)
+        file = FileFactory(parent=data_library.root_dir, size=6)
+        url = reverse('api_v1:lib-download', kwargs={'lib_id': str(data_library.pk), 'path': file.path})
+
+        with mock.patch('app.utils.tests.TestProvider.open_file') as p:
+            p.return_value = File(io.BytesIO(b'foobar'), name=file.name)
+            response = self.client.get(url)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        self.assertTrue(etag.startswith('W/"'))
+
+        for headers in [{'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}]:
+            with mock.patch('storage.data_providers.utils.get_data_provider_class') as p:
+                response = self.client.get(url, **headers)
+                p.assert_not_called()
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.headers['ETag'], etag)
+
+        # file is changed
+        file.size = 7
+        file.updated_at += timedelta(seconds=1)
+        file.save()
+        with mock.patch('app.utils.tests.TestProvider.open_file') as p:
+            p.return_value = File(io.BytesIO(b'foobar!'), name=file.name)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # strong ETag from content hash
+        file.content_hash = hashlib.sha256(b'foobar!').hexdigest()
+        file.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{file.content_hash}"')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers['ETag'], f'"{file.content_hash}"')
+
+    def test_download_offload(self):
+        """Ensure provider can take over file transfer."""
+        data_library = DataLibraryFactory(owner=self.user)
+        file = FileFactory(parent=data_library.root_dir, size=6)
+        url = reverse('api_v1:lib-download', kwargs={'lib_id': str(data_library.pk), 'path': file.path})
+
+        with mock.patch('app.utils.tests.TestProvider.offload_download') as offload, \
+                mock.patch('app.utils.tests.TestProvider.open_file') as open_file:
+            offload.return_value = HttpResponse(headers={'X-Accel-Redirect': '/protected/foo'})
+            response = self.client.get(url, HTTP_RANGE='bytes=0-1')
+            offload.assert_called_once_with(path=file.path, node=file)
+            open_file.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected/foo')
+        self.assertEqual(response.headers['Last-Modified'], http_date(file.updated_at.timestamp()))
+
+    def test_download_range(self):
+        """Ensure only requested byte ranges are read and sent."""
+        data_library = DataLibraryFactory(owner=self.user)
+        file = FileFactory(parent=data_library.root_dir, size=6)
+        url = reverse('api_v1:lib-download', kwargs={'lib_id': str(data_library.pk), 'path': file.path})
+
+        def open_file(path, offset=0, length=None):
+            return File(io.BytesIO(b'foobar'[offset:offset + length]), name=file.name)
+
+        # single range
+        with mock.patch('app.utils.tests.TestProvider.open_file', side_effect=open_file) as p:
+            response = self.client.get(url, HTTP_RANGE='bytes=1-3')
+            p.assert_called_once_with(path=file.path, offset=1, length=3)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), b'oob')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 1-3/6')
+        self.assertEqual(response.headers['Content-Length'], '3')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+        # suffix range
+        with mock.patch('app.utils.tests.TestProvider.open_file', side_effect=open_file):
+            response = self.client.get(url, HTTP_RANGE='bytes=-2')
+        self.assertEqual(b''.join(response.streaming_content), b'ar')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 4-5/6')
+
+        # many ranges
+        with mock.patch('app.utils.tests.TestProvider.open_file', side_effect=open_file):
+            response = self.client.get(url, HTTP_RANGE='bytes=0-1,4-')
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        boundary = response.headers['Content-Type'].split('boundary=')[1]
+        self.assertEqual(content, (
+            f'--{boundary}\r\nContent-Type: {file.mimetype.name}\r\nContent-Range: bytes 0-1/6\r\n\r\nfo\r\n'
+            f'--{boundary}\r\nContent-Type: {file.mimetype.name}\r\nContent-Range: bytes 4-5/6\r\n\r\nar\r\n'
+            f'--{boundary}--\r\n'
+        ).encode())
+        self.assertEqual(response.headers['Content-Length'], str(len(content)))
+
+        # not satisfiable
+        response = self.client.get(url, HTTP_RANGE='bytes=6-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */6')
+
+        # invalid header and outdated If-Range are ignored
+        for headers in [{'HTTP_RANGE': 'bytes=3-1'}, {'HTTP_RANGE': 'bytes=0-1', 'HTTP_IF_RANGE': 'outdated'}]:
+            with mock.patch('app.utils.tests.TestProvider.open_file') as p:
+                p.return_value = File(io.BytesIO(b'foobar'), name=file.name)
+                response = self.client.get(url, **headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), b'foobar')
+
+        # actual If-Range
+        with mock.patch('app.utils.tests.TestProvider.open_file', side_effect=open_file):
+            if_range = http_date(file.updated_at.timestamp())
+            response = self.client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=if_range)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
 
 class ProviderTests(APITestCase):
     """Testing api and provider integration -- errors and exceptions."""
@@ -286,6 +1013,8 @@ class ProviderTests(APITestCase):
     def setUp(self) -> None:
         self.user = UserFactory()
         self.client.force_login(self.user)
+        # ids of nodes of previous tests are reused
+        path_cache.clear()
 
     def test_mkdir(self):
         """Test provider exceptions while creating directories."""
@@ -311,6 +1040,23 @@ class ProviderTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
         self.assertDictEqual(response.json(), {'detail': 'Something went wrong'})
 
+    def test_move_node(self):
+        """Test provider exceptions on move node, node stays in place."""
+        data_library = DataLibraryFactory(owner=self.user)
+        DirectoryFactory(parent=data_library.root_dir, name='foo')
+        file = FileFactory(parent=data_library.root_dir, name='bar.txt')
+        url = reverse('api_v1:lib-move', kwargs={'lib_id': str(data_library.pk), 'path': '/bar.txt'})
+
+        with mock.patch('app.utils.tests.TestProvider.move') as p:
+            p.side_effect = ProviderException('Something went wrong')
+            response = self.client.put(url, {'target_path': '/foo'}, format='json')
+            p.assert_called_once_with(path='/bar.txt', target_path='/foo')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, response.data)
+        file.refresh_from_db()
+        self.assertEqual(file.path, '/bar.txt')
+        self.assertEqual(file.parent_id, data_library.root_dir_id)
+
     def test_rename_node(self):
         """Test provider exceptions on rename node."""
         data_library = DataLibraryFactory(owner=self.user)
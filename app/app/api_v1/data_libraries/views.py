@@ -1,22 +1,33 @@
 # todo: make errors in one style maybe {"message": "error message"}
+import hashlib
 import typing
-from uuid import UUID
+import zipfile
+from uuid import UUID, uuid4
 
 from django.core.exceptions import SuspiciousFileOperation
 from django.core.files import File
-from django.db import transaction, models
-from django.db.models import Case, When
-from django.http import Http404, FileResponse
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, FileResponse, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
 from django.utils import timezone
-from django.utils.http import http_date
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import generics, permissions, exceptions, status
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
-from app.api_v1.data_libraries.serializers import data_library_serializers, node_serializers
+from app.api_v1.data_libraries.serializers import data_library_serializers, node_serializers, upload_serializers
+from app.api_v1.utils.pagination import KeysetPagination
+from app.api_v1.utils.ranges import ByteRange, RangeNotSatisfiable, parse_range_header
+from app.utils.http import content_disposition
+from storage.archive import ArchiveMember, stream_zip
 from storage.data_providers.utils import get_data_provider
-from storage.models import DataLibrary, Node
-from storage.utils import get_node_by_path, remove_node
+from storage.file_cache import file_cache
+from storage.models import DataLibrary, Node, UploadPart, UploadSession
+from storage.upload_handlers import HashingProviderFileUploadHandler
+from storage.utils import get_node_by_path, get_nodes_by_paths, remove_node
 
 
 class DataLibraryListCreateView(generics.ListCreateAPIView):
@@ -59,6 +70,11 @@ class DataLibraryNodeListView(generics.RetrieveAPIView):
     # todo: serializer_class for openApi
     serializer_class = data_library_serializers.DataLibrarySerializer
 
+    # "directory" < "file", so directories go first; (parent, name) is unique, so is (file_type, name) in directory
+    pagination = KeysetPagination(ordering=['file_type', 'name'])
+    # listings of the same node differ between views, so name of representation is a part of ETag
+    representation = 'files'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.library: typing.Optional[DataLibrary] = None
@@ -74,27 +90,130 @@ class DataLibraryNodeListView(generics.RetrieveAPIView):
         except Node.DoesNotExist as e:
             raise Http404(str(e))
 
-    @staticmethod
-    def get_child_nodes(parent_node: Node) -> typing.Iterable[Node]:
+    def get_child_nodes(self, parent_node: Node) -> typing.Tuple[typing.List[dict], typing.Optional[str]]:
         if parent_node.file_type == Node.FileTypeChoices.FILE:
-            return [parent_node]
+            return [node_serializers.NodeSerializer(parent_node).data], None
         else:
-            return parent_node.get_children().select_related('mimetype').annotate(
-                relevancy=Case(
-                    When(file_type=Node.FileTypeChoices.DIRECTORY, then=2),
-                    When(file_type=Node.FileTypeChoices.FILE, then=1),
-                    output_field=models.IntegerField()
-                )
-            ).order_by('-relevancy', 'name')
+            serializer_class = node_serializers.NodeValuesSerializer
+            rows, next_cursor = self.pagination.paginate_queryset(
+                serializer_class.get_rows(parent_node.get_children()),
+                self.request,
+                get_values=serializer_class.get_ordering_values,
+            )
+            return serializer_class.serialize(rows), next_cursor
+
+    def get_page_params(self) -> list:
+        """Normalized query params, that select page of listing."""
+        cursor = self.request.query_params.get(self.pagination.cursor_query_param)
+        return [
+            self.pagination.get_limit(self.request) or '',
+            self.pagination.encode_cursor(self.pagination.decode_cursor(cursor)) if cursor else '',
+        ]
+
+    def get_etag(self, current_node: Node) -> str:
+        """ETag of listing, changes with library, node or any of its descendants, page and representation."""
+        key = ':'.join(map(str, [
+            self.representation,
+            *self.get_page_params(),
+            self.library.pk,
+            self.library.name,
+            self.library.data_source_id,
+            current_node.pk,
+            current_node.name,
+            current_node.version,
+        ]))
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def get_listing_response(self, current_node: Node) -> HttpResponseBase:
+        child_nodes, next_cursor = self.get_child_nodes(current_node)
+
+        return Response({
+            'library': data_library_serializers.DataLibrarySerializer(self.library).data,
+            'current_node': node_serializers.NodeSerializer(current_node).data,
+            'nodes': child_nodes,
+            'next_cursor': next_cursor,
+        })
 
     def retrieve(self, request, *args, **kwargs):
         current_node = self.get_object()
-        child_nodes = self.get_child_nodes(current_node)
+        etag = self.get_etag(current_node)
+
+        # unchanged listing is answered before children are loaded
+        response = get_conditional_response(request, etag=etag) or self.get_listing_response(current_node)
+        response['ETag'] = etag
+        return response
+
+
+class DataLibraryNodeStreamView(DataLibraryNodeListView):
+    """
+    List of all nodes in library directory as streaming JSON.
+
+    Children are read with server-side cursor and serialized chunk by chunk, so memory does not depend on
+    directory size.
+    """
+    chunk_size = 2000
+    representation = 'stream'
+
+    def get_page_params(self) -> list:
+        # all children are streamed, pagination params are ignored
+        return []
+
+    def get_child_nodes_iterator(self, parent_node: Node) -> typing.Iterator[dict]:
+        if parent_node.file_type == Node.FileTypeChoices.FILE:
+            return iter([node_serializers.NodeSerializer(parent_node).data])
+
+        serializer_class = node_serializers.NodeValuesSerializer
+        queryset = serializer_class.get_rows(parent_node.get_children()).order_by(*self.pagination.ordering)
+        return map(serializer_class.to_representation, queryset.iterator(chunk_size=self.chunk_size))
+
+    def stream_json(self, current_node: Node) -> typing.Iterator[str]:
+        encoder = JSONEncoder()
+        library_data = data_library_serializers.DataLibrarySerializer(self.library).data
+        current_node_data = node_serializers.NodeSerializer(current_node).data
+        yield f'{{"library": {encoder.encode(library_data)}, "current_node": {encoder.encode(current_node_data)}, '
+        yield '"nodes": ['
+
+        chunk = []
+        for i, node_data in enumerate(self.get_child_nodes_iterator(current_node)):
+            if i:
+                chunk.append(',')
+            chunk.append(encoder.encode(node_data))
+            if len(chunk) >= self.chunk_size:
+                yield ''.join(chunk)
+                chunk = []
 
+        chunk.append(']}')
+        yield ''.join(chunk)
+
+    def get_listing_response(self, current_node: Node) -> HttpResponseBase:
+        return StreamingHttpResponse(self.stream_json(current_node), content_type='application/json')
+
+
+class DataLibraryNodeStatView(generics.GenericAPIView):
+    """Info about many nodes in library at once."""
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = node_serializers.NodeStatSerializer
+    lookup_url_kwarg = 'lib_id'
+
+    def get_queryset(self):
+        return DataLibrary.objects.filter(owner=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        library = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        nodes, missing = get_nodes_by_paths(
+            library=library,
+            paths=serializer.validated_data['paths'],
+            queryset=Node.objects.select_related('mimetype'),
+        )
         return Response({
-            'library': data_library_serializers.DataLibrarySerializer(self.library).data,
-            'current_node': node_serializers.NodeSerializer(current_node).data,
-            'nodes': node_serializers.NodeSerializer(child_nodes, many=True).data,
+            'nodes': {
+                path: node_serializers.NodeSerializer(node).data
+                for path, node in nodes.items()
+            },
+            'missing': missing,
         })
 
 
@@ -169,6 +288,10 @@ class NodeUploadFileView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     lookup_url_kwarg = 'lib_id'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_handler: typing.Optional[HashingProviderFileUploadHandler] = None
+
     def get_queryset(self):
         return DataLibrary.objects.filter(owner=self.request.user)
 
@@ -179,6 +302,21 @@ class NodeUploadFileView(generics.CreateAPIView):
         except DataLibrary.DoesNotExist as e:
             raise exceptions.NotFound(str(e))
 
+    def initialize_request(self, request, *args, **kwargs):
+        # body may be parsed as early as csrf check of authentication, so handler is installed before it
+        self.upload_handler = HashingProviderFileUploadHandler(
+            request=request,
+            library_id=self.kwargs[self.lookup_url_kwarg],
+            path=self.kwargs['path'],
+        )
+        request.upload_handlers.insert(0, self.upload_handler)
+        return super().initialize_request(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        # body is not parsed completely or node is not created, data written into provider is removed
+        self.upload_handler.abort()
+        return super().handle_exception(exc)
+
     def get_serializer_context(self):
         library = self.get_object()
         context = super().get_serializer_context()
@@ -189,6 +327,149 @@ class NodeUploadFileView(generics.CreateAPIView):
         return context
 
 
+class NodeBatchUploadView(generics.CreateAPIView):
+    """Upload many files to library at once, "paths" may place them into new subdirectories."""
+    serializer_class = node_serializers.NodeBatchUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_url_kwarg = 'lib_id'
+
+    def get_queryset(self):
+        return DataLibrary.objects.filter(owner=self.request.user).select_related('data_source')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update({
+            'library': self.get_object(),
+            'path': self.kwargs['path'],
+        })
+        return context
+
+
+class UploadNegotiationView(generics.CreateAPIView):
+    """
+    Send name, size and hash of files before their upload.
+
+    Files, whose content server already holds, are created without transfer, the rest must be uploaded.
+    """
+    serializer_class = upload_serializers.UploadNegotiationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_url_kwarg = 'lib_id'
+
+    def get_queryset(self):
+        return DataLibrary.objects.filter(owner=self.request.user).select_related('data_source')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update({
+            'library': self.get_object(),
+            'path': self.kwargs['path'],
+        })
+        return context
+
+
+class UploadSessionCreateView(generics.CreateAPIView):
+    """Start resumable upload of file into library directory."""
+    serializer_class = upload_serializers.UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_url_kwarg = 'lib_id'
+
+    def get_queryset(self):
+        return DataLibrary.objects.filter(owner=self.request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update({
+            'library': self.get_object(),
+            'path': self.kwargs['path'],
+        })
+        return context
+
+
+class UploadSessionView(generics.RetrieveDestroyAPIView):
+    """
+    State of resumable upload, upload of its parts and abort.
+
+    Part is sent with PATCH as raw request body, its offset is sent in "Upload-Offset" header. Offset must be
+    a multiple of chunk_size, parts may be sent in any order and in parallel.
+    """
+    serializer_class = upload_serializers.UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_url_kwarg = 'upload_id'
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(library__owner=self.request.user, library_id=self.kwargs['lib_id'])
+
+    @staticmethod
+    def get_offset(request, session: UploadSession) -> int:
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+        except (KeyError, ValueError):
+            raise exceptions.ParseError('Upload-Offset header is required')
+
+        if offset < 0 or offset % session.chunk_size or offset >= session.size:
+            raise exceptions.ParseError(f'Offset must be a multiple of {session.chunk_size} less than {session.size}')
+        return offset
+
+    def patch(self, request, *args, **kwargs):
+        session: UploadSession = self.get_object()
+        offset = self.get_offset(request, session)
+        number = offset // session.chunk_size + 1
+        part_size = session.get_part_size(number)
+
+        # part is read as raw body, it is not spooled by upload handlers
+        stream = request.stream
+        data = stream.read(part_size + 1) if stream is not None else b''
+        if len(data) != part_size:
+            raise exceptions.ParseError(f'Part {number} must be {part_size} bytes')
+
+        # session is kept alive while parts are uploaded, it may be just removed as stale one
+        if not UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now()):
+            raise exceptions.NotFound()
+
+        provider = get_data_provider(session.library)
+        try:
+            etag = provider.upload_part(
+                upload_id=session.provider_upload_id,
+                path=session.path or '/',
+                name=session.name,
+                number=number,
+                offset=offset,
+                data=data,
+            )
+        except SuspiciousFileOperation as e:
+            raise exceptions.ParseError(str(e))
+
+        UploadPart.objects.update_or_create(
+            session=session,
+            number=number,
+            defaults={'size': part_size, 'etag': etag},
+        )
+        return Response(self.get_serializer(session).data)
+
+    def perform_destroy(self, instance: UploadSession):
+        provider = get_data_provider(instance.library)
+        try:
+            provider.abort_upload(upload_id=instance.provider_upload_id, path=instance.path or '/', name=instance.name)
+        except SuspiciousFileOperation as e:
+            raise exceptions.ParseError(str(e))
+        instance.delete()
+
+
+class UploadSessionCompleteView(generics.CreateAPIView):
+    """Create file node from uploaded parts."""
+    serializer_class = upload_serializers.UploadSessionCompleteSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_url_kwarg = 'upload_id'
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(library__owner=self.request.user, library_id=self.kwargs['lib_id'])
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['session'] = self.get_object()
+        return context
+
+
 class DataLibraryMkdirView(generics.CreateAPIView):
     """Create directory in library."""
     serializer_class = node_serializers.MkDirectorySerializer
@@ -229,33 +510,219 @@ class DataLibraryRmFileView(generics.DestroyAPIView):
 
 class DataLibraryDownloadView(generics.RetrieveAPIView):
     lookup_url_kwarg = 'lib_id'
+    block_size = 64 * 1024
     permission_classes = [permissions.IsAuthenticated]
     queryset = Node.objects.none()
 
     def get_library(self, lib_id: UUID) -> DataLibrary:
         return DataLibrary.objects.get(owner=self.request.user, id=lib_id)
 
+    @staticmethod
+    def get_etag(node: Node) -> str:
+        """Strong ETag from content hash, weak one from node metadata if hash is unknown."""
+        if node.content_hash:
+            return quote_etag(node.content_hash)
+
+        key = ':'.join(map(str, [node.pk, node.size, node.updated_at.timestamp()]))
+        return f'W/{quote_etag(hashlib.md5(key.encode()).hexdigest())}'
+
+    def get_ranges(self, node: Node) -> typing.Optional[typing.List[ByteRange]]:
+        """Requested byte ranges, None if whole file must be sent."""
+        header = self.request.META.get('HTTP_RANGE')
+        if not header or not node.size:
+            return None
+
+        # If-Range with outdated validator means "send me the whole new file", weak ETags never match
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        validators = [http_date(node.updated_at.timestamp())]
+        if node.content_hash:
+            validators.append(quote_etag(node.content_hash))
+        if if_range is not None and if_range not in validators:
+            return None
+
+        return parse_range_header(header, node.size)
+
+    def stream_multipart(
+            self,
+            provider,
+            path: str,
+            ranges: typing.List[ByteRange],
+            boundary: str,
+            part_headers: typing.List[bytes],
+    ) -> typing.Iterator[bytes]:
+        for (start, end), part_header in zip(ranges, part_headers):
+            yield part_header
+            file = provider.open_file(path=path, offset=start, length=end - start + 1)
+            try:
+                yield from file.chunks(chunk_size=self.block_size)
+            finally:
+                file.close()
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode()
+
+    def get_multipart_response(
+            self,
+            provider,
+            path: str,
+            node: Node,
+            ranges: typing.List[ByteRange],
+            content_type: str,
+    ) -> StreamingHttpResponse:
+        boundary = uuid4().hex
+        part_headers = [
+            (
+                f'--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{node.size}\r\n\r\n'
+            ).encode()
+            for start, end in ranges
+        ]
+        content_length = sum(
+            len(part_header) + end - start + 1 + 2
+            for (start, end), part_header in zip(ranges, part_headers)
+        ) + len(f'--{boundary}--\r\n')
+
+        response = StreamingHttpResponse(
+            self.stream_multipart(provider, path, ranges, boundary, part_headers),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+        )
+        response['Content-Length'] = content_length
+        return response
+
     def retrieve(self, request, *args, **kwargs):
         path = self.kwargs['path']
 
         try:
             library = self.get_library(self.kwargs[self.lookup_url_kwarg])
-            provider = get_data_provider(library)
             node = get_node_by_path(
                 library=library,
                 path=path,
                 last_node_type=Node.FileTypeChoices.FILE
             )
-            file: File = provider.open_file(path=path)
         except (Node.DoesNotExist, DataLibrary.DoesNotExist) as e:
             raise exceptions.NotFound(str(e))
         except SuspiciousFileOperation as e:
             raise exceptions.ParseError(str(e))
 
-        content_type = node.mimetype and node.mimetype.name or 'application/octet-stream'
-        response = FileResponse(
-            file.open('rb'),
-            content_type=content_type,
-            headers={'Last-Modified': http_date(node.updated_at.timestamp())}
+        etag = self.get_etag(node)
+        last_modified = http_date(node.updated_at.timestamp())
+
+        # revalidation is answered from node row only, provider is not touched
+        response = get_conditional_response(request, etag=etag, last_modified=int(node.updated_at.timestamp()))
+        if response is not None:
+            response['ETag'] = etag
+            response['Last-Modified'] = last_modified
+            return response
+
+        provider = get_data_provider(library)
+        content_type = node.content_type
+
+        try:
+            response = provider.offload_download(path=path, node=node)
+        except SuspiciousFileOperation as e:
+            raise exceptions.ParseError(str(e))
+
+        if response is not None:
+            # web server or storage sends the file and handles Range itself
+            response['ETag'] = etag
+            response['Last-Modified'] = last_modified
+            return response
+
+        try:
+            ranges = self.get_ranges(node)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{node.size}'
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+        try:
+            if ranges is not None and len(ranges) > 1:
+                response = self.get_multipart_response(provider, path, node, ranges, content_type)
+            else:
+                # only requested bytes are read from provider (seek on disk, ranged GET on Minio)
+                start, end = ranges[0] if ranges else (0, node.size - 1)
+                length = end - start + 1
+                file: File = file_cache.open_file(provider, node, offset=start, length=length if ranges else None)
+                # file is already opened by provider and may be not seekable (remote streams)
+                response = FileResponse(file, content_type=content_type)
+                if ranges:
+                    response.status_code = status.HTTP_206_PARTIAL_CONTENT
+                    response['Content-Range'] = f'bytes {start}-{end}/{node.size}'
+                # FileResponse guesses length from file name, size of node (or range) is set explicitly
+                response['Content-Length'] = max(length, 0)
+        except SuspiciousFileOperation as e:
+            raise exceptions.ParseError(str(e))
+
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Accept-Ranges'] = 'bytes'
+        response.block_size = self.block_size
+        return response
+
+
+class DataLibraryArchiveView(generics.RetrieveAPIView):
+    """Download directory, its selected children or file as ZIP archive built on the fly."""
+    lookup_url_kwarg = 'lib_id'
+    block_size = 64 * 1024
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = node_serializers.NodeArchiveSerializer
+    queryset = Node.objects.none()
+    compression_methods = {
+        'store': zipfile.ZIP_STORED,
+        'deflate': zipfile.ZIP_DEFLATED,
+    }
+
+    def get_library(self, lib_id: UUID) -> DataLibrary:
+        return DataLibrary.objects.get(owner=self.request.user, id=lib_id)
+
+    @staticmethod
+    def get_members(node: Node, names: typing.Optional[typing.List[str]]) -> typing.Iterator[ArchiveMember]:
+        """Whole subtree of node in one query, parents go before their children."""
+        if node.is_directory:
+            queryset = node.get_descendants()
+            if names:
+                condition = Q()
+                for name in names:
+                    condition |= Q(path=f'{node.path}/{name}') | Q(path__startswith=f'{node.path}/{name}/')
+                queryset = queryset.filter(condition)
+            base_path_length = len(node.path) + 1
+        else:
+            queryset = Node.objects.filter(pk=node.pk)
+            base_path_length = len(node.path) - len(node.name)
+
+        rows = queryset.order_by('path').values_list('path', 'file_type', 'size', 'updated_at')
+        for path, file_type, size, updated_at in rows.iterator():
+            yield ArchiveMember(
+                name=path[base_path_length:],
+                is_directory=file_type == Node.FileTypeChoices.DIRECTORY,
+                size=size,
+                modified=updated_at,
+                path=path,
+            )
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            library = self.get_library(self.kwargs[self.lookup_url_kwarg])
+            node = get_node_by_path(library=library, path=self.kwargs['path'])
+        except (Node.DoesNotExist, DataLibrary.DoesNotExist) as e:
+            raise exceptions.NotFound(str(e))
+        except SuspiciousFileOperation as e:
+            raise exceptions.ParseError(str(e))
+
+        provider = get_data_provider(library)
+        archive = stream_zip(
+            members=self.get_members(node, serializer.validated_data.get('names')),
+            open_file=lambda path: provider.open_file(path=path),
+            compression=self.compression_methods[serializer.validated_data['compression']],
+            chunk_size=self.block_size,
         )
+
+        filename = f'{node.name or library.name}.zip'
+        response = StreamingHttpResponse(archive, content_type='application/zip')
+        response['Content-Disposition'] = content_disposition(filename, disposition='attachment')
         return response
@@ -0,0 +1,58 @@
+import timeit
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from app.api_v1.data_libraries.serializers.node_serializers import NodeSerializer, NodeValuesSerializer
+from storage.models import Node, Mimetype
+
+
+class Command(BaseCommand):
+    help = 'Compare NodeSerializer and NodeValuesSerializer on directory listing. Test data is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Number of nodes in directory')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs, best one is reported')
+
+    @staticmethod
+    def create_directory(count: int) -> Node:
+        directory = Node.add_root(name='', file_type=Node.FileTypeChoices.DIRECTORY)
+        mimetype, _ = Mimetype.objects.get_or_create(name='image/jpeg')
+        Node.objects.bulk_create([
+            Node(
+                parent=directory,
+                root=directory,
+                name=f'{i:08}.jpg',
+                path=f'/{i:08}.jpg',
+                file_type=Node.FileTypeChoices.FILE,
+                mimetype=mimetype,
+                size=i,
+                total_size=i,
+                file_count=1,
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        return directory
+
+    def handle(self, *args, count: int, repeat: int, **options):
+        with transaction.atomic():
+            directory = self.create_directory(count)
+            queryset = directory.get_children().order_by('file_type', 'name')
+
+            def serialize_models():
+                return NodeSerializer(queryset.select_related('mimetype'), many=True).data
+
+            def serialize_values():
+                return NodeValuesSerializer.serialize(NodeValuesSerializer.get_rows(queryset))
+
+            assert list(map(dict, serialize_models())) == serialize_values()
+
+            models_time = min(timeit.repeat(serialize_models, number=1, repeat=repeat))
+            values_time = min(timeit.repeat(serialize_values, number=1, repeat=repeat))
+
+            self.stdout.write(f'Nodes: {count}')
+            self.stdout.write(f'NodeSerializer: {models_time:.3f}s')
+            self.stdout.write(f'NodeValuesSerializer: {values_time:.3f}s')
+            self.stdout.write(f'Speedup: {models_time / values_time:.1f}x')
+
+            transaction.set_rollback(True)
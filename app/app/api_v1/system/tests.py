@@ -1,7 +1,7 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
-from accounts.factories import UserFactory
+from accounts.factories import UserFactory, SuperuserFactory
 
 
 class SystemTests(APITestCase):
@@ -23,3 +23,17 @@ class SystemTests(APITestCase):
         self.client.logout()
         response = self.client.get(url)
         self.assertEqual(response.status_code, 403)
+
+    def test_cache_stats(self):
+        """Ensure admins can get cache stats."""
+        url = reverse('api_v1:sys-cache-stats')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(SuperuserFactory())
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertSetEqual(set(response.json()['path_cache']), {'size', 'max_size', 'hits', 'misses', 'hit_ratio'})
+        self.assertSetEqual(set(response.json()['file_cache']), {
+            'enabled', 'size', 'max_size', 'hits', 'misses', 'hit_ratio', 'bytes_served',
+        })
@@ -3,6 +3,8 @@ from rest_framework import generics, permissions, response, views
 
 from accounts.models import User
 from app.api_v1.system.serializers import CurrentUserSerializer
+from storage.file_cache import file_cache
+from storage.path_cache import path_cache
 
 
 class CurrentUserView(generics.RetrieveAPIView):
@@ -23,3 +25,15 @@ class ApiIndex(views.APIView):
         return response.Response([
             {'url': reverse('api_v1:lib-list')},
         ])
+
+
+class CacheStatsView(views.APIView):
+    """Hit/miss counters of storage caches in current process."""
+    permission_classes = [permissions.IsAdminUser]
+
+    @staticmethod
+    def get(request):
+        return response.Response({
+            'path_cache': path_cache.stats(),
+            'file_cache': file_cache.stats(),
+        })
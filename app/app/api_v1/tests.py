@@ -1,9 +1,13 @@
+from io import StringIO
+
 from django.contrib import auth
+from django.core.management import call_command
 from django.urls import reverse
 from django.test import TestCase
 from rest_framework import status
 
 from accounts.factories import UserFactory
+from storage.models import Node
 
 
 class AuthTests(TestCase):
@@ -30,3 +34,12 @@ class AuthTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
         user = auth.get_user(self.client)
         self.assertFalse(user.is_authenticated)
+
+
+class CommandsTests(TestCase):
+    def test_benchmark_node_listing(self):
+        """Ensure listing benchmark runs and leaves no data behind."""
+        out = StringIO()
+        call_command('benchmark_node_listing', count=10, repeat=1, stdout=out)
+        self.assertIn('Speedup', out.getvalue())
+        self.assertFalse(Node.objects.exists())
@@ -10,16 +10,42 @@ urlpatterns = [
     path('', sys_views.ApiIndex.as_view(), name='index'),
     path('auth/', include(api_urls)),
     path('sys/current_user', sys_views.CurrentUserView.as_view(), name='sys-cuser'),
+    path('sys/cache_stats', sys_views.CacheStatsView.as_view(), name='sys-cache-stats'),
     path('dp', dp_views.DataProviderList.as_view(), name='dp-list'),
     path('ds', ds_views.DataSourceListCreateView.as_view(), name='ds-list'),
     path('ds/<int:pk>', ds_views.DataSourceDetailView.as_view(), name='ds-detail'),
     path('lib', dl_views.DataLibraryListCreateView.as_view(), name='lib-list'),
     path('lib/<uuid:lib_id>', dl_views.DataLibraryDetailUpdateView.as_view(), name='lib-detail'),
     path('lib/<uuid:lib_id>/files<path:path>', dl_views.DataLibraryNodeListView.as_view(), name='lib-files'),
+    path('lib/<uuid:lib_id>/stream<path:path>', dl_views.DataLibraryNodeStreamView.as_view(), name='lib-files-stream'),
+    path('lib/<uuid:lib_id>/stat', dl_views.DataLibraryNodeStatView.as_view(), name='lib-stat'),
     path('lib/<uuid:lib_id>/move<path:path>', dl_views.DataLibraryNodeMoveView.as_view(), name='lib-move'),
     path('lib/<uuid:lib_id>/rename<path:path>', dl_views.DataLibraryNodeRenameView.as_view(), name='lib-rename'),
+    # upload session and batch routes go first, "upload<path>" matches them too
+    path('lib/<uuid:lib_id>/upload_batch<path:path>', dl_views.NodeBatchUploadView.as_view(), name='lib-upload-batch'),
+    path(
+        'lib/<uuid:lib_id>/upload_negotiate<path:path>',
+        dl_views.UploadNegotiationView.as_view(),
+        name='lib-upload-negotiate',
+    ),
+    path(
+        'lib/<uuid:lib_id>/upload_sessions/<uuid:upload_id>/complete',
+        dl_views.UploadSessionCompleteView.as_view(),
+        name='lib-upload-session-complete',
+    ),
+    path(
+        'lib/<uuid:lib_id>/upload_sessions/<uuid:upload_id>',
+        dl_views.UploadSessionView.as_view(),
+        name='lib-upload-session',
+    ),
+    path(
+        'lib/<uuid:lib_id>/upload_sessions<path:path>',
+        dl_views.UploadSessionCreateView.as_view(),
+        name='lib-upload-session-create',
+    ),
     path('lib/<uuid:lib_id>/upload<path:path>', dl_views.NodeUploadFileView.as_view(), name='lib-upload'),
     path('lib/<uuid:lib_id>/mkdir<path:path>', dl_views.DataLibraryMkdirView.as_view(), name='lib-mkdir'),
     path('lib/<uuid:lib_id>/rm<path:path>', dl_views.DataLibraryRmFileView.as_view(), name='lib-rm'),
     path('lib/<uuid:lib_id>/download<path:path>', dl_views.DataLibraryDownloadView.as_view(), name='lib-download'),
+    path('lib/<uuid:lib_id>/archive<path:path>', dl_views.DataLibraryArchiveView.as_view(), name='lib-archive'),
 ]
@@ -0,0 +1,97 @@
+import base64
+import binascii
+import json
+import typing
+
+from django.db.models import Q, QuerySet
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+
+class KeysetPagination:
+    """
+    Cursor pagination on unique set of ordering fields.
+
+    Next page is selected with "(field1, field2) > (value1, value2)" condition instead of OFFSET,
+    so every page costs the same index range scan regardless of its position.
+    """
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    max_limit = 1000
+
+    def __init__(self, ordering: typing.Sequence[str]):
+        self.ordering = ordering
+
+    @staticmethod
+    def encode_cursor(values: typing.Sequence) -> str:
+        return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+    def decode_cursor(self, cursor: str) -> list:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, ValueError):
+            raise exceptions.ParseError('Invalid cursor')
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise exceptions.ParseError('Invalid cursor')
+        # values are compared with columns, objects or lists would fail in SQL
+        if any(isinstance(value, bool) or not isinstance(value, (str, int)) for value in values):
+            raise exceptions.ParseError('Invalid cursor')
+        return values
+
+    def get_limit(self, request: Request) -> typing.Optional[int]:
+        limit = request.query_params.get(self.limit_query_param)
+        if limit is None:
+            return None
+
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise exceptions.ParseError('Invalid limit')
+
+        if not 0 < limit <= self.max_limit:
+            raise exceptions.ParseError(f'Limit must be between 1 and {self.max_limit}')
+        return limit
+
+    def filter_after(self, queryset: QuerySet, values: typing.Sequence) -> QuerySet:
+        """Rows after values in self.ordering order."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            equal_fields = {f: v for f, v in zip(self.ordering[:i], values[:i])}
+            condition |= Q(**equal_fields, **{f'{field}__gt': values[i]})
+        return queryset.filter(condition)
+
+    def paginate_queryset(
+            self,
+            queryset: QuerySet,
+            request: Request,
+            get_values: typing.Optional[typing.Callable[[typing.Any], typing.Sequence]] = None,
+    ) -> typing.Tuple[list, typing.Optional[str]]:
+        """
+        Get page of queryset.
+
+        :param queryset: queryset to paginate
+        :param request: request with optional limit and cursor query params
+        :param get_values: optional, gets values of ordering fields from item (for values_list querysets)
+        :return: list of page items and cursor of next page (None if it is last page or limit is not set)
+        """
+        if get_values is None:
+            def get_values(item):
+                return [getattr(item, field) for field in self.ordering]
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = self.filter_after(queryset, self.decode_cursor(cursor))
+
+        limit = self.get_limit(request)
+        if limit is None:
+            return list(queryset), None
+
+        items = list(queryset[:limit + 1])
+        if len(items) <= limit:
+            return items, None
+
+        items = items[:limit]
+        last = items[-1]
+        return items, self.encode_cursor(get_values(last))
@@ -0,0 +1,57 @@
+import typing
+
+ByteRange = typing.Tuple[int, int]
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header: str, size: int, max_ranges: int = 32) -> typing.Optional[typing.List[ByteRange]]:
+    """
+    Parse "Range" request header (RFC 7233).
+
+    "bytes=0-99" -> [(0, 99)]
+    "bytes=-100" -> [(size - 100, size - 1)]
+    "bytes=100-" -> [(100, size - 1)]
+
+    :param header: value of Range header
+    :param size: size of requested file
+    :param max_ranges: header with more ranges is ignored
+    :return: list of (first byte, last byte) pairs or None if header is invalid and should be ignored
+    :exception RangeNotSatisfiable: no range overlaps file
+    """
+    unit, _, ranges_spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    specs = [spec.strip() for spec in ranges_spec.split(',')]
+    if not specs or len(specs) > max_ranges:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.partition('-')
+        start, end = start.strip(), end.strip()
+        if not sep or not start + end or not all(value.isdigit() for value in [start, end] if value):
+            return None
+
+        if not start:
+            # suffix range: last N bytes
+            length = int(end)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+
+        start = int(start)
+        if end and int(end) < start:
+            return None
+        if start >= size:
+            continue
+        end = int(end) if end else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 
     'accounts',
     'storage',
+    'app.api_v1',
 ]
 
 MIDDLEWARE = [
@@ -137,6 +138,31 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Storage
+# Resolved paths cache: max entries in process memory, optional Django cache alias shared between processes
+# and lifetime of entries in seconds
+STORAGE_PATH_CACHE_SIZE = 10000
+STORAGE_PATH_CACHE_ALIAS = None
+STORAGE_PATH_CACHE_TIMEOUT = 300
+
+# Local disk cache of remote provider files: directory (None disables cache), size budget and max file size in bytes
+STORAGE_FILE_CACHE_DIR = None
+STORAGE_FILE_CACHE_SIZE = 1024 ** 3
+STORAGE_FILE_CACHE_MAX_FILE_SIZE = 64 * 1024 ** 2
+
+# Resumable uploads: part size (providers may require larger one) and number of parts clients may send at once
+STORAGE_UPLOAD_CHUNK_SIZE = 8 * 1024 ** 2
+STORAGE_UPLOAD_MAX_PARALLEL_PARTS = 4
+# Largest file, that may be uploaded by parts (S3 limit of object size)
+STORAGE_UPLOAD_MAX_SIZE = 5 * 1024 ** 4
+
+# Content hash of uploaded files is computed while request body is received
+FILE_UPLOAD_HANDLERS = [
+    'storage.upload_handlers.HashingMemoryFileUploadHandler',
+    'storage.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+
+
 # Debug toolbar
 ENABLE_DEBUG_TOOLBAR = DEBUG and not TESTING
 if ENABLE_DEBUG_TOOLBAR:
@@ -0,0 +1,14 @@
+from urllib.parse import quote
+
+
+def content_disposition(filename: str, disposition: str = 'inline') -> str:
+    """
+    Content-Disposition header value (RFC 6266).
+
+    Printable ASCII names are sent as quoted strings with quotes and backslashes escaped, other names are
+    percent-encoded (RFC 5987).
+    """
+    if filename.isascii() and filename.isprintable():
+        escaped = filename.replace('\\', '\\\\').replace('"', r'\"')
+        return f'{disposition}; filename="{escaped}"'
+    return f"{disposition}; filename*=utf-8''{quote(filename, safe='')}"
@@ -1,3 +1,4 @@
+import typing
 from pathlib import Path
 
 from django.core.files.storage import Storage
@@ -21,7 +22,19 @@ class TestProvider(BaseProvider):
     def upload_file(self, path: str, uploaded_file: UploadedFile):
         pass
 
-    def open_file(self, path: str) -> Path:
+    def open_file(self, path: str, offset: int = 0, length: typing.Optional[int] = None) -> Path:
+        pass
+
+    def create_upload(self, path: str, name: str, size: int) -> str:
+        return 'upload'
+
+    def upload_part(self, upload_id: str, path: str, name: str, number: int, offset: int, data: bytes) -> str:
+        return ''
+
+    def complete_upload(self, upload_id: str, path: str, name: str, parts: typing.List[typing.Tuple[int, str]]) -> str:
+        return ''
+
+    def abort_upload(self, upload_id: str, path: str, name: str):
         pass
 
     def mkdir(self, target_path: str):
@@ -33,5 +46,8 @@ class TestProvider(BaseProvider):
     def rename(self, path: str, name: str):
         pass
 
+    def move(self, path: str, target_path: str):
+        pass
+
 
 provider_registry.register(TestProvider)
@@ -5,7 +5,7 @@ from django.forms import ModelForm, ChoiceField
 
 from storage.data_providers.base import provider_registry
 from storage.data_providers.utils import get_data_provider, get_data_provider_class
-from storage.models import DataLibrary, DataSource, DataSourceOption, Node, Mimetype
+from storage.models import Blob, DataLibrary, DataSource, DataSourceOption, Node, Mimetype
 
 
 admin.site.register(Mimetype)
@@ -104,3 +104,9 @@ class NodeAdmin(admin.ModelAdmin):
     @admin.display(description='Name')
     def name_str(self, instance):
         return instance.name or '<no name>'
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ['hash', 'data_source', 'size', 'refcount']
+    list_filter = ['data_source']
@@ -8,7 +8,9 @@ class StorageConfig(AppConfig):
     def ready(self):
         # todo: move to settings
         from storage.data_providers.base import provider_registry
+        from storage.data_providers.blob_storage import BlobStorageProvider
         from storage.data_providers.file_storage import FileSystemStorageProvider
         from storage.data_providers.minio_storage import MinioStorageProvider
         provider_registry.register(FileSystemStorageProvider)
         provider_registry.register(MinioStorageProvider)
+        provider_registry.register(BlobStorageProvider)
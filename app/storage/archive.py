@@ -0,0 +1,92 @@
+import io
+import typing
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.core.files import File
+
+
+@dataclass
+class ArchiveMember:
+    name: str
+    is_directory: bool
+    size: int
+    modified: datetime
+    path: str
+
+
+class ZipStreamBuffer(io.RawIOBase):
+    """
+    Write-only unseekable stream, that keeps written data until it is taken.
+
+    ZipFile writes to unseekable streams with data descriptors after each member, so archive is built
+    without knowing member sizes and without going back.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: typing.List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(
+        members: typing.Iterable[ArchiveMember],
+        open_file: typing.Callable[[str], File],
+        compression: int = zipfile.ZIP_STORED,
+        chunk_size: int = 64 * 1024,
+) -> typing.Iterator[bytes]:
+    """
+    Build ZIP archive on the fly.
+
+    Files are opened one by one when archive reaches them and read by chunks, so memory does not depend on
+    archive size.
+
+    :param members: files and directories in archive order
+    :param open_file: opens member by its path
+    :param compression: zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+    :param chunk_size: read size of member files
+    """
+    buffer = ZipStreamBuffer()
+
+    with zipfile.ZipFile(buffer, mode='w', compression=compression) as archive:
+        for member in members:
+            modified = member.modified.timetuple()[:6]
+
+            if member.is_directory:
+                info = zipfile.ZipInfo(f'{member.name}/', date_time=modified)
+                info.external_attr = 0o40775 << 16 | 0x10
+                archive.writestr(info, b'')
+            else:
+                info = zipfile.ZipInfo(member.name, date_time=modified)
+                info.external_attr = 0o644 << 16
+                info.compress_type = compression
+                # zip64 extra fields are written in advance for large files
+                info.file_size = member.size
+
+                file = open_file(member.path)
+                try:
+                    with archive.open(info, mode='w') as target:
+                        for chunk in file.chunks(chunk_size=chunk_size):
+                            target.write(chunk)
+                            data = buffer.take()
+                            if data:
+                                yield data
+                finally:
+                    file.close()
+
+            yield buffer.take()
+
+    # central directory
+    yield buffer.take()
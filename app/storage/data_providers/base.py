@@ -4,12 +4,29 @@ from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.uploadedfile import UploadedFile
 from django.forms import forms
+from django.http import HttpResponse
 
-from storage.models import DataLibrary
+from storage.data_providers.exceptions import FileExistsException, ProviderException
+from storage.models import DataLibrary, Node
+
+
+class UploadWriter:
+    """Stream of uploaded file into provider, file appears in library only after complete()."""
+
+    def write(self, data: bytes):
+        raise NotImplementedError
+
+    def complete(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
 
 
 class BaseProvider:
     validation_class: forms.Form = forms.Form
+    # files are worth caching on local disk (remote storages)
+    use_file_cache = False
 
     @property
     def provider_id(self) -> str:
@@ -48,7 +65,106 @@ class BaseProvider:
     def upload_file(self, path: str, uploaded_file: UploadedFile):
         raise NotImplementedError
 
-    def open_file(self, path: str) -> File:
+    def open_file(self, path: str, offset: int = 0, length: typing.Optional[int] = None) -> File:
+        """
+        Open file for reading.
+
+        :param path: path to file in library
+        :param offset: first byte to read
+        :param length: optional, number of bytes to read (till the end of file by default)
+        """
+        raise NotImplementedError
+
+    def offload_download(self, path: str, node: Node) -> typing.Optional[HttpResponse]:
+        """
+        Response, that hands file transfer over to web server or storage.
+
+        :param path: path to file in library
+        :param node: file node
+        :return: response or None, if file must be sent by Django
+        """
+        return None
+
+    def open_upload_writer(self, path: str, name: str, size: typing.Optional[int] = None) -> UploadWriter:
+        """
+        Start upload of file, that is written by chunks as they are received.
+
+        :param path: path of target directory in library
+        :param name: name of file
+        :param size: expected size of file or its upper bound, if it is known
+        """
+        raise NotImplementedError
+
+    # minimal size of upload part (except the last one)
+    min_upload_chunk_size = 1
+
+    def create_upload(self, path: str, name: str, size: int) -> str:
+        """
+        Start resumable upload of file.
+
+        :param path: path of target directory in library
+        :param name: name of file
+        :param size: size of file in bytes
+        :return: id of upload in provider
+        """
+        raise NotImplementedError
+
+    def upload_part(self, upload_id: str, path: str, name: str, number: int, offset: int, data: bytes) -> str:
+        """
+        Store part of resumable upload, parts may be uploaded in any order and in parallel.
+
+        :return: part id in provider (etag) or empty string
+        """
+        raise NotImplementedError
+
+    def complete_upload(self, upload_id: str, path: str, name: str, parts: typing.List[typing.Tuple[int, str]]) -> str:
+        """
+        Place uploaded file into library.
+
+        :param parts: (number, etag) of all parts in order
+        :return: SHA-256 hex digest of content or empty string, if storage can not compute it without transfer
+        """
+        raise NotImplementedError
+
+    def abort_upload(self, upload_id: str, path: str, name: str):
+        raise NotImplementedError
+
+    def link_file(self, path: str, name: str, content_hash: str, size: int) -> bool:
+        """
+        Create file from content, that is already stored, without transfer of data.
+
+        Content is looked for among files of library, file node is created by caller.
+
+        :param path: path of target directory in library
+        :param name: name of file
+        :param content_hash: SHA-256 hex digest of content
+        :param size: size of content in bytes
+        :return: False if there is no such content or it can not be copied cheaply
+        :exception FileExistsException -- target file already exists in storage
+        """
+        target_path = f'{path.rstrip("/")}/{name}'
+        source_path = Node.objects.filter(
+            root_id=self.library.root_dir_id,
+            file_type=Node.FileTypeChoices.FILE,
+            content_hash=content_hash,
+            size=size,
+        ).exclude(
+            path=target_path,
+        ).values_list('path', flat=True).first()
+
+        if source_path is None:
+            return False
+
+        try:
+            self.copy_file(source_path=source_path, target_path=target_path)
+        except FileExistsException:
+            raise
+        except (NotImplementedError, ProviderException):
+            return False
+        return True
+
+    def copy_file(self, source_path: str, target_path: str):
+        """Copy file inside library, only if storage does it without transfer of data."""
         raise NotImplementedError
 
     def mkdir(self, target_path: str):
@@ -60,6 +176,16 @@ class BaseProvider:
     def rename(self, path: str, name: str):
         raise NotImplementedError
 
+    def move(self, path: str, target_path: str):
+        """
+        Move file or directory into another directory.
+
+        :param path: path of file or directory in library
+        :param target_path: path of target directory in library
+        :exception FileExistsException -- target directory already has node with the same name
+        """
+        raise NotImplementedError
+
 
 class ProviderRegister:
     TypeBaseProvider = typing.Type[BaseProvider]
@@ -0,0 +1,216 @@
+import io
+import os
+import re
+import tempfile
+import typing
+from pathlib import Path
+
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import F
+
+from storage.data_providers.base import UploadWriter
+from storage.data_providers.exceptions import FileExistsException, ProviderException
+from storage.data_providers.file_storage import FileSystemStorageProvider, hash_file, place_file
+from storage.data_providers.streams import LimitedStream
+from storage.models import Blob, DataLibrary, Node
+from storage.upload_handlers import get_content_hasher
+from storage.utils import adapt_path
+
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def get_blob_path(blobs_directory: Path, content_hash: str) -> Path:
+    """Blobs are sharded by first bytes of hash: "ab/cd/abcd..."."""
+    if not HASH_RE.match(content_hash):
+        raise ProviderException('Suspicious operation')
+    return blobs_directory / content_hash[:2] / content_hash[2:4] / content_hash
+
+
+class BlobUploadWriter(UploadWriter):
+    """Writes chunks into temporary file and hashes them, content becomes blob on completion."""
+
+    def __init__(self, provider: 'BlobStorageProvider', path: str):
+        self.provider = provider
+        self.path = path
+        self.hasher = get_content_hasher()
+        self.size = 0
+        self.file = tempfile.NamedTemporaryFile(dir=provider.tmp_directory, prefix='upload-', delete=False)
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.hasher.update(data)
+        self.size += len(data)
+
+    def complete(self):
+        self.file.close()
+        self.provider.link_blob(
+            path=self.path,
+            content_hash=self.hasher.hexdigest(),
+            size=self.size,
+            tmp_path=self.file.name,
+        )
+
+    def abort(self):
+        self.file.close()
+        Path(self.file.name).unlink(missing_ok=True)
+
+
+class BlobStorageProvider(FileSystemStorageProvider):
+    """
+    Disk storage, that keeps every file content once per data source.
+
+    Content is stored under its SHA-256 hash in "data/blobs/ab/cd/<hash>", nodes reference it by
+    Node.content_hash. Directories exist only in database, so mkdir, rename and rm do not touch the disk and
+    duplicate uploads do not take space. Unreferenced blobs are removed by "collect_blobs" command.
+    """
+    provider_id = 'BlobStorage'
+    verbose_name = 'Deduplicated Disk Storage'
+
+    @property
+    def blobs_directory(self) -> Path:
+        return self.data_directory / 'blobs'
+
+    def init_provider(self):
+        super().init_provider()
+        self.blobs_directory.mkdir(exist_ok=True)
+
+    def init_library(self):
+        pass
+
+    def get_content_hash(self, path: str) -> str:
+        content_hash = Node.objects.filter(
+            root_id=self.library.root_dir_id,
+            path=adapt_path(path),
+            file_type=Node.FileTypeChoices.FILE,
+        ).values_list('content_hash', flat=True).first()
+
+        if not content_hash:
+            raise ProviderException('file does not exist')
+        return content_hash
+
+    def get_real_path(self, path: str) -> Path:
+        return get_blob_path(self.blobs_directory, self.get_content_hash(path))
+
+    def _link_node(self, path: str, content_hash: str):
+        Node.objects.filter(
+            root_id=self.library.root_dir_id,
+            path=adapt_path(path),
+        ).update(content_hash=content_hash)
+
+    def link_blob(self, path: str, content_hash: str, size: int, tmp_path: str):
+        """
+        Reference blob with content of temporary file from file node at path.
+
+        File is moved into blob store if there is no such blob yet. Row of blob is locked, so blob is not
+        collected while it is referenced again.
+        """
+        blob_path = get_blob_path(self.blobs_directory, content_hash)
+
+        with transaction.atomic():
+            blob, _ = Blob.objects.select_for_update().get_or_create(
+                data_source_id=self.library.data_source_id,
+                hash=content_hash,
+                defaults={'size': size},
+            )
+            if blob_path.exists():
+                os.unlink(tmp_path)
+            else:
+                blob_path.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    # temporary directory is on the same disk, so file is moved without copying
+                    place_file(tmp_path, blob_path, fsync=self.fsync)
+                except FileExistsException:
+                    # the same content is placed by another upload
+                    os.unlink(tmp_path)
+            Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+            self._link_node(path, content_hash)
+
+    def link_existing_blob(self, path: str, content_hash: str) -> bool:
+        """Reference stored blob from file node at path without any data transfer, False if there is no such blob."""
+        with transaction.atomic():
+            found = Blob.objects.filter(
+                data_source_id=self.library.data_source_id,
+                hash=content_hash,
+            ).update(refcount=F('refcount') + 1)
+            if found:
+                self._link_node(path, content_hash)
+        return bool(found)
+
+    def upload_file(self, path: str, uploaded_file: UploadedFile):
+        path = f'{adapt_path(path)}/{uploaded_file.name}'
+        # hash is computed by upload handler, content of duplicate is not written at all
+        content_hash = getattr(uploaded_file, 'content_hash', '')
+        if content_hash and self.link_existing_blob(path=path, content_hash=content_hash):
+            return
+
+        writer = BlobUploadWriter(provider=self, path=path)
+        try:
+            for chunk in uploaded_file.chunks():
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.complete()
+
+    def open_file(self, path: str, offset: int = 0, length: typing.Optional[int] = None) -> File:
+        try:
+            file = open(self.get_real_path(path), 'rb')
+        except FileNotFoundError:
+            raise ProviderException('file does not exist')
+
+        if offset:
+            file.seek(offset)
+        if length is not None:
+            file = io.BufferedReader(LimitedStream(file, length))
+        return File(file, name=Path(path).name)
+
+    def open_upload_writer(self, path: str, name: str, size: typing.Optional[int] = None) -> UploadWriter:
+        return BlobUploadWriter(provider=self, path=f'{adapt_path(path)}/{name}')
+
+    def complete_upload(self, upload_id: str, path: str, name: str, parts: typing.List[typing.Tuple[int, str]]) -> str:
+        upload_path = self._get_upload_path(upload_id)
+        content_hash = hash_file(upload_path)
+
+        self.link_blob(
+            path=f'{adapt_path(path)}/{name}',
+            content_hash=content_hash,
+            size=upload_path.stat().st_size,
+            tmp_path=str(upload_path),
+        )
+        return content_hash
+
+    def link_file(self, path: str, name: str, content_hash: str, size: int) -> bool:
+        """
+        Content is shared by all libraries of data source, but only content of owner's files is linked.
+
+        Otherwise anyone, who knows hash of a file, could get it.
+        """
+        is_owned = Node.objects.filter(
+            root_id__in=DataLibrary.objects.filter(
+                owner_id=self.library.owner_id,
+                data_source_id=self.library.data_source_id,
+            ).values('root_dir_id'),
+            file_type=Node.FileTypeChoices.FILE,
+            content_hash=content_hash,
+            size=size,
+        ).exists()
+        return is_owned and self.link_existing_blob(path=f'{adapt_path(path)}/{name}', content_hash=content_hash)
+
+    def copy_file(self, source_path: str, target_path: str):
+        if not self.link_existing_blob(path=target_path, content_hash=self.get_content_hash(source_path)):
+            raise ProviderException('file does not exist')
+
+    def mkdir(self, target_path: str):
+        pass
+
+    def rm(self, path: str):
+        """Blob is released with its node."""
+        pass
+
+    def rename(self, path: str, name: str):
+        pass
+
+    def move(self, path: str, target_path: str):
+        pass
@@ -3,3 +3,8 @@ from django.core.exceptions import SuspiciousFileOperation
 
 class ProviderException(SuspiciousFileOperation):
     pass
+
+
+class FileExistsException(ProviderException):
+    """Target file already exists in storage."""
+    pass
@@ -1,15 +1,114 @@
+import errno
+import io
+import os
+import shutil
+import tempfile
+import time
+import typing
 from pathlib import Path
+from urllib.parse import quote
+from uuid import uuid4
 
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import UploadedFile
 from django.forms import forms, fields
+from django.http import HttpResponse
 
 from app.utils.models import get_field
-from storage.data_providers.base import BaseProvider
-from storage.data_providers.exceptions import ProviderException
-from storage.models import DataLibrary, DataSourceOption
+from storage.data_providers.base import BaseProvider, UploadWriter
+from storage.data_providers.exceptions import FileExistsException, ProviderException
+from storage.data_providers.streams import LimitedStream
+from storage.models import DataLibrary, DataSourceOption, Node
+from storage.upload_handlers import get_content_hasher
+
+
+class DownloadOffloadChoices:
+    DISABLED = ''
+    X_ACCEL_REDIRECT = 'x-accel-redirect'
+    X_SENDFILE = 'x-sendfile'
+
+    choices = [
+        (DISABLED, 'Disabled'),
+        (X_ACCEL_REDIRECT, 'X-Accel-Redirect (nginx)'),
+        (X_SENDFILE, 'X-Sendfile (apache, lighttpd)'),
+    ]
+
+
+class FsyncChoices:
+    DISABLED = ''
+    FILE = 'file'
+    FILE_AND_DIRECTORY = 'file+dir'
+
+    choices = [
+        (DISABLED, 'Disabled'),
+        (FILE, 'File'),
+        (FILE_AND_DIRECTORY, 'File and directory'),
+    ]
+
+
+def fsync_path(path: typing.Union[str, Path]):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def hash_file(path: typing.Union[str, Path]) -> str:
+    """SHA-256 hex digest of file on disk."""
+    hasher = get_content_hasher()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(File.DEFAULT_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# errors of os.link on filesystems without hard links (some SMB and FUSE mounts, exFAT) or across disks
+LINK_UNSUPPORTED_ERRORS = {errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EXDEV}
+
+
+def place_file(tmp_path: str, target_path: Path, fsync: str = FsyncChoices.DISABLED):
+    """
+    Move fully written temporary file into target path, existing file is never overwritten.
+
+    File is hard linked into target path and then unlinked from temporary directory. Link is atomic and fails if
+    target exists, so readers see either no file or the whole file, and crash never leaves partial file in place.
+    Temporary file must be on the same disk. With fsync data reaches disk before file appears, with directory
+    fsync the new directory entry survives power loss too.
+
+    If filesystem does not support hard links, target path is reserved by exclusive creation of empty file, that
+    is replaced by temporary file: existing file is still never overwritten, but readers may see empty file
+    for a moment.
+
+    :exception ProviderException -- target file exists
+    """
+    if fsync != FsyncChoices.DISABLED:
+        fsync_path(tmp_path)
+
+    try:
+        os.link(tmp_path, target_path)
+    except FileExistsError:
+        raise FileExistsException('file already exists')
+    except OSError as e:
+        if e.errno not in LINK_UNSUPPORTED_ERRORS:
+            raise
+        try:
+            os.close(os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            raise FileExistsException('file already exists')
+        try:
+            # copied if temporary file is on another disk
+            shutil.move(tmp_path, target_path)
+        except BaseException:
+            target_path.unlink(missing_ok=True)
+            raise
+    else:
+        os.unlink(tmp_path)
+
+    if fsync == FsyncChoices.FILE_AND_DIRECTORY:
+        fsync_path(target_path.parent)
 
 
 class FileStorageForm(forms.Form):
@@ -19,6 +118,24 @@ class FileStorageForm(forms.Form):
         label='Root directory',
         help_text='Root directory on server. Must exist',
     )
+    download_offload = fields.ChoiceField(
+        required=False,
+        choices=DownloadOffloadChoices.choices,
+        label='Download offload',
+        help_text='Let web server send files, Django only checks permissions',
+    )
+    download_location = fields.CharField(
+        required=False,
+        max_length=get_field(DataSourceOption, 'value').max_length,
+        label='Download location',
+        help_text='Internal nginx location, that points to "data" directory in root directory. Example: /protected/',
+    )
+    fsync = fields.ChoiceField(
+        required=False,
+        choices=FsyncChoices.choices,
+        label='Fsync',
+        help_text='Flush uploaded files to disk before they are reported as uploaded. Safer, but slower',
+    )
 
     def clean(self):
         root_directory = self.cleaned_data.get('root_directory', None)
@@ -26,9 +143,40 @@ class FileStorageForm(forms.Form):
             root_directory = Path(root_directory)
             if not root_directory.exists() or not root_directory.is_dir():
                 raise ValidationError({'root_directory': f'"{root_directory}" is not directory or does not exist'})
+
+        download_offload = self.cleaned_data.get('download_offload')
+        download_location = self.cleaned_data.get('download_location')
+        if download_offload == DownloadOffloadChoices.X_ACCEL_REDIRECT and not download_location:
+            raise ValidationError({'download_location': 'Location is required for X-Accel-Redirect'})
         return self.cleaned_data
 
 
+class FileUploadWriter(UploadWriter):
+    """Appends chunks to temporary file, that is renamed to target path on completion."""
+
+    def __init__(self, tmp_directory: Path, target_path: Path, fsync: str = FsyncChoices.DISABLED):
+        self.target_path = target_path
+        self.fsync = fsync
+        self.file = tempfile.NamedTemporaryFile(dir=tmp_directory, prefix='upload-', delete=False)
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def complete(self):
+        self.file.close()
+        try:
+            self.target_path.parent.mkdir(parents=True, exist_ok=True)
+            # temporary directory is on the same disk, so file is moved without copying
+            place_file(self.file.name, self.target_path, fsync=self.fsync)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        self.file.close()
+        Path(self.file.name).unlink(missing_ok=True)
+
+
 class FileSystemStorageProvider(BaseProvider):
     provider_id = 'FileStorage'
     verbose_name = 'Disk File Storage'
@@ -36,6 +184,9 @@ class FileSystemStorageProvider(BaseProvider):
 
     def __init__(self, library: DataLibrary, options: dict):
         self.root_directory = Path(options['root_directory'])
+        self.download_offload = options.get('download_offload', DownloadOffloadChoices.DISABLED)
+        self.download_location = options.get('download_location', '')
+        self.fsync = options.get('fsync', FsyncChoices.DISABLED)
         super().__init__(library=library, options=options)
 
     @property
@@ -46,6 +197,10 @@ class FileSystemStorageProvider(BaseProvider):
     def tmp_directory(self) -> Path:
         return self.root_directory / 'tmp'
 
+    @property
+    def uploads_directory(self) -> Path:
+        return self.tmp_directory / 'uploads'
+
     def init_provider(self):
         self.root_directory.mkdir(exist_ok=True)
         self.tmp_directory.mkdir(exist_ok=True)
@@ -67,23 +222,139 @@ class FileSystemStorageProvider(BaseProvider):
         return FileSystemStorage(location=self.root_directory / self._get_relative_user_data_directory())
 
     def upload_file(self, path: str, uploaded_file: UploadedFile) -> str:
+        """File is written into temporary directory and renamed into place, readers never see partial file."""
+        path_name = Path(self._path_to_rel_path(path)) / uploaded_file.name
+        writer = self.open_upload_writer(path=path, name=uploaded_file.name)
+        try:
+            for chunk in uploaded_file.chunks():
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.complete()
+        return str(path_name)
+
+    def open_file(self, path: str, offset: int = 0, length: typing.Optional[int] = None) -> File:
         path = self._path_to_rel_path(path)
-        storage = self.get_user_storage()
-        path_name = Path(path) / uploaded_file.name
-
-        if storage.exists(path_name):
-            raise ProviderException('file already exists')
 
-        return storage.save(path_name, content=uploaded_file)
+        if not path:
+            raise ProviderException('Suspicious operation')
 
-    def open_file(self, path: str) -> File:
+        storage = self.get_user_storage()
+        file = storage.open(path)
+        if offset:
+            file.seek(offset)
+        if length is not None:
+            file = File(io.BufferedReader(LimitedStream(file.file, length)), name=Path(file.name).name)
+        return file
+
+    def get_real_path(self, path: str) -> Path:
+        """Path of file on disk."""
         path = self._path_to_rel_path(path)
 
         if not path:
             raise ProviderException('Suspicious operation')
 
+        return Path(self.get_user_storage().path(path))
+
+    def offload_download(self, path: str, node: Node) -> typing.Optional[HttpResponse]:
+        if self.download_offload == DownloadOffloadChoices.DISABLED:
+            return None
+
+        real_path = self.get_real_path(path)
+        response = HttpResponse(content_type=node.content_type)
+
+        if self.download_offload == DownloadOffloadChoices.X_ACCEL_REDIRECT:
+            location = self.download_location.rstrip('/')
+            relative_path = real_path.relative_to(os.path.abspath(self.data_directory)).as_posix()
+            response['X-Accel-Redirect'] = quote(f'{location}/{relative_path}')
+        else:
+            response['X-Sendfile'] = str(real_path)
+        return response
+
+    def open_upload_writer(self, path: str, name: str, size: typing.Optional[int] = None) -> UploadWriter:
         storage = self.get_user_storage()
-        return storage.open(path)
+        target_path = Path(storage.path(Path(self._path_to_rel_path(path)) / name))
+
+        if target_path.exists():
+            raise FileExistsException('file already exists')
+
+        return FileUploadWriter(tmp_directory=self.tmp_directory, target_path=target_path, fsync=self.fsync)
+
+    def _get_upload_path(self, upload_id: str) -> Path:
+        if not upload_id.isalnum():
+            raise ProviderException('Suspicious operation')
+        return self.uploads_directory / upload_id
+
+    def create_upload(self, path: str, name: str, size: int) -> str:
+        """Parts are written into preallocated temporary file at their offsets."""
+        upload_id = uuid4().hex
+        self.uploads_directory.mkdir(parents=True, exist_ok=True)
+        upload_path = self._get_upload_path(upload_id)
+        try:
+            with open(upload_path, 'xb') as f:
+                f.truncate(size)
+        except OSError as e:
+            upload_path.unlink(missing_ok=True)
+            raise ProviderException(f'Can not create upload: {e.strerror}')
+        return upload_id
+
+    def upload_part(self, upload_id: str, path: str, name: str, number: int, offset: int, data: bytes) -> str:
+        with open(self._get_upload_path(upload_id), 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+        return ''
+
+    def complete_upload(self, upload_id: str, path: str, name: str, parts: typing.List[typing.Tuple[int, str]]) -> str:
+        storage = self.get_user_storage()
+        target_path = Path(storage.path(Path(self._path_to_rel_path(path)) / name))
+        upload_path = self._get_upload_path(upload_id)
+        # parts are written in any order, so content is hashed when file is complete
+        content_hash = hash_file(upload_path)
+
+        # temporary directory is on the same disk, so file is moved without copying
+        place_file(str(upload_path), target_path, fsync=self.fsync)
+        return content_hash
+
+    def abort_upload(self, upload_id: str, path: str, name: str):
+        self._get_upload_path(upload_id).unlink(missing_ok=True)
+
+    def sweep_tmp_files(self, max_age: int, upload_ids: typing.Collection[str] = ()) -> int:
+        """
+        Remove temporary files left by interrupted writes.
+
+        :param max_age: files modified earlier than max_age seconds ago are removed
+        :param upload_ids: ids of resumable uploads in progress, their files are kept
+        :return: number of removed files
+        """
+        deadline = time.time() - max_age
+        tmp_files = [
+            *self.tmp_directory.glob('upload-*'),
+            *(path for path in self.uploads_directory.glob('*') if path.name not in upload_ids),
+        ]
+
+        removed = 0
+        for path in tmp_files:
+            try:
+                if path.is_file() and path.stat().st_mtime < deadline:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def copy_file(self, source_path: str, target_path: str):
+        """Files are never changed in place, so copy is a hard link to the same data."""
+        source_path = self.get_real_path(source_path)
+        target_path = self.get_real_path(target_path)
+
+        if target_path.exists():
+            raise FileExistsException('file already exists')
+
+        try:
+            os.link(source_path, target_path)
+        except OSError as e:
+            raise ProviderException(f'Can not link file: {e.strerror}')
 
     def mkdir(self, target_path: str):
         relative_path = self._path_to_rel_path(target_path)
@@ -122,3 +393,21 @@ class FileSystemStorageProvider(BaseProvider):
             raise ProviderException('Suspicious operation')
 
         real_path.rename(new_path)
+
+    def move(self, path: str, target_path: str):
+        path = self._path_to_rel_path(path)
+
+        if not path:
+            raise ProviderException('Suspicious operation')
+
+        storage = self.get_user_storage()
+        real_path = Path(storage.path(path))
+        new_path = Path(storage.path(Path(self._path_to_rel_path(target_path)) / real_path.name))
+
+        if new_path.exists():
+            raise FileExistsException('file already exists')
+
+        try:
+            real_path.rename(new_path)
+        except OSError as e:
+            raise ProviderException(f'Can not move file: {e.strerror}')
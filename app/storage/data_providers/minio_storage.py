@@ -1,4 +1,9 @@
+import inspect
 import io
+import time
+import typing
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import timedelta
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 
@@ -6,18 +11,117 @@ from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.uploadedfile import UploadedFile
 from django.forms import forms, fields
+from django.http import HttpResponse, HttpResponseRedirect
 from minio import Minio, S3Error
-from urllib3.exceptions import RequestError
+from minio.commonconfig import CopySource
+from minio.datatypes import Part
+from minio.error import ServerError
+from urllib3 import HTTPResponse
+from urllib3.exceptions import HTTPError, RequestError
 
+from app.utils.http import content_disposition
 from app.utils.models import get_field
-from storage.data_providers.base import BaseProvider
+from storage.data_providers.base import BaseProvider, UploadWriter
 from storage.data_providers.exceptions import ProviderException
-from storage.models import DataLibrary, DataSourceOption
+from storage.models import DataLibrary, DataSourceOption, Node
+
+
+class ObjectStream(io.RawIOBase):
+    """
+    Read-only stream over object response.
+
+    Data is read from the connection on demand, connection is released back to the pool on close.
+    """
+
+    def __init__(self, response: HTTPResponse):
+        super().__init__()
+        self.response = response
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.response.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.response.close()
+            self.response.release_conn()
+        super().close()
+
+
+class MultipartClient:
+    """
+    Multipart upload calls of minio client.
+
+    Minio has no public API for parts of multipart upload, so private methods of client are used. They are
+    called only here, minio version is pinned and expected signatures are checked by tests.
+    """
+    signatures = {
+        '_create_multipart_upload': ['bucket_name', 'object_name', 'headers'],
+        '_upload_part': ['bucket_name', 'object_name', 'data', 'headers', 'upload_id', 'part_number'],
+        '_complete_multipart_upload': ['bucket_name', 'object_name', 'upload_id', 'parts'],
+        '_abort_multipart_upload': ['bucket_name', 'object_name', 'upload_id'],
+    }
+
+    def __init__(self, client: Minio):
+        self.client = client
+
+    @classmethod
+    def get_incompatible_methods(cls) -> typing.List[str]:
+        """Private methods of installed minio, whose parameters differ from expected ones."""
+        incompatible = []
+        for name, parameters in cls.signatures.items():
+            method = getattr(Minio, name, None)
+            if method is None or list(inspect.signature(method).parameters)[1:] != parameters:
+                incompatible.append(name)
+        return incompatible
+
+    def create(self, bucket_name: str, object_name: str) -> str:
+        return self.client._create_multipart_upload(bucket_name=bucket_name, object_name=object_name, headers={})
+
+    def upload_part(self, bucket_name: str, object_name: str, upload_id: str, number: int, data: bytes) -> str:
+        return self.client._upload_part(
+            bucket_name=bucket_name,
+            object_name=object_name,
+            data=data,
+            headers=None,
+            upload_id=upload_id,
+            part_number=number,
+        )
+
+    def complete(self, bucket_name: str, object_name: str, upload_id: str, parts: typing.List[typing.Tuple[int, str]]):
+        self.client._complete_multipart_upload(
+            bucket_name=bucket_name,
+            object_name=object_name,
+            upload_id=upload_id,
+            parts=[Part(number, etag) for number, etag in parts],
+        )
+
+    def abort(self, bucket_name: str, object_name: str, upload_id: str):
+        self.client._abort_multipart_upload(bucket_name=bucket_name, object_name=object_name, upload_id=upload_id)
 
 
 class MinioStorage:
-    def __init__(self, client_options: dict):
+    chunk_size = 256 * 1024
+    # S3 limits of multipart upload
+    min_upload_part_size = 5 * 1024 * 1024
+    max_upload_parts = 10000
+    default_upload_part_size = 16 * 1024 * 1024
+    default_upload_concurrency = 4
+
+    def __init__(
+            self,
+            client_options: dict,
+            upload_part_size: typing.Optional[int] = None,
+            upload_concurrency: typing.Optional[int] = None,
+    ):
         self.client = Minio(**client_options)
+        self.multipart = MultipartClient(self.client)
+        self.upload_part_size = upload_part_size or self.default_upload_part_size
+        self.upload_concurrency = upload_concurrency or self.default_upload_concurrency
 
     def bucket_exists(self, bucket_name) -> bool:
         return self.client.bucket_exists(bucket_name)
@@ -26,22 +130,95 @@ class MinioStorage:
         return self.client.make_bucket(bucket_name)
 
     def upload(self, bucket_name: str, path: str, file: UploadedFile):
-        self.client.put_object(
+        object_name = str(Path(path) / file.name)
+        if file.size <= self.upload_part_size:
+            self.client.put_object(
+                bucket_name=bucket_name,
+                object_name=object_name,
+                data=file,
+                length=file.size,
+            )
+            return
+
+        writer = MinioUploadWriter(storage=self, bucket_name=bucket_name, path=object_name, size=file.size)
+        try:
+            file.seek(0)
+            # UploadedFile.chunks() ignores chunk size for files kept in memory
+            for data in iter(lambda: file.read(writer.part_size), b''):
+                writer.write(data)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.complete()
+
+    def get_part_size(self, size: int) -> int:
+        """Configured part size, increased for files that would not fit into S3 parts limit."""
+        return max(self.upload_part_size, -(-size // self.max_upload_parts))
+
+    def get_object(self, bucket_name: str, path: str, offset: int = 0, length: typing.Optional[int] = None) -> File:
+        """Get object (or its byte range with offset and length) as stream."""
+        resp = self.client.get_object(bucket_name=bucket_name, object_name=path, offset=offset, length=length or 0)
+        stream = io.BufferedReader(ObjectStream(resp), buffer_size=self.chunk_size)
+        return File(file=stream, name=Path(path).name)
+
+    def get_presigned_url(
+            self,
+            bucket_name: str,
+            path: str,
+            expires: timedelta,
+            response_headers: typing.Optional[dict] = None,
+    ) -> str:
+        """Temporary url to download object, it is signed locally if client region is set."""
+        return self.client.presigned_get_object(
             bucket_name=bucket_name,
-            object_name=str(Path(path) / file.name),
-            data=file,
-            length=file.size,
+            object_name=path,
+            expires=expires,
+            response_headers=response_headers,
         )
 
-    def get_object(self, bucket_name: str, path: str) -> File:
-        resp = self.client.get_object(bucket_name=bucket_name, object_name=path)
-        return File(file=io.BytesIO(resp.read()), name=Path(path).name)
+    def create_multipart_upload(self, bucket_name: str, path: str) -> str:
+        return self.multipart.create(bucket_name=bucket_name, object_name=path)
+
+    def upload_part(self, bucket_name: str, path: str, upload_id: str, number: int, data: bytes) -> str:
+        return self.multipart.upload_part(
+            bucket_name=bucket_name,
+            object_name=path,
+            upload_id=upload_id,
+            number=number,
+            data=data,
+        )
+
+    def complete_multipart_upload(
+            self,
+            bucket_name: str,
+            path: str,
+            upload_id: str,
+            parts: typing.List[typing.Tuple[int, str]],
+    ):
+        if not parts:
+            # S3 does not complete uploads without parts, empty object is put instead
+            self.multipart.abort(bucket_name=bucket_name, object_name=path, upload_id=upload_id)
+            self.client.put_object(bucket_name=bucket_name, object_name=path, data=io.BytesIO(), length=0)
+            return
+
+        self.multipart.complete(bucket_name=bucket_name, object_name=path, upload_id=upload_id, parts=parts)
+
+    def abort_multipart_upload(self, bucket_name: str, path: str, upload_id: str):
+        self.multipart.abort(bucket_name=bucket_name, object_name=path, upload_id=upload_id)
 
     def remove(self, bucket_name: str, path: str):
         """Remove object or directory."""
         # remove_object is always success even if path does not exist
         self.client.remove_object(bucket_name=bucket_name, object_name=path)
 
+    def copy(self, bucket_name: str, source_path: str, target_path: str):
+        """Server-side copy of object, data is not sent through application."""
+        self.client.copy_object(
+            bucket_name=bucket_name,
+            object_name=target_path.lstrip('/'),
+            source=CopySource(bucket_name=bucket_name, object_name=source_path.lstrip('/')),
+        )
+
     def move(self, bucket_name: str, source_path: str, target_path: str):
         """
         Move file or directory into target path.
@@ -54,6 +231,10 @@ class MinioStorage:
             target_path += '/'
 
         for item in self.client.list_objects(bucket_name=bucket_name, prefix=source_path, recursive=True):
+            object_name = str(item.object_name)
+            if object_name != source_path and not object_name.startswith(f'{source_path.rstrip("/")}/'):
+                # prefix also matches neighbours with longer names ("foo" and "foobar")
+                continue
             with NamedTemporaryFile() as f:
                 self.client.fget_object(bucket_name=bucket_name, object_name=item.object_name, file_path=f.name)
                 self.client.remove_object(bucket_name=bucket_name, object_name=item.object_name)
@@ -61,6 +242,122 @@ class MinioStorage:
                 self.client.fput_object(bucket_name=bucket_name, object_name=item_target, file_path=f.name)
 
 
+def is_transient_error(error: Exception) -> bool:
+    """Errors, after which request may succeed if it is repeated (server errors and lost connections)."""
+    if isinstance(error, (ServerError, HTTPError)):
+        return True
+    if isinstance(error, S3Error):
+        return error.code in ['InternalError', 'RequestTimeout', 'ServiceUnavailable', 'SlowDown'] or (
+            error.response is not None and error.response.status >= 500
+        )
+    return False
+
+
+class MinioUploadWriter(UploadWriter):
+    """
+    Streams chunks into object with multipart upload, parts are sent as soon as they are filled.
+
+    Parts are uploaded concurrently on bounded thread pool, no more than upload_concurrency parts are kept
+    in memory at once. Part, that failed with transient error, is retried, the whole upload is aborted if it
+    fails anyway. Files smaller than one part are put with single request.
+    """
+    upload_part_retries = 3
+    upload_retry_delay = 1
+
+    def __init__(self, storage: MinioStorage, bucket_name: str, path: str, size: typing.Optional[int] = None):
+        """
+        :param size: expected size of file (or its upper bound), part size is increased for large files
+        """
+        self.storage = storage
+        self.bucket_name = bucket_name
+        self.path = path
+        self.part_size = storage.get_part_size(size or 0)
+        self.buffer = bytearray()
+        self.upload_id: typing.Optional[str] = None
+        self.part_count = 0
+        self.parts: typing.Dict[int, str] = {}
+        self.executor: typing.Optional[ThreadPoolExecutor] = None
+        self.pending: typing.Dict[Future, int] = {}
+
+    def upload_part_with_retries(self, number: int, data: bytes) -> str:
+        for attempt in range(self.upload_part_retries):
+            try:
+                return self.storage.upload_part(
+                    bucket_name=self.bucket_name,
+                    path=self.path,
+                    upload_id=self.upload_id,
+                    number=number,
+                    data=data,
+                )
+            except Exception as e:
+                if not is_transient_error(e) or attempt == self.upload_part_retries - 1:
+                    raise
+                time.sleep(self.upload_retry_delay * 2 ** attempt)
+
+    def _collect(self, return_when: str):
+        """Wait for pending parts, error of any part is raised."""
+        done, _ = wait(self.pending, return_when=return_when)
+        for future in done:
+            self.parts[self.pending.pop(future)] = future.result()
+
+    def _upload_part(self, data: bytes):
+        if self.upload_id is None:
+            self.upload_id = self.storage.create_multipart_upload(bucket_name=self.bucket_name, path=self.path)
+            self.executor = ThreadPoolExecutor(max_workers=self.storage.upload_concurrency)
+
+        if self.part_count >= self.storage.max_upload_parts:
+            raise ProviderException('File is too large')
+
+        if len(self.pending) >= self.storage.upload_concurrency:
+            self._collect(return_when=FIRST_COMPLETED)
+
+        self.part_count += 1
+        self.pending[self.executor.submit(self.upload_part_with_retries, self.part_count, data)] = self.part_count
+
+    def write(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def complete(self):
+        if self.upload_id is None:
+            self.storage.client.put_object(
+                bucket_name=self.bucket_name,
+                object_name=self.path,
+                data=io.BytesIO(self.buffer),
+                length=len(self.buffer),
+            )
+            return
+
+        try:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self._collect(return_when=ALL_COMPLETED)
+            self.executor.shutdown()
+            self.storage.complete_multipart_upload(
+                bucket_name=self.bucket_name,
+                path=self.path,
+                upload_id=self.upload_id,
+                parts=sorted(self.parts.items()),
+            )
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        self.buffer.clear()
+        if self.upload_id is None:
+            return
+
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown()
+        self.pending.clear()
+        self.storage.abort_multipart_upload(bucket_name=self.bucket_name, path=self.path, upload_id=self.upload_id)
+        self.upload_id = None
+
+
 class MinioValidationForm(forms.Form):
     endpoint = fields.CharField(
         label='Endpoint',
@@ -83,21 +380,77 @@ class MinioValidationForm(forms.Form):
         required=False,
         help_text='If should use secure protocol (https)',
     )
+    region = fields.CharField(
+        label='Region',
+        required=False,
+        max_length=get_field(DataSourceOption, 'value').max_length,
+        help_text='Region of buckets. Required for presigned download: urls are signed without request to server',
+    )
+    presigned_download = fields.BooleanField(
+        label='Presigned download',
+        required=False,
+        help_text='Redirect downloads to temporary object url instead of sending files through server',
+    )
+    upload_part_size = fields.IntegerField(
+        label='Upload part size',
+        required=False,
+        min_value=MinioStorage.min_upload_part_size,
+        help_text='Large files are uploaded by parts of this size in bytes, 16 MiB by default',
+    )
+    upload_concurrency = fields.IntegerField(
+        label='Upload concurrency',
+        required=False,
+        min_value=1,
+        max_value=64,
+        help_text='Number of parts of one file uploaded at once, 4 by default',
+    )
+    presigned_download_expires = fields.IntegerField(
+        label='Presigned download expiration',
+        required=False,
+        min_value=1,
+        max_value=7 * 24 * 60 * 60,
+        help_text='Lifetime of presigned url in seconds, 300 by default',
+    )
+
+    def clean(self):
+        if self.cleaned_data.get('presigned_download') and not self.cleaned_data.get('region'):
+            # otherwise region of bucket is requested from server on every download
+            raise ValidationError({'region': 'Region is required for presigned download'})
+        return self.cleaned_data
 
 
 class MinioStorageProvider(BaseProvider):
     provider_id = 'MinioStorage'
     verbose_name = 'Minio Storage'
     validation_class = MinioValidationForm
+    use_file_cache = True
+    client_option_names = ['endpoint', 'access_key', 'secret_key', 'secure', 'region']
+    default_presigned_download_expires = 300
 
     def __init__(self, library: DataLibrary, options: dict):
         super().__init__(library=library, options=options)
-        self.storage = MinioStorage(client_options=self.transform_options(options))
+        options = self.transform_options(options)
+        self.presigned_download = options['presigned_download']
+        self.presigned_download_expires = timedelta(
+            seconds=options['presigned_download_expires'] or self.default_presigned_download_expires,
+        )
+        self.storage = MinioStorage(
+            client_options=self.get_client_options(options),
+            upload_part_size=options['upload_part_size'],
+            upload_concurrency=options['upload_concurrency'],
+        )
+
+    @classmethod
+    def get_client_options(cls, options: dict) -> dict:
+        """Minio client arguments from cleaned options."""
+        client_options = {key: options[key] for key in cls.client_option_names}
+        client_options['region'] = client_options['region'] or None
+        return client_options
 
     @classmethod
     def validate_options(cls, options: dict):
         options = super().validate_options(options=options)
-        storage = MinioStorage(client_options=options)
+        storage = MinioStorage(client_options=cls.get_client_options(options))
         # todo: custom http_client ?
         storage.client._http.connection_pool_kw['retries'].total = 1
         try:
@@ -117,14 +470,90 @@ class MinioStorageProvider(BaseProvider):
         path = path.lstrip('/')
         self.storage.upload(bucket_name=self.get_user_bucket(), path=path, file=uploaded_file)
 
-    def open_file(self, path: str) -> File:
+    def open_file(self, path: str, offset: int = 0, length: typing.Optional[int] = None) -> File:
         if not path or path == '/':
             raise ProviderException('Suspicious operation')
 
         return self.storage.get_object(
             bucket_name=self.get_user_bucket(),
             path=path,
+            offset=offset,
+            length=length,
+        )
+
+    def offload_download(self, path: str, node: Node) -> typing.Optional[HttpResponse]:
+        if not self.presigned_download:
+            return None
+
+        if not path or path == '/':
+            raise ProviderException('Suspicious operation')
+
+        url = self.storage.get_presigned_url(
+            bucket_name=self.get_user_bucket(),
+            path=path.lstrip('/'),
+            expires=self.presigned_download_expires,
+            response_headers={
+                'response-content-type': node.content_type,
+                'response-content-disposition': content_disposition(node.name),
+            },
         )
+        return HttpResponseRedirect(url)
+
+    min_upload_chunk_size = MinioStorage.min_upload_part_size
+
+    @staticmethod
+    def _get_object_name(path: str, name: str) -> str:
+        return str(Path(path.lstrip('/')) / name)
+
+    def open_upload_writer(self, path: str, name: str, size: typing.Optional[int] = None) -> UploadWriter:
+        return MinioUploadWriter(
+            storage=self.storage,
+            bucket_name=self.get_user_bucket(),
+            path=self._get_object_name(path, name),
+            size=size,
+        )
+
+    def create_upload(self, path: str, name: str, size: int) -> str:
+        return self.storage.create_multipart_upload(
+            bucket_name=self.get_user_bucket(),
+            path=self._get_object_name(path, name),
+        )
+
+    def upload_part(self, upload_id: str, path: str, name: str, number: int, offset: int, data: bytes) -> str:
+        return self.storage.upload_part(
+            bucket_name=self.get_user_bucket(),
+            path=self._get_object_name(path, name),
+            upload_id=upload_id,
+            number=number,
+            data=data,
+        )
+
+    def complete_upload(self, upload_id: str, path: str, name: str, parts: typing.List[typing.Tuple[int, str]]) -> str:
+        self.storage.complete_multipart_upload(
+            bucket_name=self.get_user_bucket(),
+            path=self._get_object_name(path, name),
+            upload_id=upload_id,
+            parts=parts,
+        )
+        # object is not read back, hash is computed later by "hash_node_contents" command
+        return ''
+
+    def abort_upload(self, upload_id: str, path: str, name: str):
+        self.storage.abort_multipart_upload(
+            bucket_name=self.get_user_bucket(),
+            path=self._get_object_name(path, name),
+            upload_id=upload_id,
+        )
+
+    def copy_file(self, source_path: str, target_path: str):
+        if not source_path or not target_path:
+            raise ProviderException('Suspicious operation')
+
+        try:
+            self.storage.copy(bucket_name=self.get_user_bucket(), source_path=source_path, target_path=target_path)
+        except (S3Error, ValueError) as e:
+            # objects larger than 5 GiB can not be copied at once
+            raise ProviderException(f'Can not copy file: {e}')
 
     def mkdir(self, target_path: str):
         """S3 does not have file-system like directories, so let's not create them."""
@@ -144,3 +573,16 @@ class MinioStorageProvider(BaseProvider):
         target_path = str(Path(path).parent / name)
 
         self.storage.move(bucket_name=bucket_name, source_path=path, target_path=target_path)
+
+    def move(self, path: str, target_path: str):
+        if not path or path == '/':
+            raise ProviderException('Suspicious operation')
+
+        try:
+            self.storage.move(
+                bucket_name=self.get_user_bucket(),
+                source_path=path,
+                target_path=f'{target_path.rstrip("/")}/{Path(path).name}',
+            )
+        except S3Error as e:
+            raise ProviderException(f'Can not move file: {e}')
@@ -0,0 +1,28 @@
+import io
+import typing
+
+
+class LimitedStream(io.RawIOBase):
+    """Read-only stream, that reads no more than length bytes from underlying file."""
+
+    def __init__(self, file: typing.BinaryIO, length: int):
+        super().__init__()
+        self.file = file
+        self.remaining = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.remaining <= 0:
+            return 0
+
+        data = self.file.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
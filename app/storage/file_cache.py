@@ -0,0 +1,247 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import typing
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from storage.data_providers.base import BaseProvider
+from storage.data_providers.streams import LimitedStream
+from storage.models import Node
+
+
+class CacheFillStream(io.RawIOBase):
+    """
+    Read-only stream, that copies everything read from source into temporary file.
+
+    Temporary file becomes cache entry on close if source was read to the end, otherwise it is dropped.
+    """
+
+    def __init__(self, source: File, size: int, on_complete: typing.Callable[[str], None], directory: Path):
+        super().__init__()
+        self.source = source
+        self.size = size
+        self.on_complete = on_complete
+        self.written = 0
+        self.tmp_file = tempfile.NamedTemporaryFile(dir=directory, prefix='.tmp-', delete=False)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.source.read(len(buffer))
+        buffer[:len(data)] = data
+        self.tmp_file.write(data)
+        self.written += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.source.close()
+            self.tmp_file.close()
+            if self.written == self.size:
+                self.on_complete(self.tmp_file.name)
+            else:
+                os.unlink(self.tmp_file.name)
+        super().close()
+
+
+class FileCache:
+    """
+    Read-through cache of provider files on local disk with LRU eviction.
+
+    Entries are stored as "<directory>/<library_id>/<node path>/<version>", version changes with file content,
+    so outdated entries are never served. Entries of renamed or removed nodes are dropped with invalidate().
+    Last use time of entry is its mtime, it is shared between processes.
+    """
+    # temporary files of interrupted cache fills are removed by evict() after this time (seconds)
+    tmp_max_age = 60 * 60
+    # evict() frees space down to this part of max_size, so cache directory is not walked on every added entry
+    low_water_mark = 0.9
+
+    def __init__(self, directory: typing.Optional[str], max_size: int, max_file_size: int):
+        self.directory = Path(directory) if directory else None
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self._size: typing.Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    @staticmethod
+    def get_version(node: Node) -> str:
+        return node.content_hash or f'{node.updated_at.timestamp():.6f}-{node.size}'
+
+    def _get_node_directory(self, library_id, path: str) -> typing.Optional[Path]:
+        library_directory = self.directory / str(library_id)
+        node_directory = Path(os.path.normpath(library_directory / path.lstrip('/')))
+        if node_directory == library_directory or library_directory not in node_directory.parents:
+            return None
+        return node_directory
+
+    def _add_entry(self, entry_path: Path, tmp_path: str):
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, entry_path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            over_budget = self._size is None or self._size > self.max_size
+        if over_budget:
+            self.evict()
+
+    def open_file(
+            self,
+            provider: BaseProvider,
+            node: Node,
+            offset: int = 0,
+            length: typing.Optional[int] = None,
+    ) -> File:
+        """
+        Open node file from cache or from provider.
+
+        Whole file reads of cache misses fill the cache while file is being sent.
+        """
+        if not self.enabled or not provider.use_file_cache or node.size > self.max_file_size:
+            return provider.open_file(path=node.path, offset=offset, length=length)
+
+        node_directory = self._get_node_directory(provider.library.pk, node.path)
+        if node_directory is None:
+            return provider.open_file(path=node.path, offset=offset, length=length)
+
+        entry_path = node_directory / self.get_version(node)
+        try:
+            file = open(entry_path, 'rb')
+        except FileNotFoundError:
+            pass
+        else:
+            # entry may be already evicted by another process, opened file is still readable
+            os.utime(file.fileno())
+            if offset:
+                file.seek(offset)
+            served = node.size - offset if length is None else length
+            with self._lock:
+                self.hits += 1
+                self.bytes_served += served
+            if length is not None:
+                file = io.BufferedReader(LimitedStream(file, length))
+            return File(file, name=node.name)
+
+        with self._lock:
+            self.misses += 1
+
+        source = provider.open_file(path=node.path, offset=offset, length=length)
+        if offset or length is not None:
+            return source
+
+        node_directory.mkdir(parents=True, exist_ok=True)
+        stream = CacheFillStream(
+            source=source,
+            size=node.size,
+            on_complete=lambda tmp_path: self._add_entry(entry_path, tmp_path),
+            directory=node_directory,
+        )
+        return File(io.BufferedReader(stream), name=source.name)
+
+    def invalidate(self, library_id, path: str):
+        """
+        Remove all versions of node at path and entries of its descendants.
+
+        Entries are removed when transaction is committed, so readers of rolled back changes keep them.
+        """
+        if not self.enabled:
+            return
+
+        node_directory = self._get_node_directory(library_id, path)
+        if node_directory is not None:
+            transaction.on_commit(lambda: self._remove_directory(node_directory))
+
+    def _remove_directory(self, node_directory: Path):
+        removed = 0
+        for root, _, files in os.walk(node_directory):
+            for name in files:
+                if name.startswith('.tmp-'):
+                    continue
+                try:
+                    removed += os.path.getsize(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+        shutil.rmtree(node_directory, ignore_errors=True)
+
+        with self._lock:
+            if self._size is not None:
+                self._size = max(self._size - removed, 0)
+
+    def evict(self):
+        """
+        Remove abandoned temporary files and, if cache exceeds max_size, least recently used entries.
+
+        Entries are removed till cache takes low_water_mark of max_size.
+        """
+        entries = []
+        tmp_deadline = time.time() - self.tmp_max_age
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                if not name.startswith('.tmp-'):
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+                elif stat.st_mtime < tmp_deadline:
+                    # cache fill, that was interrupted without close (process was killed)
+                    Path(root, name).unlink(missing_ok=True)
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target_size = self.max_size if size <= self.max_size else self.max_size * self.low_water_mark
+        entries.sort()
+        for _, entry_size, entry_path in entries:
+            if size <= target_size:
+                break
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+        with self._lock:
+            self._size = size
+
+    def clear(self):
+        if self.enabled:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.bytes_served = 0
+            self._size = None
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'size': self._size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0,
+            'bytes_served': self.bytes_served,
+        }
+
+
+file_cache = FileCache(
+    directory=settings.STORAGE_FILE_CACHE_DIR,
+    max_size=settings.STORAGE_FILE_CACHE_SIZE,
+    max_file_size=settings.STORAGE_FILE_CACHE_MAX_FILE_SIZE,
+)
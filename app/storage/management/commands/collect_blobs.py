@@ -0,0 +1,96 @@
+import os
+import time
+import typing
+from pathlib import Path
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from storage.data_providers.blob_storage import BlobStorageProvider, get_blob_path
+from storage.models import Blob, DataLibrary, DataSource, Node
+
+
+class Command(BaseCommand):
+    help = 'Remove blobs of deduplicated storages, that are not referenced by any file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-source', type=int, help='Id of DataSource, all blob storages by default')
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help='Recompute references counts from files before collecting',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Files in blob store without blob rows are removed if they are older (seconds)',
+        )
+
+    @staticmethod
+    def recount(data_source: DataSource) -> int:
+        """Set refcount of every blob to the number of files with its hash, returns number of fixed blobs."""
+        counts = dict(Node.objects.filter(
+            root_id__in=DataLibrary.objects.filter(data_source=data_source).values('root_dir_id'),
+            file_type=Node.FileTypeChoices.FILE,
+        ).exclude(
+            content_hash='',
+        ).values_list('content_hash').annotate(count=Count('id')).order_by())
+
+        fixed = 0
+        for pk, content_hash, refcount in Blob.objects.filter(
+                data_source=data_source,
+        ).values_list('pk', 'hash', 'refcount').iterator():
+            if counts.get(content_hash, 0) != refcount:
+                Blob.objects.filter(pk=pk).update(refcount=counts.get(content_hash, 0))
+                fixed += 1
+        return fixed
+
+    @staticmethod
+    def collect(data_source: DataSource, blobs_directory: Path) -> typing.Tuple[int, int]:
+        """Remove unreferenced blobs, returns their number and size."""
+        removed = freed = 0
+        for pk in Blob.objects.filter(data_source=data_source, refcount=0).values_list('pk', flat=True).iterator():
+            # row is locked, so blob is not referenced again while its file is removed
+            with transaction.atomic():
+                blob = Blob.objects.select_for_update().filter(pk=pk, refcount=0).first()
+                if blob is None:
+                    continue
+                blob.delete()
+                get_blob_path(blobs_directory, blob.hash).unlink(missing_ok=True)
+            removed += 1
+            freed += blob.size
+        return removed, freed
+
+    @staticmethod
+    def collect_orphans(data_source: DataSource, blobs_directory: Path, min_age: int) -> int:
+        """Remove files left by interrupted writes, blob store is checked shard by shard."""
+        removed = 0
+        deadline = time.time() - min_age
+        for shard in sorted(blobs_directory.glob('??')):
+            hashes = set(Blob.objects.filter(
+                data_source=data_source,
+                hash__startswith=shard.name,
+            ).values_list('hash', flat=True))
+            for root, _, files in os.walk(shard):
+                for name in files:
+                    file_path = Path(root) / name
+                    if name not in hashes and file_path.stat().st_mtime < deadline:
+                        file_path.unlink(missing_ok=True)
+                        removed += 1
+        return removed
+
+    def handle(self, *args, data_source: typing.Optional[int], recount: bool, min_age: int, **options):
+        data_sources = DataSource.objects.filter(data_provider_id=BlobStorageProvider.provider_id)
+        if data_source:
+            data_sources = data_sources.filter(pk=data_source)
+
+        for source in data_sources:
+            # blob store does not depend on library
+            provider = BlobStorageProvider(library=None, options=source.options_dict)
+            if recount:
+                self.stdout.write(f'{source}: fixed references of {self.recount(source)} blobs')
+            removed, freed = self.collect(source, provider.blobs_directory)
+            orphans = self.collect_orphans(source, provider.blobs_directory, min_age)
+            self.stdout.write(f'{source}: removed blobs: {removed} ({freed} bytes), orphan files: {orphans}')
@@ -0,0 +1,74 @@
+import itertools
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand
+
+from storage.data_providers.base import BaseProvider
+from storage.data_providers.utils import get_data_provider
+from storage.models import DataLibrary, Node
+from storage.upload_handlers import get_content_hasher
+
+
+class Command(BaseCommand):
+    help = 'Compute content hashes of files uploaded before hashing. Files are read in parallel, one pass each.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--library', help='Id of DataLibrary, all libraries by default')
+        parser.add_argument('--workers', type=int, default=8, help='Number of files read at once')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Nodes are loaded by chunks of this size')
+
+    @staticmethod
+    def hash_file(provider: BaseProvider, path: str) -> str:
+        hasher = get_content_hasher()
+        file = provider.open_file(path=path)
+        try:
+            for chunk in file.chunks():
+                hasher.update(chunk)
+        finally:
+            file.close()
+        return hasher.hexdigest()
+
+    def get_tasks(self, libraries: typing.Iterable[DataLibrary], chunk_size: int):
+        """(provider, node id, path) of every file without hash."""
+        for library in libraries:
+            provider = get_data_provider(library)
+            nodes = Node.objects.filter(
+                root_id=library.root_dir_id,
+                file_type=Node.FileTypeChoices.FILE,
+                content_hash='',
+            ).values_list('pk', 'path')
+            for pk, path in nodes.iterator(chunk_size=chunk_size):
+                yield provider, pk, path
+
+    def handle(self, *args, library: typing.Optional[str], workers: int, chunk_size: int, **options):
+        libraries = DataLibrary.objects.select_related('data_source')
+        if library:
+            libraries = libraries.filter(pk=library)
+
+        def hash_node(task) -> typing.Tuple[int, str, typing.Optional[str], typing.Optional[Exception]]:
+            provider, pk, path = task
+            try:
+                return pk, path, self.hash_file(provider, path), None
+            except Exception as e:
+                return pk, path, None, e
+
+        hashed = failed = 0
+        tasks = self.get_tasks(libraries, chunk_size)
+        # workers only read files, database is updated from this thread
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                batch = list(itertools.islice(tasks, chunk_size))
+                if not batch:
+                    break
+
+                for pk, path, content_hash, error in executor.map(hash_node, batch):
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f'{path}: {error}')
+                        continue
+
+                    Node.objects.filter(pk=pk, content_hash='').update(content_hash=content_hash)
+                    hashed += 1
+
+        self.stdout.write(f'Hashed: {hashed}, failed: {failed}')
@@ -0,0 +1,64 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from storage.data_providers.file_storage import FileSystemStorageProvider
+from storage.data_providers.utils import get_data_provider, get_data_provider_class
+from storage.models import DataSource, UploadSession
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove leftovers of interrupted uploads: stale resumable uploads and temporary files of disk storages. '
+        'Meant to be run on startup and periodically.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=24 * 60 * 60,
+            help='Uploads and temporary files older than this are removed (seconds)',
+        )
+
+    def sweep_upload_sessions(self, max_age: int) -> int:
+        """Abort sessions without activity (new parts) for max_age seconds."""
+        deadline = timezone.now() - timedelta(seconds=max_age)
+
+        removed = 0
+        for pk in UploadSession.objects.filter(updated_at__lt=deadline).values_list('pk', flat=True).iterator():
+            # row is locked, so parts are not uploaded while session is aborted
+            with transaction.atomic():
+                session = UploadSession.objects.select_for_update(of=('self',)).filter(
+                    pk=pk,
+                    updated_at__lt=deadline,
+                ).select_related('library__data_source').first()
+                if session is None:
+                    continue
+                try:
+                    get_data_provider(session.library).abort_upload(
+                        upload_id=session.provider_upload_id,
+                        path=session.path or '/',
+                        name=session.name,
+                    )
+                except Exception as e:
+                    self.stderr.write(f'{session}: {e}')
+                session.delete()
+            removed += 1
+        return removed
+
+    def handle(self, *args, max_age: int, **options):
+        self.stdout.write(f'Stale upload sessions: {self.sweep_upload_sessions(max_age)}')
+
+        upload_ids = set(UploadSession.objects.values_list('provider_upload_id', flat=True))
+        for data_source in DataSource.objects.all():
+            provider_class = get_data_provider_class(data_source.data_provider_id)
+            if not issubclass(provider_class, FileSystemStorageProvider):
+                continue
+
+            # temporary directory does not depend on library
+            provider = provider_class(library=None, options=data_source.options_dict)
+            removed = provider.sweep_tmp_files(max_age=max_age, upload_ids=upload_ids)
+            self.stdout.write(f'{data_source}: temporary files: {removed}')
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_node_paths(apps, schema_editor):
+    """Fill root and path of existing nodes level by level, starting from root directories."""
+    Node = apps.get_model('storage', 'Node')
+    chunk_size = 500
+
+    parents = {
+        node_id: (node_id, '')
+        for node_id in Node.objects.filter(parent__isnull=True).values_list('pk', flat=True)
+    }
+    while parents:
+        parent_ids = list(parents)
+        children = {}
+        for i in range(0, len(parent_ids), chunk_size):
+            nodes = list(Node.objects.filter(parent_id__in=parent_ids[i:i + chunk_size]))
+            for node in nodes:
+                root_id, parent_path = parents[node.parent_id]
+                node.root_id = root_id
+                node.path = f'{parent_path}/{node.name}'
+                children[node.pk] = (root_id, node.path)
+            Node.objects.bulk_update(nodes, ['root', 'path'], batch_size=chunk_size)
+        parents = children
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0002_auto_20220806_1713'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='path',
+            field=models.TextField(blank=True, default='', help_text='Full path from root directory ("/foo/bar.jpg"), empty for root directories', verbose_name='Path'),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='root',
+            field=models.ForeignKey(blank=True, help_text='Root directory of the tree, empty for root directories', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='storage.node', verbose_name='Root directory'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['root', 'path'], name='storage_node_root_path_idx'),
+        ),
+        migrations.RunPython(fill_node_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:23
+
+import os
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Value
+from django.db.models.functions import Concat, Substr
+
+
+def get_subtree_ids(Node, node_id: int) -> list:
+    """Ids of all descendants of node, walked level by level: duplicates share paths, so prefixes are ambiguous."""
+    subtree_ids = []
+    level_ids = [node_id]
+    while level_ids:
+        level_ids = list(Node.objects.filter(parent_id__in=level_ids).values_list('pk', flat=True))
+        subtree_ids.extend(level_ids)
+    return subtree_ids
+
+
+def rename_duplicates(apps, schema_editor):
+    """
+    Rename nodes with the same name in one directory, so that unique constraint can be added.
+
+    The first node keeps its name, the rest get their id appended ("foo (42).txt"). Their files in data
+    providers are not renamed.
+    """
+    Node = apps.get_model('storage', 'Node')
+    max_length = Node._meta.get_field('name').max_length
+
+    duplicates = Node.objects.filter(
+        parent__isnull=False,
+    ).values('parent_id', 'name').annotate(count=Count('id'), first_id=Min('id')).filter(count__gt=1).order_by()
+
+    for duplicate in duplicates:
+        nodes = Node.objects.filter(
+            parent_id=duplicate['parent_id'],
+            name=duplicate['name'],
+        ).exclude(pk=duplicate['first_id']).order_by('pk')
+
+        for node in nodes:
+            old_path = node.path
+            stem, extension = os.path.splitext(node.name)
+            suffix = f' ({node.pk}){extension}'
+            node.name = stem[:max_length - len(suffix)] + suffix
+            node.path = f'{old_path.rpartition("/")[0]}/{node.name}'
+            node.save(update_fields=['name', 'path'])
+            Node.objects.filter(pk__in=get_subtree_ids(Node, node.pk)).update(
+                path=Concat(Value(node.path), Substr('path', len(old_path) + 1)),
+            )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0003_node_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='node',
+            constraint=models.UniqueConstraint(fields=('parent', 'name'), name='storage_node_parent_name_uniq'),
+        ),
+    ]
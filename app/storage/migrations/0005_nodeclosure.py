@@ -0,0 +1,59 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_node_closure(apps, schema_editor):
+    """Link existing nodes to themselves and all their ancestors level by level, starting from root directories."""
+    Node = apps.get_model('storage', 'Node')
+    NodeClosure = apps.get_model('storage', 'NodeClosure')
+    chunk_size = 500
+
+    # node id -> [(ancestor id, depth), ...], including node itself
+    parents = {
+        node_id: [(node_id, 0)]
+        for node_id in Node.objects.filter(parent__isnull=True).values_list('pk', flat=True)
+    }
+    while parents:
+        NodeClosure.objects.bulk_create([
+            NodeClosure(ancestor_id=ancestor_id, descendant_id=node_id, depth=depth)
+            for node_id, ancestors in parents.items()
+            for ancestor_id, depth in ancestors
+        ], batch_size=chunk_size)
+
+        parent_ids = list(parents)
+        children = {}
+        for i in range(0, len(parent_ids), chunk_size):
+            nodes = Node.objects.filter(parent_id__in=parent_ids[i:i + chunk_size]).values_list('pk', 'parent_id')
+            for node_id, parent_id in nodes:
+                children[node_id] = [(node_id, 0), *((a, depth + 1) for a, depth in parents[parent_id])]
+        parents = children
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0004_node_parent_name_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeClosure',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('depth', models.PositiveIntegerField(help_text='Distance from ancestor to descendant', verbose_name='Depth')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='storage.node')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='storage.node')),
+            ],
+            options={
+                'verbose_name': 'Node closure',
+                'verbose_name_plural': 'Node closures',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='nodeclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='storage_nodeclosure_uniq'),
+        ),
+        migrations.RunPython(fill_node_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:27
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_node_stats(apps, schema_editor):
+    """Aggregate sizes and counts of existing nodes through closure table."""
+    Node = apps.get_model('storage', 'Node')
+    NodeClosure = apps.get_model('storage', 'NodeClosure')
+
+    files = NodeClosure.objects.filter(
+        ancestor_id=OuterRef('pk'),
+        descendant__file_type='file',
+    ).values('ancestor_id')
+    children = Node.objects.filter(parent_id=OuterRef('pk')).values('parent_id')
+
+    Node.objects.update(
+        total_size=Coalesce(Subquery(files.annotate(s=Sum('descendant__size')).values('s')), Value(0)),
+        file_count=Coalesce(Subquery(files.annotate(c=Count('pk')).values('c')), Value(0)),
+        child_count=Coalesce(Subquery(children.annotate(c=Count('pk')).values('c')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0005_nodeclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='child_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of direct children', verbose_name='Children count'),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='file_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of files in node and all its descendants', verbose_name='Files count'),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='total_size',
+            field=models.PositiveBigIntegerField(default=0, help_text='Size of node and all its descendants in bytes', verbose_name='Total size'),
+        ),
+        migrations.AlterField(
+            model_name='node',
+            name='size',
+            field=models.PositiveBigIntegerField(default=0, help_text='Size in bytes', verbose_name='Size'),
+        ),
+        migrations.RunPython(fill_node_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0006_node_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['parent', 'file_type', 'name'], name='storage_node_listing_idx'),
+        ),
+    ]
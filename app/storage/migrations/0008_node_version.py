@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0007_node_listing_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, help_text='Increases on any change of descendants', verbose_name='Version'),
+        ),
+    ]
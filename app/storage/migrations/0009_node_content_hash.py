@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0008_node_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='SHA-256 hex digest of file content, empty if unknown', max_length=64, verbose_name='Content hash'),
+        ),
+    ]
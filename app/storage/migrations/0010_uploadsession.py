@@ -0,0 +1,50 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0009_node_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('path', models.TextField(help_text='Path of target directory', verbose_name='Path')),
+                ('name', models.CharField(max_length=255, verbose_name='Name')),
+                ('size', models.PositiveBigIntegerField(help_text='Size of file in bytes', verbose_name='Size')),
+                ('chunk_size', models.PositiveIntegerField(help_text='Size of every part except the last one', verbose_name='Chunk size')),
+                ('provider_upload_id', models.CharField(help_text='Id of upload in data provider (temporary file or multipart upload)', max_length=1024, verbose_name='Provider upload id')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('library', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='storage.datalibrary', verbose_name='Data library')),
+            ],
+            options={
+                'verbose_name': 'Upload session',
+                'verbose_name_plural': 'Upload sessions',
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadPart',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('number', models.PositiveIntegerField(help_text='Number of part, starts from 1', verbose_name='Number')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Size')),
+                ('etag', models.CharField(blank=True, default='', help_text='Part id in data provider, if it has one', max_length=255, verbose_name='ETag')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='storage.uploadsession')),
+            ],
+            options={
+                'verbose_name': 'Upload part',
+                'verbose_name_plural': 'Upload parts',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='uploadpart',
+            constraint=models.UniqueConstraint(fields=('session', 'number'), name='storage_uploadpart_uniq'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.13 on 2026-10-18 02:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0010_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('hash', models.CharField(help_text='SHA-256 hex digest of content', max_length=64, verbose_name='Hash')),
+                ('size', models.PositiveBigIntegerField(help_text='Size in bytes', verbose_name='Size')),
+                ('refcount', models.PositiveIntegerField(db_index=True, default=0, help_text='Number of files with this content', verbose_name='References count')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('data_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blobs', to='storage.datasource', verbose_name='Data source')),
+            ],
+            options={
+                'verbose_name': 'Blob',
+                'verbose_name_plural': 'Blobs',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='blob',
+            constraint=models.UniqueConstraint(fields=('data_source', 'hash'), name='storage_blob_uniq'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0011_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, help_text='Last activity: creation or upload of part', verbose_name='Updated'),
+            preserve_default=False,
+        ),
+    ]
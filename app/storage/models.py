@@ -1,9 +1,13 @@
+import collections
+import itertools
 import typing
 import uuid
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value, F, Case, When
+from django.db.models.functions import Concat, Substr
 from django_cte import CTEManager
 
 
@@ -120,11 +124,38 @@ class Node(models.Model):
         db_index=True,
         blank=True, null=False,
     )
-    size = models.PositiveIntegerField(
+    size = models.PositiveBigIntegerField(
         verbose_name='Size',
         default=0,
         help_text='Size in bytes',
     )
+    total_size = models.PositiveBigIntegerField(
+        verbose_name='Total size',
+        default=0,
+        help_text='Size of node and all its descendants in bytes',
+    )
+    file_count = models.PositiveIntegerField(
+        verbose_name='Files count',
+        default=0,
+        help_text='Number of files in node and all its descendants',
+    )
+    child_count = models.PositiveIntegerField(
+        verbose_name='Children count',
+        default=0,
+        help_text='Number of direct children',
+    )
+    version = models.PositiveBigIntegerField(
+        verbose_name='Version',
+        default=0,
+        help_text='Increases on any change of descendants',
+    )
+    content_hash = models.CharField(
+        verbose_name='Content hash',
+        max_length=64,
+        blank=True, default='',
+        db_index=True,
+        help_text='SHA-256 hex digest of file content, empty if unknown',
+    )
 
     class FileTypeChoices(models.TextChoices):
         DIRECTORY = 'directory', 'Directory'
@@ -149,6 +180,19 @@ class Node(models.Model):
         null=True, db_index=True,
         on_delete=models.PROTECT,
     )
+    root = models.ForeignKey(
+        'self',
+        verbose_name='Root directory',
+        related_name='+',
+        null=True, blank=True,
+        on_delete=models.PROTECT,
+        help_text='Root directory of the tree, empty for root directories',
+    )
+    path = models.TextField(
+        verbose_name='Path',
+        blank=True, default='',
+        help_text='Full path from root directory ("/foo/bar.jpg"), empty for root directories',
+    )
 
     created_at = models.DateTimeField(
         verbose_name='Created',
@@ -162,10 +206,19 @@ class Node(models.Model):
     class Meta:
         verbose_name = 'Node'
         verbose_name_plural = 'Nodes'
+        indexes = [
+            models.Index(fields=['root', 'path'], name='storage_node_root_path_idx'),
+            models.Index(fields=['parent', 'file_type', 'name'], name='storage_node_listing_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['parent', 'name'], name='storage_node_parent_name_uniq'),
+        ]
 
     node_order_by = ['name', 'file_type']
     get_file_type_display: typing.Callable
     DoesNotExist: typing.Type[ObjectDoesNotExist]
+    parent_id: typing.Optional[int]
+    root_id: typing.Optional[int]
     objects = models.Manager()
     cte_objects = CTEManager()
 
@@ -176,15 +229,429 @@ class Node(models.Model):
     def is_directory(self):
         return self.file_type == self.FileTypeChoices.DIRECTORY
 
+    @property
+    def content_type(self) -> str:
+        return self.mimetype and self.mimetype.name or 'application/octet-stream'
+
+    @property
+    def tree_id(self) -> int:
+        """Id of root directory of the tree, that contains this node."""
+        return self.root_id or self.pk
+
+    @staticmethod
+    def _get_stats_kwargs(**kwargs) -> dict:
+        """Initial total_size and file_count of new node."""
+        return {
+            'total_size': kwargs.get('size', 0),
+            'file_count': int(kwargs.get('file_type') == Node.FileTypeChoices.FILE),
+        }
+
     @classmethod
+    @transaction.atomic
     def add_root(cls, **kwargs):
-        return cls.objects.create(parent=None, **kwargs)
+        node = cls.objects.create(parent=None, root=None, path='', **cls._get_stats_kwargs(**kwargs), **kwargs)
+        NodeClosure.objects.create(ancestor=node, descendant=node, depth=0)
+        return node
 
+    @transaction.atomic
     def add_child(self, **kwargs):
-        return Node.objects.create(parent=self, **kwargs)
+        node = Node.objects.create(
+            parent=self,
+            root_id=self.tree_id,
+            path=f'{self.path}/{kwargs["name"]}',
+            **self._get_stats_kwargs(**kwargs),
+            **kwargs
+        )
+        NodeClosure.objects.bulk_create([
+            NodeClosure(ancestor=node, descendant=node, depth=0),
+            *(
+                NodeClosure(ancestor_id=ancestor_id, descendant=node, depth=depth + 1)
+                for ancestor_id, depth in self.ancestor_links.values_list('ancestor_id', 'depth')
+            ),
+        ])
+        node._update_ancestors_stats(sign=1)
+        return node
+
+    @transaction.atomic
+    def add_descendants(
+            self,
+            files: typing.Sequence[typing.Tuple[str, dict]],
+    ) -> typing.Tuple[typing.List['Node'], typing.List['Node']]:
+        """
+        Add many files at once, missing directories of their relative paths are created too.
+
+        Nodes are created with bulk_create by tree levels, closure rows are built from already known ancestors
+        and stats of every ancestor are updated once, so number of queries does not depend on number of files.
+
+        :param files: (relative path of file ("foo/bar.jpg"), Node fields) pairs, paths must be normalized
+        :return: created directories (parents first) and created files (in order of files)
+
+        Raises:
+            Node.DoesNotExist if some directory of relative paths is a file.
+            IntegrityError if some node already exists.
+        """
+        tree_id = self.tree_id
+        directory_paths = set()
+        for relative_path, _ in files:
+            parts = relative_path.split('/')[:-1]
+            directory_paths.update(f'{self.path}/' + '/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+
+        directories = {self.path: self}
+        for node in Node.objects.filter(root_id=tree_id, path__in=directory_paths):
+            if not node.is_directory:
+                raise Node.DoesNotExist(f'"{node.path}" is not a directory')
+            directories[node.path] = node
+        existing_ids = [node.pk for node in directories.values()]
+
+        def create_level(nodes: typing.List[Node]) -> typing.List[Node]:
+            """bulk_create does not return primary keys on every database, so nodes are fetched back."""
+            Node.objects.bulk_create(nodes, batch_size=1000)
+            created = {node.path: node for node in Node.objects.filter(root_id=tree_id, path__in=[
+                node.path for node in nodes
+            ])}
+            return [created[node.path] for node in nodes]
+
+        new_directories = []
+        missing_paths = sorted(directory_paths - directories.keys(), key=lambda path: (path.count('/'), path))
+        for _, level_paths in itertools.groupby(missing_paths, key=lambda path: path.count('/')):
+            level = create_level([
+                Node(
+                    parent=directories[parent_path],
+                    root_id=tree_id,
+                    path=path,
+                    name=name,
+                    file_type=Node.FileTypeChoices.DIRECTORY,
+                )
+                for path in level_paths
+                for parent_path, name in [path.rsplit('/', 1)]
+            ])
+            directories.update((node.path, node) for node in level)
+            new_directories.extend(level)
+
+        new_files = create_level([
+            Node(
+                parent=directories[parent_path],
+                root_id=tree_id,
+                path=path,
+                name=name,
+                file_type=Node.FileTypeChoices.FILE,
+                **self._get_stats_kwargs(file_type=Node.FileTypeChoices.FILE, **kwargs),
+                **kwargs,
+            )
+            for relative_path, kwargs in files
+            for path in [f'{self.path}/{relative_path}']
+            for parent_path, name in [path.rsplit('/', 1)]
+        ])
+
+        ancestor_links = collections.defaultdict(list)
+        for descendant_id, ancestor_id, depth in NodeClosure.objects.filter(
+                descendant_id__in=existing_ids,
+        ).values_list('descendant_id', 'ancestor_id', 'depth'):
+            ancestor_links[descendant_id].append((ancestor_id, depth))
+
+        closures = []
+        # [total_size, file_count, child_count] to add to every ancestor
+        stats = collections.defaultdict(lambda: [0, 0, 0])
+        for node in itertools.chain(new_directories, new_files):
+            links = [(node.pk, 0), *((ancestor_id, depth + 1) for ancestor_id, depth in ancestor_links[node.parent_id])]
+            ancestor_links[node.pk] = links
+            closures.extend(
+                NodeClosure(ancestor_id=ancestor_id, descendant_id=node.pk, depth=depth) for ancestor_id, depth in links
+            )
+            for ancestor_id, depth in links[1:]:
+                ancestor_stats = stats[ancestor_id]
+                ancestor_stats[0] += node.size
+                ancestor_stats[1] += int(not node.is_directory)
+                ancestor_stats[2] += int(depth == 1)
+        NodeClosure.objects.bulk_create(closures, batch_size=1000)
+
+        ids_by_stats = collections.defaultdict(list)
+        for node_id, (total_size, file_count, child_count) in stats.items():
+            ids_by_stats[total_size, file_count, child_count].append(node_id)
+        for (total_size, file_count, child_count), ids in ids_by_stats.items():
+            Node.objects.filter(pk__in=ids).update(
+                total_size=F('total_size') + total_size,
+                file_count=F('file_count') + file_count,
+                child_count=F('child_count') + child_count,
+                version=F('version') + 1,
+            )
+
+        return new_directories, new_files
+
+    def _update_ancestors_stats(self, sign: int):
+        """
+        Add (sign=1) or subtract (sign=-1) totals of this node to all its ancestors in one query.
+
+        Called after node is linked to its ancestors or before it is unlinked from them. Versions of ancestors
+        are increased in both cases.
+        """
+        self.get_ancestors().update(
+            total_size=F('total_size') + sign * self.total_size,
+            file_count=F('file_count') + sign * self.file_count,
+            child_count=F('child_count') + Case(
+                When(pk=self.parent_id, then=sign),
+                default=0,
+            ),
+            version=F('version') + 1,
+        )
+
+    @transaction.atomic
+    def delete(self, *args, **kwargs):
+        self.refresh_from_db(fields=['total_size', 'file_count', 'content_hash'])
+        self._update_ancestors_stats(sign=-1)
+        if not self.is_directory and self.content_hash:
+            # content of file is released, only libraries of content-addressable providers have blobs
+            Blob.objects.filter(
+                data_source__datalibrary__root_dir_id=self.tree_id,
+                hash=self.content_hash,
+                refcount__gt=0,
+            ).update(refcount=F('refcount') - 1)
+        return super().delete(*args, **kwargs)
+
+    def _update_descendants_path(self, old_path: str):
+        """Replace old_path prefix with current path in all descendants."""
+        Node.objects.filter(
+            root_id=self.tree_id,
+            path__startswith=f'{old_path}/',
+        ).update(
+            path=Concat(
+                Value(self.path), Substr('path', len(old_path) + 1),
+                output_field=models.TextField(),
+            ),
+        )
+
+    @transaction.atomic
+    def rename(self, name: str):
+        """Rename node and update paths of all its descendants."""
+        old_path = self.path
+        self.name = name
+
+        if self.parent_id is not None:
+            self.path = f'{old_path.rsplit("/", 1)[0]}/{name}'
+            self._update_descendants_path(old_path)
+            self.get_ancestors().update(version=F('version') + 1)
+
+        self.save(update_fields=['name', 'path', 'updated_at'])
+
+    def _move_closure(self, target: 'Node'):
+        """Relink subtree of this node from its current ancestors to target and its ancestors."""
+        subtree_ids = self.descendant_links.values('descendant_id')
+        NodeClosure.objects.filter(
+            descendant_id__in=subtree_ids,
+        ).exclude(
+            ancestor_id__in=subtree_ids,
+        ).delete()
+
+        subtree = list(self.descendant_links.values_list('descendant_id', 'depth'))
+        NodeClosure.objects.bulk_create([
+            NodeClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + depth + 1)
+            for ancestor_id, ancestor_depth in target.ancestor_links.values_list('ancestor_id', 'depth')
+            for descendant_id, depth in subtree
+        ], batch_size=1000)
+
+    @transaction.atomic
+    def move(self, target: 'Node'):
+        """Move node into target directory and update paths of all its descendants."""
+        old_path = self.path
+        self.refresh_from_db(fields=['total_size', 'file_count'])
+        self._update_ancestors_stats(sign=-1)
+        self.parent = target
+        self.path = f'{target.path}/{self.name}'
+        self._update_descendants_path(old_path)
+        self._move_closure(target)
+        self._update_ancestors_stats(sign=1)
+        self.save(update_fields=['parent', 'path', 'updated_at'])
+
+    def is_descendant_of(self, node: 'Node') -> bool:
+        return self.tree_id == node.tree_id and self.path.startswith(f'{node.path}/')
 
     def get_children(self):
         return Node.objects.filter(parent=self)
 
     def get_children_count(self):
         return self.get_children().count()
+
+    def get_descendants(self, include_self: bool = False):
+        """All nodes in subtree of this node (one join with closure table)."""
+        min_depth = 0 if include_self else 1
+        return Node.objects.filter(ancestor_links__ancestor=self, ancestor_links__depth__gte=min_depth)
+
+    def get_ancestors(self, include_self: bool = False):
+        """All nodes from root directory to this node (one join with closure table)."""
+        min_depth = 0 if include_self else 1
+        return Node.objects.filter(descendant_links__descendant=self, descendant_links__depth__gte=min_depth)
+
+
+class NodeClosure(models.Model):
+    """
+    Closure table of Node tree: every (ancestor, descendant) pair with distance between them.
+
+    Every node is linked to itself with depth 0. Maintained by Node.add_root, Node.add_child and Node.move,
+    rows are removed with their nodes.
+    """
+    id = models.BigAutoField(primary_key=True)
+    ancestor = models.ForeignKey(
+        Node,
+        related_name='descendant_links',
+        on_delete=models.CASCADE,
+    )
+    descendant = models.ForeignKey(
+        Node,
+        related_name='ancestor_links',
+        on_delete=models.CASCADE,
+    )
+    depth = models.PositiveIntegerField(
+        verbose_name='Depth',
+        help_text='Distance from ancestor to descendant',
+    )
+
+    class Meta:
+        verbose_name = 'Node closure'
+        verbose_name_plural = 'Node closures'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='storage_nodeclosure_uniq'),
+        ]
+
+    objects = models.Manager()
+
+
+class UploadSession(models.Model):
+    """Resumable upload of file, Node is created when all parts are uploaded."""
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+    )
+    library = models.ForeignKey(
+        DataLibrary,
+        verbose_name='Data library',
+        on_delete=models.CASCADE,
+    )
+    path = models.TextField(
+        verbose_name='Path',
+        help_text='Path of target directory',
+    )
+    name = models.CharField(
+        verbose_name='Name',
+        max_length=255,
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name='Size',
+        help_text='Size of file in bytes',
+    )
+    chunk_size = models.PositiveIntegerField(
+        verbose_name='Chunk size',
+        help_text='Size of every part except the last one',
+    )
+    provider_upload_id = models.CharField(
+        verbose_name='Provider upload id',
+        max_length=1024,
+        help_text='Id of upload in data provider (temporary file or multipart upload)',
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Created',
+        auto_now_add=True,
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Updated',
+        auto_now=True,
+        help_text='Last activity: creation or upload of part',
+    )
+
+    class Meta:
+        verbose_name = 'Upload session'
+        verbose_name_plural = 'Upload sessions'
+
+    objects = models.Manager()
+    parts: models.QuerySet
+    DoesNotExist: typing.Type[ObjectDoesNotExist]
+
+    def __str__(self):
+        return f'{self.path}/{self.name}'
+
+    @property
+    def part_count(self) -> int:
+        return -(-self.size // self.chunk_size)
+
+    def get_part_size(self, number: int) -> int:
+        """Expected size of part (numbers start from 1)."""
+        return min(self.chunk_size, self.size - (number - 1) * self.chunk_size)
+
+
+class UploadPart(models.Model):
+    """Uploaded part of UploadSession."""
+    id = models.BigAutoField(primary_key=True)
+    session = models.ForeignKey(
+        UploadSession,
+        related_name='parts',
+        on_delete=models.CASCADE,
+    )
+    number = models.PositiveIntegerField(
+        verbose_name='Number',
+        help_text='Number of part, starts from 1',
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name='Size',
+    )
+    etag = models.CharField(
+        verbose_name='ETag',
+        max_length=255,
+        blank=True, default='',
+        help_text='Part id in data provider, if it has one',
+    )
+
+    class Meta:
+        verbose_name = 'Upload part'
+        verbose_name_plural = 'Upload parts'
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'number'], name='storage_uploadpart_uniq'),
+        ]
+
+    objects = models.Manager()
+
+
+class Blob(models.Model):
+    """
+    File content stored once per data source under its hash by content-addressable providers.
+
+    Nodes reference blobs by Node.content_hash, refcount is the number of such nodes. Blobs, that are not
+    referenced anymore, are removed by "collect_blobs" command.
+    """
+    id = models.BigAutoField(primary_key=True)
+    data_source = models.ForeignKey(
+        DataSource,
+        verbose_name='Data source',
+        related_name='blobs',
+        on_delete=models.CASCADE,
+    )
+    hash = models.CharField(
+        verbose_name='Hash',
+        max_length=64,
+        help_text='SHA-256 hex digest of content',
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name='Size',
+        help_text='Size in bytes',
+    )
+    refcount = models.PositiveIntegerField(
+        verbose_name='References count',
+        default=0,
+        db_index=True,
+        help_text='Number of files with this content',
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Created',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        verbose_name = 'Blob'
+        verbose_name_plural = 'Blobs'
+        constraints = [
+            models.UniqueConstraint(fields=['data_source', 'hash'], name='storage_blob_uniq'),
+        ]
+
+    objects = models.Manager()
+    DoesNotExist: typing.Type[ObjectDoesNotExist]
+
+    def __str__(self):
+        return self.hash
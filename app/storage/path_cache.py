@@ -0,0 +1,150 @@
+import hashlib
+import threading
+import time
+import typing
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+CacheKey = typing.Tuple[str, str]
+CacheValue = typing.Tuple[int, str]
+
+
+class PathCache:
+    """
+    Bounded LRU cache of resolved paths: (library_id, path) -> (node_id, file_type).
+
+    Entries are kept in process memory and, if cache_alias is set, shared between processes through Django cache.
+    Both expire after timeout. Cached values may become stale in other processes till then, so callers check
+    them (see get_node_by_path).
+
+    Shared entries of library are stored with its generation, a random token, that is replaced when subtree is
+    invalidated: entries of descendants can not be found by prefix in Django cache, so all entries of library
+    become stale at once.
+    """
+
+    key_prefix = 'storage:path'
+
+    def __init__(self, max_size: int, cache_alias: typing.Optional[str] = None, timeout: typing.Optional[int] = None):
+        self.max_size = max_size
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, expiration time)
+        self._entries: typing.OrderedDict[CacheKey, typing.Tuple[CacheValue, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared_cache(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def _make_shared_key(self, key: CacheKey) -> str:
+        library_id, path = key
+        return f'{self.key_prefix}:{library_id}:{hashlib.md5(path.encode()).hexdigest()}'
+
+    def _make_generation_key(self, library_id: str) -> str:
+        return f'{self.key_prefix}:{library_id}:generation'
+
+    def _get_generation(self, library_id: str) -> str:
+        generation_key = self._make_generation_key(library_id)
+        generation = self.shared_cache.get(generation_key)
+        if generation is None:
+            # another process may start generation at the same time
+            self.shared_cache.add(generation_key, uuid4().hex, timeout=None)
+            generation = self.shared_cache.get(generation_key)
+        return generation
+
+    def _set_local(self, key: CacheKey, value: CacheValue):
+        expires_at = time.monotonic() + self.timeout if self.timeout is not None else float('inf')
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, library_id, path: str) -> typing.Optional[CacheValue]:
+        key = (str(library_id), path)
+
+        with self._lock:
+            value, expires_at = self._entries.get(key, (None, 0))
+            if value is not None and expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._entries.pop(key, None)
+
+        if self.shared_cache is not None:
+            generation_key = self._make_generation_key(key[0])
+            shared_key = self._make_shared_key(key)
+            found = self.shared_cache.get_many([generation_key, shared_key])
+            if shared_key in found and found[shared_key][2] == found.get(generation_key):
+                value = tuple(found[shared_key][:2])
+                self._set_local(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, library_id, path: str, node_id: int, file_type: str):
+        key = (str(library_id), path)
+        value = (node_id, file_type)
+        self._set_local(key, value)
+
+        if self.shared_cache is not None:
+            generation = self._get_generation(key[0])
+            self.shared_cache.set(self._make_shared_key(key), (*value, generation), timeout=self.timeout)
+
+    def invalidate(self, library_id, path: str, recursive: bool = False):
+        """
+        Remove path from cache.
+
+        :param library_id: DataLibrary id
+        :param path: adapted path
+        :param recursive: remove all descendants of path too, in shared cache all entries of library are dropped
+        """
+        key = (str(library_id), path)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            if recursive:
+                prefix = f'{path}/'
+                stale_keys = [k for k in self._entries if k[0] == key[0] and k[1].startswith(prefix)]
+                for stale_key in stale_keys:
+                    del self._entries[stale_key]
+
+        if self.shared_cache is not None:
+            if recursive:
+                self.shared_cache.set(self._make_generation_key(key[0]), uuid4().hex, timeout=None)
+            else:
+                self.shared_cache.delete(self._make_shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            size, hits, misses = len(self._entries), self.hits, self.misses
+        requests = hits + misses
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / requests if requests else 0,
+        }
+
+
+path_cache = PathCache(
+    max_size=settings.STORAGE_PATH_CACHE_SIZE,
+    cache_alias=settings.STORAGE_PATH_CACHE_ALIAS,
+    timeout=settings.STORAGE_PATH_CACHE_TIMEOUT,
+)
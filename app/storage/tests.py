@@ -1,21 +1,44 @@
+import errno
+import hashlib
+import io
+import os
 import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from unittest import mock
+from urllib.parse import parse_qs, quote, urlparse
 
+from django.core.cache import caches
 from django.core.exceptions import SuspiciousFileOperation, ValidationError
-from django.core.files.uploadedfile import UploadedFile
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
+from django.core.management import call_command
 from django.test import TestCase
 from django.urls import reverse
+from django.utils import timezone
+from minio import Minio
+from minio.error import S3Error, ServerError
 
 from accounts.factories import SuperuserFactory
 from app.utils.tests import TestProvider
-from storage.data_providers.exceptions import ProviderException
+from storage.data_providers.blob_storage import BlobStorageProvider
+from storage.data_providers.exceptions import FileExistsException, ProviderException
 from storage.data_providers.file_storage import FileSystemStorageProvider
+from storage.data_providers.minio_storage import (
+    MinioStorage,
+    MinioStorageProvider,
+    MinioUploadWriter,
+    MultipartClient,
+)
 from storage.data_providers.utils import get_data_provider
+from storage.file_cache import FileCache
 from storage.factories import DirectoryFactory, DataLibraryFactory, FileFactory, DataSourceFactory
-from storage.models import Node, DataSource
-from storage.utils import get_node_by_path
+from storage.models import Blob, Node, DataSource, NodeClosure, UploadSession
+from storage.path_cache import PathCache, path_cache
+from storage.utils import get_node_by_path, get_nodes_by_paths
 
 
 class StorageTests(TestCase):
@@ -56,6 +79,467 @@ class StorageTests(TestCase):
         with self.assertRaises(Node.DoesNotExist):
             get_node_by_path(data_library, '/does-not-exist/')
 
+        # same path in another library
+        with self.assertRaises(Node.DoesNotExist):
+            get_node_by_path(DataLibraryFactory(), file_path)
+
+    def test_get_nodes_by_paths(self):
+        """Test getting many nodes by their paths in one query."""
+        data_library = DataLibraryFactory()
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        file = FileFactory(parent=directory, name='bar.jpg')
+        FileFactory(parent=DataLibraryFactory().root_dir, name='baz.jpg')
+
+        with self.assertNumQueries(1):
+            nodes, missing = get_nodes_by_paths(data_library, ['/', 'foo/', '/foo/bar.jpg', '/baz.jpg', '/foo/baz'])
+
+        self.assertDictEqual(nodes, {
+            '/': data_library.root_dir,
+            'foo/': directory,
+            '/foo/bar.jpg': file,
+        })
+        self.assertListEqual(missing, ['/baz.jpg', '/foo/baz'])
+
+    def test_node_path(self):
+        """Ensure node path is kept up to date on rename and move."""
+        data_library = DataLibraryFactory()
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        sub_directory = DirectoryFactory(parent=directory, name='bar')
+        file = FileFactory(parent=sub_directory, name='baz.jpg')
+        target_directory = DirectoryFactory(parent=data_library.root_dir, name='target')
+
+        self.assertEqual(data_library.root_dir.path, '')
+        self.assertEqual(file.path, '/foo/bar/baz.jpg')
+        self.assertEqual(file.root_id, data_library.root_dir_id)
+
+        # rename
+        directory.rename(name='foo2')
+        file.refresh_from_db()
+        sub_directory.refresh_from_db()
+        self.assertEqual(directory.path, '/foo2')
+        self.assertEqual(sub_directory.path, '/foo2/bar')
+        self.assertEqual(file.path, '/foo2/bar/baz.jpg')
+        self.assertEqual(get_node_by_path(data_library, '/foo2/bar/baz.jpg'), file)
+
+        # move
+        sub_directory.move(target_directory)
+        file.refresh_from_db()
+        self.assertEqual(sub_directory.path, '/target/bar')
+        self.assertEqual(file.path, '/target/bar/baz.jpg')
+        self.assertTrue(file.is_descendant_of(target_directory))
+        self.assertFalse(file.is_descendant_of(directory))
+        self.assertEqual(get_node_by_path(data_library, '/target/bar/baz.jpg'), file)
+
+    def test_node_closure(self):
+        """Ensure closure table is kept up to date on add, move and delete."""
+        data_library = DataLibraryFactory()
+        root_dir = data_library.root_dir
+        directory = DirectoryFactory(parent=root_dir, name='foo')
+        sub_directory = DirectoryFactory(parent=directory, name='bar')
+        file = FileFactory(parent=sub_directory, name='baz.jpg')
+        target_directory = DirectoryFactory(parent=root_dir, name='target')
+
+        self.assertSetEqual(set(root_dir.get_descendants()), {directory, sub_directory, file, target_directory})
+        self.assertSetEqual(set(directory.get_descendants(include_self=True)), {directory, sub_directory, file})
+        self.assertSetEqual(set(file.get_ancestors()), {root_dir, directory, sub_directory})
+        self.assertSetEqual(set(file.get_descendants()), set())
+
+        # move
+        sub_directory.move(target_directory)
+        self.assertSetEqual(set(directory.get_descendants()), set())
+        self.assertSetEqual(set(target_directory.get_descendants()), {sub_directory, file})
+        self.assertSetEqual(set(file.get_ancestors()), {root_dir, target_directory, sub_directory})
+        self.assertListEqual(
+            list(file.ancestor_links.order_by('depth').values_list('ancestor_id', 'depth')),
+            [(file.pk, 0), (sub_directory.pk, 1), (target_directory.pk, 2), (root_dir.pk, 3)],
+        )
+
+        # delete
+        file.delete()
+        self.assertSetEqual(set(target_directory.get_descendants()), {sub_directory})
+        self.assertFalse(NodeClosure.objects.filter(descendant_id=file.pk).exists())
+
+    def test_node_stats(self):
+        """Ensure directory sizes and counts are kept up to date on add, move and delete."""
+        data_library = DataLibraryFactory()
+        root_dir = data_library.root_dir
+        directory = DirectoryFactory(parent=root_dir, name='foo')
+        sub_directory = DirectoryFactory(parent=directory, name='bar')
+        file = FileFactory(parent=sub_directory, name='baz.jpg', size=100)
+        FileFactory(parent=directory, name='baz.jpg', size=20)
+        target_directory = DirectoryFactory(parent=root_dir, name='target')
+
+        def get_stats(*nodes):
+            return [
+                tuple(Node.objects.values_list('total_size', 'file_count', 'child_count').get(pk=node.pk))
+                for node in nodes
+            ]
+
+        self.assertListEqual(
+            get_stats(root_dir, directory, sub_directory, file, target_directory),
+            [(120, 2, 2), (120, 2, 2), (100, 1, 1), (100, 1, 0), (0, 0, 0)],
+        )
+
+        # move
+        sub_directory.move(target_directory)
+        self.assertListEqual(
+            get_stats(root_dir, directory, sub_directory, target_directory),
+            [(120, 2, 2), (20, 1, 1), (100, 1, 1), (100, 1, 1)],
+        )
+
+        # delete
+        file.delete()
+        self.assertListEqual(
+            get_stats(root_dir, directory, sub_directory, target_directory),
+            [(20, 1, 2), (20, 1, 1), (0, 0, 0), (0, 0, 1)],
+        )
+
+    def test_add_descendants(self):
+        """Ensure many files are added with their directories, closure and stats without queries per file."""
+        data_library = DataLibraryFactory()
+        root_dir = data_library.root_dir
+        directory = DirectoryFactory(parent=root_dir, name='foo')
+        FileFactory(parent=directory, name='file.txt', size=1)
+
+        files = [
+            ('foo/a.txt', {'size': 10}),
+            ('foo/bar/b.txt', {'size': 20}),
+            ('foo/bar/baz/c.txt', {'size': 30}),
+            ('d.txt', {'size': 40}),
+        ]
+        with self.assertNumQueries(15):
+            directories, nodes = root_dir.add_descendants(files)
+
+        self.assertListEqual([node.path for node in directories], ['/foo/bar', '/foo/bar/baz'])
+        self.assertListEqual(
+            [node.path for node in nodes],
+            ['/foo/a.txt', '/foo/bar/b.txt', '/foo/bar/baz/c.txt', '/d.txt'],
+        )
+        sub_directory, sub_sub_directory = directories
+        self.assertListEqual(
+            list(nodes[2].ancestor_links.order_by('depth').values_list('ancestor_id', 'depth')),
+            [(nodes[2].pk, 0), (sub_sub_directory.pk, 1), (sub_directory.pk, 2), (directory.pk, 3), (root_dir.pk, 4)],
+        )
+        self.assertSetEqual(set(directory.get_descendants()), {*directories, *nodes[:3], *directory.get_children()})
+        self.assertListEqual(
+            [
+                tuple(Node.objects.values_list('total_size', 'file_count', 'child_count').get(pk=node.pk))
+                for node in [root_dir, directory, sub_directory, sub_sub_directory, nodes[2]]
+            ],
+            [(101, 5, 2), (61, 4, 3), (50, 2, 2), (30, 1, 1), (30, 1, 0)],
+        )
+
+        # directory in path is a file
+        with self.assertRaises(Node.DoesNotExist):
+            root_dir.add_descendants([('d.txt/e.txt', {'size': 1})])
+
+
+class CommandsTests(TestCase):
+    def test_hash_node_contents(self):
+        """Ensure content hashes are computed for files without them."""
+        library = DataLibraryFactory()
+        file = FileFactory(parent=library.root_dir)
+        hashed_file = FileFactory(parent=library.root_dir, content_hash='foo')
+        missing_file = FileFactory(parent=library.root_dir)
+
+        def open_file(path, offset=0, length=None):
+            if path == missing_file.path:
+                raise FileNotFoundError(path)
+            return File(io.BytesIO(b'foobar'), name=path)
+
+        out, err = StringIO(), StringIO()
+        with mock.patch('app.utils.tests.TestProvider.open_file', side_effect=open_file) as p:
+            call_command('hash_node_contents', workers=2, stdout=out, stderr=err)
+            self.assertEqual(p.call_count, 2)
+
+        file.refresh_from_db()
+        hashed_file.refresh_from_db()
+        missing_file.refresh_from_db()
+        self.assertEqual(file.content_hash, hashlib.sha256(b'foobar').hexdigest())
+        self.assertEqual(hashed_file.content_hash, 'foo')
+        self.assertEqual(missing_file.content_hash, '')
+        self.assertIn('Hashed: 1, failed: 1', out.getvalue())
+        self.assertIn(missing_file.path, err.getvalue())
+
+    def test_sweep_tmp_files(self):
+        """Ensure stale upload sessions and temporary files are removed, fresh ones are kept."""
+        with TemporaryDirectory() as root_directory:
+            library = DataLibraryFactory(data_source=DataSourceFactory(
+                data_provider_id=FileSystemStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            ))
+            provider = get_data_provider(library)
+            provider.init_provider()
+            provider.init_library()
+
+            stale_session = UploadSession.objects.create(
+                library=library, path='', name='foo.txt', size=1, chunk_size=1,
+                provider_upload_id=provider.create_upload(path='/', name='foo.txt', size=1),
+            )
+            UploadSession.objects.filter(pk=stale_session.pk).update(
+                created_at=timezone.now() - timedelta(days=2),
+                updated_at=timezone.now() - timedelta(days=2),
+            )
+            # long upload, that still receives parts
+            session = UploadSession.objects.create(
+                library=library, path='', name='bar.txt', size=1, chunk_size=1,
+                provider_upload_id=provider.create_upload(path='/', name='bar.txt', size=1),
+            )
+            UploadSession.objects.filter(pk=session.pk).update(created_at=timezone.now() - timedelta(days=2))
+            tmp_file = provider.tmp_directory / 'upload-foo'
+            tmp_file.write_bytes(b'foo')
+            orphan_upload = provider.uploads_directory / 'foo'
+            orphan_upload.write_bytes(b'foo')
+            fresh_tmp_file = provider.tmp_directory / 'upload-bar'
+            fresh_tmp_file.write_bytes(b'bar')
+            old = time.time() - 2 * 24 * 60 * 60
+            for path in [tmp_file, orphan_upload, provider.uploads_directory / session.provider_upload_id]:
+                os.utime(path, (old, old))
+
+            out = StringIO()
+            call_command('sweep_tmp_files', stdout=out)
+            self.assertIn('Stale upload sessions: 1', out.getvalue())
+            self.assertIn('temporary files: 2', out.getvalue())
+            self.assertListEqual(list(UploadSession.objects.all()), [session])
+            self.assertFalse((provider.uploads_directory / stale_session.provider_upload_id).exists())
+            self.assertTrue((provider.uploads_directory / session.provider_upload_id).exists())
+            self.assertFalse(tmp_file.exists())
+            self.assertFalse(orphan_upload.exists())
+            self.assertTrue(fresh_tmp_file.exists())
+
+
+class PathCacheTests(TestCase):
+    def test_lru(self):
+        """Ensure cache keeps only recently used entries."""
+        cache = PathCache(max_size=2)
+        cache.set('lib', '/foo', node_id=1, file_type='directory')
+        cache.set('lib', '/bar', node_id=2, file_type='directory')
+        self.assertEqual(cache.get('lib', '/foo'), (1, 'directory'))
+
+        cache.set('lib', '/baz', node_id=3, file_type='file')
+        self.assertIsNone(cache.get('lib', '/bar'))
+        self.assertEqual(cache.get('lib', '/foo'), (1, 'directory'))
+        self.assertEqual(cache.get('lib', '/baz'), (3, 'file'))
+        self.assertIsNone(cache.get('another-lib', '/baz'))
+        self.assertDictEqual(cache.stats(), {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 2, 'hit_ratio': 0.6})
+
+    def test_invalidate(self):
+        """Ensure we can invalidate path and its subtree."""
+        cache = PathCache(max_size=10)
+        cache.set('lib', '/foo', node_id=1, file_type='directory')
+        cache.set('lib', '/foo/bar', node_id=2, file_type='directory')
+        cache.set('lib', '/foobar', node_id=3, file_type='file')
+        cache.set('another-lib', '/foo/bar', node_id=4, file_type='directory')
+
+        cache.invalidate('lib', '/foo/bar')
+        self.assertIsNone(cache.get('lib', '/foo/bar'))
+        self.assertEqual(cache.get('lib', '/foo'), (1, 'directory'))
+
+        cache.set('lib', '/foo/bar', node_id=2, file_type='directory')
+        cache.invalidate('lib', '/foo', recursive=True)
+        self.assertIsNone(cache.get('lib', '/foo'))
+        self.assertIsNone(cache.get('lib', '/foo/bar'))
+        self.assertEqual(cache.get('lib', '/foobar'), (3, 'file'))
+        self.assertEqual(cache.get('another-lib', '/foo/bar'), (4, 'directory'))
+
+    def test_timeout(self):
+        """Ensure entries in process memory expire."""
+        cache = PathCache(max_size=10, timeout=60)
+        cache.set('lib', '/foo', node_id=1, file_type='directory')
+        self.assertEqual(cache.get('lib', '/foo'), (1, 'directory'))
+
+        with mock.patch('storage.path_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('lib', '/foo'))
+
+    def test_shared_cache(self):
+        """Ensure entries are shared between processes and subtree is invalidated in all of them."""
+        caches['default'].clear()
+        cache = PathCache(max_size=10, cache_alias='default', timeout=60)
+        another_cache = PathCache(max_size=10, cache_alias='default', timeout=60)
+        cache.set('lib', '/foo', node_id=1, file_type='directory')
+        cache.set('lib', '/foo/bar', node_id=2, file_type='directory')
+        cache.set('another-lib', '/foo/bar', node_id=3, file_type='directory')
+        self.assertEqual(another_cache.get('lib', '/foo'), (1, 'directory'))
+
+        cache.invalidate('lib', '/foo', recursive=True)
+        self.assertIsNone(another_cache.get('lib', '/foo/bar'))
+        self.assertEqual(another_cache.get('another-lib', '/foo/bar'), (3, 'directory'))
+        self.assertEqual(another_cache.stats()['misses'], 1)
+
+        cache.set('lib', '/foo/baz', node_id=4, file_type='file')
+        self.assertEqual(another_cache.get('lib', '/foo/baz'), (4, 'file'))
+
+    def test_cached_lookup(self):
+        """Ensure cached path is resolved by primary key and entry is not written again."""
+        path_cache.clear()
+        data_library = DataLibraryFactory()
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        self.assertEqual(get_node_by_path(data_library, '/foo'), directory)
+
+        with mock.patch.object(path_cache, 'set') as set_entry, self.assertNumQueries(1):
+            node = get_node_by_path(data_library, '/foo')
+        set_entry.assert_not_called()
+        self.assertEqual(node.name, 'foo')
+        self.assertEqual((path_cache.stats()['hits'], path_cache.stats()['misses']), (1, 1))
+
+    def test_lazy_lookup(self):
+        """Ensure cached path is resolved without queries by lazy lookup."""
+        data_library = DataLibraryFactory()
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        self.assertEqual(get_node_by_path(data_library, '/foo'), directory)
+
+        with self.assertNumQueries(0):
+            node = get_node_by_path(data_library, '/foo', last_node_type=Node.FileTypeChoices.DIRECTORY, lazy=True)
+            with self.assertRaises(Node.DoesNotExist):
+                get_node_by_path(data_library, '/foo', last_node_type=Node.FileTypeChoices.FILE, lazy=True)
+        self.assertEqual(node, directory)
+        self.assertEqual(node.path, '/foo')
+        self.assertEqual(node.tree_id, data_library.root_dir_id)
+        # other fields are loaded on access
+        self.assertEqual(node.name, 'foo')
+
+    def test_stale_entries(self):
+        """Ensure stale entries (changed in another process) are not returned by get_node_by_path."""
+        data_library = DataLibraryFactory()
+        directory = DirectoryFactory(parent=data_library.root_dir, name='foo')
+        self.assertEqual(get_node_by_path(data_library, '/foo'), directory)
+        self.assertIsNotNone(path_cache.get(data_library.pk, '/foo'))
+
+        # renamed without cache invalidation
+        directory.rename('bar')
+        with self.assertRaises(Node.DoesNotExist):
+            get_node_by_path(data_library, '/foo')
+        self.assertIsNone(path_cache.get(data_library.pk, '/foo'))
+        self.assertEqual(get_node_by_path(data_library, '/bar'), directory)
+
+        # removed and created again
+        path_cache.set(data_library.pk, '/baz', node_id=directory.pk, file_type=directory.file_type)
+        new_directory = DirectoryFactory(parent=data_library.root_dir, name='baz')
+        self.assertEqual(get_node_by_path(data_library, '/baz'), new_directory)
+
+
+class FileCacheTests(TestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.cache = FileCache(directory=self.directory.name, max_size=10, max_file_size=8)
+        self.library = DataLibraryFactory()
+        self.provider = TestProvider(library=self.library, options={})
+        self.provider.use_file_cache = True
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    @staticmethod
+    def open_file(path, offset=0, length=None):
+        data = path.lstrip('/').encode()
+        return File(io.BytesIO(data[offset:None if length is None else offset + length]), name=path)
+
+    @staticmethod
+    def open_and_unlink(path, mode):
+        file = open(path, mode)
+        os.unlink(path)
+        return file
+
+    def test_read_through(self):
+        """Ensure whole file reads fill the cache and next reads do not touch provider."""
+        node = FileFactory(parent=self.library.root_dir, name='foobar', size=6)
+
+        with mock.patch.object(self.provider, 'open_file', side_effect=self.open_file) as p:
+            # file is not read till the end (client disconnected), cache is not filled
+            self.cache.open_file(self.provider, node).close()
+
+            with self.cache.open_file(self.provider, node) as file:
+                self.assertEqual(file.read(), b'foobar')
+            self.assertEqual(p.call_count, 2)
+
+            with self.cache.open_file(self.provider, node) as file:
+                self.assertEqual(file.read(), b'foobar')
+            with self.cache.open_file(self.provider, node, offset=2, length=3) as file:
+                self.assertEqual(file.read(), b'oba')
+            self.assertEqual(p.call_count, 2)
+
+        self.assertDictEqual(self.cache.stats(), {
+            'enabled': True,
+            'size': 6,
+            'max_size': 10,
+            'hits': 2,
+            'misses': 2,
+            'hit_ratio': 0.5,
+            'bytes_served': 9,
+        })
+
+        # new version of file
+        node.content_hash = 'foo'
+        with mock.patch.object(self.provider, 'open_file', side_effect=self.open_file) as p:
+            self.cache.open_file(self.provider, node).close()
+            p.assert_called_once()
+
+        # removed node, entries are removed on commit and cache size is kept without full scan
+        node_directory = Path(self.directory.name) / str(self.library.pk) / node.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cache.invalidate(self.library.pk, node.path)
+            self.assertTrue(node_directory.exists())
+        self.assertFalse(node_directory.exists())
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+        # entry is evicted by another process right after it is opened
+        with mock.patch.object(self.provider, 'open_file', side_effect=self.open_file):
+            with self.cache.open_file(self.provider, node) as file:
+                file.read()
+        with mock.patch('storage.file_cache.open', create=True, side_effect=self.open_and_unlink):
+            with self.cache.open_file(self.provider, node) as file:
+                self.assertEqual(file.read(), b'foobar')
+
+    def test_evict(self):
+        """Ensure least recently used entries are removed to fit size budget."""
+        nodes = [FileFactory(parent=self.library.root_dir, name=f'f{i}.x', size=4) for i in range(3)]
+
+        with mock.patch.object(self.provider, 'open_file', side_effect=self.open_file):
+            for i, node in enumerate(nodes[:2]):
+                with self.cache.open_file(self.provider, node) as file:
+                    file.read()
+                # mtime resolution may be too coarse to order entries written at once
+                entry_path = next((Path(self.directory.name) / str(self.library.pk) / node.name).iterdir())
+                os.utime(entry_path, (time.time() - 10 + i, time.time() - 10 + i))
+            # first file is used recently
+            self.cache.open_file(self.provider, nodes[0]).close()
+            with self.cache.open_file(self.provider, nodes[2]) as file:
+                file.read()
+
+        # space is freed down to low water mark (9 bytes)
+        entries = {path.parent.name for path in Path(self.directory.name).rglob('*') if path.is_file()}
+        self.assertSetEqual(entries, {'f0.x', 'f2.x'})
+        self.assertEqual(self.cache.stats()['size'], 8)
+
+        # there is enough space, cache is not scanned
+        small_node = FileFactory(parent=self.library.root_dir, name='f', size=1)
+        with mock.patch.object(self.provider, 'open_file', side_effect=self.open_file), \
+                mock.patch.object(self.cache, 'evict') as evict:
+            with self.cache.open_file(self.provider, small_node) as file:
+                file.read()
+            evict.assert_not_called()
+        self.assertEqual(self.cache.stats()['size'], 9)
+
+        # temporary files of interrupted cache fills are removed, when they are old enough
+        tmp_directory = Path(self.directory.name) / str(self.library.pk) / 'f1.x'
+        old_tmp_file, tmp_file = tmp_directory / '.tmp-old', tmp_directory / '.tmp-new'
+        old_tmp_file.write_bytes(b'foo')
+        tmp_file.write_bytes(b'foo')
+        old = time.time() - FileCache.tmp_max_age - 1
+        os.utime(old_tmp_file, (old, old))
+        self.cache.evict()
+        self.assertFalse(old_tmp_file.exists())
+        self.assertTrue(tmp_file.exists())
+        self.assertEqual(self.cache.stats()['size'], 9)
+
+        # too large and not cacheable files are read from provider
+        large_node = FileFactory(parent=self.library.root_dir, size=9)
+        with mock.patch.object(self.provider, 'open_file', side_effect=self.open_file) as p:
+            self.cache.open_file(self.provider, large_node).close()
+            self.provider.use_file_cache = False
+            self.cache.open_file(self.provider, nodes[0]).close()
+            self.assertEqual(p.call_count, 2)
+
 
 class FileSystemStorageProviderTests(TestCase):
     """FileStorage tests."""
@@ -124,6 +608,153 @@ class FileSystemStorageProviderTests(TestCase):
             # upload with same name
             with self.assertRaises(ProviderException):
                 provider.upload_file(path='/', uploaded_file=UploadedFile(tmp_file))
+            self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+            # file with same name is created while upload is in progress, it is not overwritten
+            writer = provider.open_upload_writer(path='/', name='bar.txt')
+            writer.write(b'bar')
+            filepath.with_name('bar.txt').write_bytes(b'baz')
+            with self.assertRaises(ProviderException):
+                writer.complete()
+            self.assertEqual(filepath.with_name('bar.txt').read_bytes(), b'baz')
+            self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+    def test_file_upload_fsync(self):
+        """Ensure uploaded file is linked into place and flushed to disk according to fsync option."""
+        with TemporaryDirectory() as f:
+            for fsync, synced in [('', 0), ('file', 1), ('file+dir', 2)]:
+                provider = FileSystemStorageProvider(
+                    library=DataLibraryFactory(),
+                    options={'root_directory': f, 'fsync': fsync},
+                )
+                provider.init_provider()
+                provider.init_library()
+
+                with mock.patch('os.fsync') as p, mock.patch('os.link', wraps=os.link) as link:
+                    provider.upload_file(path='/foo', uploaded_file=SimpleUploadedFile('bar.txt', b'foobar'))
+                self.assertEqual(p.call_count, synced)
+                link.assert_called_once()
+                self.assertEqual(Path(link.call_args.args[0]).parent, provider.tmp_directory)
+                self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+                self.assertEqual(Path(provider.get_user_storage().path('foo/bar.txt')).read_bytes(), b'foobar')
+
+    def test_file_upload_without_hard_links(self):
+        """Ensure files are placed on filesystems without hard links and existing files are not overwritten."""
+        with TemporaryDirectory() as f:
+            provider = FileSystemStorageProvider(library=DataLibraryFactory(), options={'root_directory': f})
+            provider.init_provider()
+            provider.init_library()
+            filepath = Path(provider.get_user_storage().path('bar.txt'))
+
+            with mock.patch('os.link', side_effect=OSError(errno.EPERM, 'Operation not permitted')) as link:
+                provider.upload_file(path='/', uploaded_file=SimpleUploadedFile('bar.txt', b'foobar'))
+                link.assert_called_once()
+                self.assertEqual(filepath.read_bytes(), b'foobar')
+                self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+                # file with same name is created while upload is in progress
+                writer = provider.open_upload_writer(path='/', name='baz.txt')
+                writer.write(b'baz')
+                filepath.with_name('baz.txt').write_bytes(b'foo')
+                with self.assertRaises(FileExistsException):
+                    writer.complete()
+                self.assertEqual(filepath.with_name('baz.txt').read_bytes(), b'foo')
+                self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+            # other errors are not hidden
+            with mock.patch('os.link', side_effect=OSError(errno.EIO, 'Input/output error')):
+                with self.assertRaises(OSError):
+                    provider.upload_file(path='/', uploaded_file=SimpleUploadedFile('foo.txt', b'foo'))
+            self.assertFalse(filepath.with_name('foo.txt').exists())
+
+    def test_open_file(self):
+        """Ensure we can read whole file or its byte range."""
+        with TemporaryDirectory() as f:
+            provider = FileSystemStorageProvider(library=DataLibraryFactory(), options={'root_directory': f})
+            provider.init_provider()
+            provider.init_library()
+            Path(provider.get_user_storage().path('foo.txt')).write_bytes(b'foobar')
+
+            with provider.open_file(path='/foo.txt') as file:
+                self.assertEqual(file.read(), b'foobar')
+
+            with provider.open_file(path='/foo.txt', offset=1, length=3) as file:
+                self.assertEqual(file.name, 'foo.txt')
+                self.assertEqual(b''.join(file.chunks(chunk_size=2)), b'oob')
+
+            with provider.open_file(path='/foo.txt', offset=4, length=10) as file:
+                self.assertEqual(file.read(), b'ar')
+
+    def test_resumable_upload(self):
+        """Ensure parts are written at their offsets and file is moved into library on completion."""
+        with TemporaryDirectory() as f:
+            provider = FileSystemStorageProvider(library=DataLibraryFactory(), options={'root_directory': f})
+            provider.init_provider()
+            provider.init_library()
+
+            upload_id = provider.create_upload(path='/', name='foo.txt', size=6)
+            provider.upload_part(upload_id=upload_id, path='/', name='foo.txt', number=2, offset=4, data=b'ar')
+            provider.upload_part(upload_id=upload_id, path='/', name='foo.txt', number=1, offset=0, data=b'foob')
+            content_hash = provider.complete_upload(
+                upload_id=upload_id, path='/', name='foo.txt', parts=[(1, ''), (2, '')],
+            )
+
+            self.assertEqual(content_hash, hashlib.sha256(b'foobar').hexdigest())
+            self.assertEqual(Path(provider.get_user_storage().path('foo.txt')).read_bytes(), b'foobar')
+            self.assertFalse(any(provider.uploads_directory.iterdir()))
+
+            # file exists
+            upload_id = provider.create_upload(path='/', name='foo.txt', size=0)
+            with self.assertRaises(ProviderException):
+                provider.complete_upload(upload_id=upload_id, path='/', name='foo.txt', parts=[])
+
+            provider.abort_upload(upload_id=upload_id, path='/', name='foo.txt')
+            self.assertFalse(any(provider.uploads_directory.iterdir()))
+
+            with self.assertRaises(ProviderException):
+                provider.abort_upload(upload_id='../foo', path='/', name='foo.txt')
+
+            # file system can not hold file of such size
+            with mock.patch('storage.data_providers.file_storage.open', mock.mock_open(), create=True) as p, \
+                    self.assertRaises(ProviderException):
+                p.return_value.truncate.side_effect = OSError(errno.EFBIG, 'File too large')
+                provider.create_upload(path='/', name='foo.txt', size=2 ** 62)
+
+    def test_offload_download(self):
+        """Ensure downloads are handed over to web server if offload is enabled."""
+        with TemporaryDirectory() as f:
+            library = DataLibraryFactory()
+            node = FileFactory(parent=library.root_dir, name='foo bar.txt')
+            options = {'root_directory': f}
+
+            # disabled by default
+            provider = FileSystemStorageProvider(library=library, options=options)
+            self.assertIsNone(provider.offload_download(path=node.path, node=node))
+
+            # nginx
+            options.update(download_offload='x-accel-redirect', download_location='/protected/')
+            provider = FileSystemStorageProvider(library=library, options=options)
+            response = provider.offload_download(path=node.path, node=node)
+            self.assertEqual(response['X-Accel-Redirect'], f'/protected/{library.pk}/files/foo%20bar.txt')
+            self.assertEqual(response['Content-Type'], node.mimetype.name)
+            self.assertEqual(response.content, b'')
+
+            with self.assertRaises(SuspiciousFileOperation):
+                provider.offload_download(path='/../../foo.txt', node=node)
+
+            # x-sendfile
+            options.update(download_offload='x-sendfile')
+            provider = FileSystemStorageProvider(library=library, options=options)
+            response = provider.offload_download(path=node.path, node=node)
+            real_path = Path(f).resolve() / 'data' / str(library.pk) / 'files' / node.name
+            self.assertEqual(response['X-Sendfile'], str(real_path))
+
+            # location is required for nginx
+            with self.assertRaises(ValidationError) as e:
+                provider.validate_options({'root_directory': f, 'download_offload': 'x-accel-redirect'})
+            self.assertDictEqual(e.exception.message_dict, {
+                'download_location': ['Location is required for X-Accel-Redirect']
+            })
 
     def test_mkdir(self):
         """Ensure we can make directories in storage."""
@@ -247,6 +878,356 @@ class FileSystemStorageProviderTests(TestCase):
             with self.assertRaises(SuspiciousFileOperation):
                 provider.rename(path=str(dir_name), name=new_dir_name)
 
+    def test_move(self):
+        """Ensure files and directories are moved into another directory in storage."""
+        with TemporaryDirectory() as f:
+            provider = FileSystemStorageProvider(library=DataLibraryFactory(), options={'root_directory': f})
+            provider.init_provider()
+            provider.init_library()
+            root_path = Path(f) / 'data' / str(provider.library.pk) / 'files'
+            (root_path / 'foo').mkdir()
+            (root_path / 'bar').mkdir()
+            (root_path / 'bar' / 'baz.txt').write_bytes(b'baz')
+
+            provider.move(path='/bar', target_path='/foo')
+            self.assertFalse((root_path / 'bar').exists())
+            self.assertEqual((root_path / 'foo' / 'bar' / 'baz.txt').read_bytes(), b'baz')
+
+            provider.move(path='/foo/bar/baz.txt', target_path='')
+            self.assertEqual((root_path / 'baz.txt').read_bytes(), b'baz')
+
+            # target exists
+            (root_path / 'foo' / 'baz.txt').touch()
+            with self.assertRaises(FileExistsException):
+                provider.move(path='/baz.txt', target_path='/foo')
+            self.assertEqual((root_path / 'baz.txt').read_bytes(), b'baz')
+
+            # into itself
+            with self.assertRaises(ProviderException):
+                provider.move(path='/foo', target_path='/foo/bar')
+
+            with self.assertRaises(ProviderException):
+                provider.move(path='/', target_path='/foo')
+
+
+class BlobStorageProviderTests(TestCase):
+    def test_deduplication(self):
+        """Ensure same content is stored once, referenced by files and collected when it is not needed."""
+        content = b'foobar'
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        with TemporaryDirectory() as root_directory:
+            data_source = DataSourceFactory(
+                data_provider_id=BlobStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            )
+            library, other_library = DataLibraryFactory.create_batch(2, data_source=data_source)
+            provider = get_data_provider(library)
+            provider.init_provider()
+            other_provider = get_data_provider(other_library)
+
+            directory = DirectoryFactory(parent=library.root_dir, name='foo')
+            provider.mkdir('/foo')
+            file = FileFactory(parent=directory, name='bar.txt', size=len(content))
+            provider.upload_file(path='/foo', uploaded_file=SimpleUploadedFile('bar.txt', content))
+
+            blob_path = provider.blobs_directory / content_hash[:2] / content_hash[2:4] / content_hash
+            self.assertEqual(blob_path.read_bytes(), content)
+            self.assertEqual(Node.objects.get(pk=file.pk).content_hash, content_hash)
+            self.assertEqual(Blob.objects.get(data_source=data_source, hash=content_hash).refcount, 1)
+            self.assertFalse(any(provider.tmp_directory.glob('upload-*')))
+
+            # duplicate is not written, hash is known from upload handler
+            uploaded_file = SimpleUploadedFile('baz.txt', content)
+            uploaded_file.content_hash = content_hash
+            other_file = FileFactory(parent=other_library.root_dir, name='baz.txt', size=len(content))
+            with mock.patch('storage.data_providers.blob_storage.BlobUploadWriter.write') as p:
+                other_provider.upload_file(path='/', uploaded_file=uploaded_file)
+                p.assert_not_called()
+            self.assertEqual(Node.objects.get(pk=other_file.pk).content_hash, content_hash)
+            self.assertEqual(Blob.objects.get(data_source=data_source, hash=content_hash).refcount, 2)
+            self.assertEqual(len([path for path in provider.blobs_directory.rglob('*') if path.is_file()]), 1)
+
+            # files are read from blob
+            self.assertEqual(other_provider.open_file('/baz.txt').read(), content)
+            self.assertEqual(provider.open_file('/foo/bar.txt', offset=1, length=3).read(), b'oob')
+            with self.assertRaises(ProviderException):
+                provider.open_file('/foo/missing.txt')
+
+            # rename and removal do not touch blob store
+            provider.rename('/foo/bar.txt', 'qux.txt')
+            file.delete()
+            provider.rm('/foo/bar.txt')
+            self.assertEqual(Blob.objects.get(data_source=data_source, hash=content_hash).refcount, 1)
+            call_command('collect_blobs', stdout=StringIO())
+            self.assertTrue(blob_path.exists())
+
+            other_file.delete()
+            orphan_path = provider.blobs_directory / 'ab' / 'cd' / ('abcd' + '0' * 60)
+            orphan_path.parent.mkdir(parents=True)
+            orphan_path.write_bytes(b'orphan')
+            out = StringIO()
+            call_command('collect_blobs', min_age=0, stdout=out)
+            self.assertIn('removed blobs: 1 (6 bytes), orphan files: 1', out.getvalue())
+            self.assertFalse(Blob.objects.exists())
+            self.assertFalse(blob_path.exists())
+            self.assertFalse(orphan_path.exists())
+
+    def test_link_file(self):
+        """Ensure blobs are linked without data transfer only if owner has files with such content."""
+        content_hash = hashlib.sha256(b'foobar').hexdigest()
+
+        with TemporaryDirectory() as root_directory:
+            data_source = DataSourceFactory(
+                data_provider_id=BlobStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            )
+            library = DataLibraryFactory(data_source=data_source)
+            provider = get_data_provider(library)
+            provider.init_provider()
+            FileFactory(parent=library.root_dir, name='foo.txt', size=6)
+            provider.upload_file(path='/', uploaded_file=SimpleUploadedFile('foo.txt', b'foobar'))
+
+            own_library = DataLibraryFactory(data_source=data_source, owner=library.owner)
+            own_provider = get_data_provider(own_library)
+            self.assertFalse(own_provider.link_file(path='/', name='bar.txt', content_hash=content_hash, size=5))
+            self.assertTrue(own_provider.link_file(path='/', name='bar.txt', content_hash=content_hash, size=6))
+            self.assertEqual(Blob.objects.get(hash=content_hash).refcount, 2)
+
+            other_library = DataLibraryFactory(data_source=data_source)
+            other_provider = get_data_provider(other_library)
+            self.assertFalse(other_provider.link_file(path='/', name='bar.txt', content_hash=content_hash, size=6))
+            self.assertEqual(Blob.objects.get(hash=content_hash).refcount, 2)
+
+    def test_collect_blobs_recount(self):
+        """Ensure references are recounted from files."""
+        with TemporaryDirectory() as root_directory:
+            library = DataLibraryFactory(data_source=DataSourceFactory(
+                data_provider_id=BlobStorageProvider.provider_id,
+                options={'root_directory': root_directory},
+            ))
+            get_data_provider(library).init_provider()
+            FileFactory(parent=library.root_dir, content_hash='a' * 64)
+            referenced = Blob.objects.create(data_source=library.data_source, hash='a' * 64, size=1, refcount=0)
+            unreferenced = Blob.objects.create(data_source=library.data_source, hash='b' * 64, size=1, refcount=5)
+
+            out = StringIO()
+            call_command('collect_blobs', recount=True, stdout=out)
+            self.assertIn('fixed references of 2 blobs', out.getvalue())
+            self.assertEqual(Blob.objects.get(pk=referenced.pk).refcount, 1)
+            self.assertFalse(Blob.objects.filter(pk=unreferenced.pk).exists())
+
+
+class MinioStorageTests(TestCase):
+    """MinioStorage tests (object storage client is mocked)."""
+
+    def test_get_object(self):
+        """Ensure objects are streamed instead of being read into memory at once."""
+        storage = MinioStorage(client_options={'endpoint': 'localhost:9000'})
+        response = mock.Mock()
+        response.read.side_effect = io.BytesIO(b'foobar').read
+
+        with mock.patch.object(storage.client, 'get_object', return_value=response) as get_object:
+            file = storage.get_object(bucket_name='bucket', path='foo/bar.jpg')
+
+        get_object.assert_called_once_with(bucket_name='bucket', object_name='foo/bar.jpg', offset=0, length=0)
+        response.read.assert_not_called()
+        self.assertEqual(file.name, 'bar.jpg')
+        self.assertEqual(b''.join(file.chunks()), b'foobar')
+        self.assertEqual(response.read.call_args_list[0], mock.call(MinioStorage.chunk_size))
+
+        file.close()
+        response.close.assert_called_once()
+        response.release_conn.assert_called_once()
+
+    def test_move(self):
+        """Ensure only object and its descendants are moved, not neighbours with the same prefix."""
+        storage = MinioStorage(client_options={'endpoint': 'localhost:9000'})
+        objects = [mock.Mock(object_name=name) for name in ['foo', 'foo/bar.txt', 'foobar.txt']]
+
+        with mock.patch.multiple(
+                storage.client,
+                list_objects=mock.DEFAULT,
+                fget_object=mock.DEFAULT,
+                remove_object=mock.DEFAULT,
+                fput_object=mock.DEFAULT,
+        ) as mocks:
+            mocks['list_objects'].return_value = objects
+            storage.move(bucket_name='bucket', source_path='/foo', target_path='/baz/foo')
+
+        mocks['list_objects'].assert_called_once_with(bucket_name='bucket', prefix='foo', recursive=True)
+        self.assertEqual(
+            [c.kwargs['object_name'] for c in mocks['fput_object'].call_args_list],
+            ['baz/foo', 'baz/foo/bar.txt'],
+        )
+        self.assertEqual(
+            [c.kwargs['object_name'] for c in mocks['remove_object'].call_args_list],
+            ['foo', 'foo/bar.txt'],
+        )
+
+    def test_multipart_client(self):
+        """Ensure private multipart methods of installed minio have expected signatures (minio is pinned)."""
+        self.assertEqual(MultipartClient.get_incompatible_methods(), [])
+
+        with mock.patch.object(Minio, '_upload_part', lambda self, bucket_name, object_name, data, upload_id: None):
+            self.assertEqual(MultipartClient.get_incompatible_methods(), ['_upload_part'])
+
+    def test_parallel_upload(self):
+        """Ensure large files are uploaded by parts, failed parts are retried and upload is aborted on failure."""
+        storage = MinioStorage(client_options={'endpoint': 'localhost:9000'}, upload_part_size=4, upload_concurrency=2)
+        attempts = {}
+
+        def upload_part(number, data, **kwargs):
+            attempts[number] = attempts.get(number, 0) + 1
+            if number == 2 and attempts[number] == 1:
+                raise ServerError('Service unavailable')
+            return f'etag{number}'
+
+        with mock.patch.multiple(
+                storage,
+                create_multipart_upload=mock.DEFAULT,
+                upload_part=mock.DEFAULT,
+                complete_multipart_upload=mock.DEFAULT,
+                abort_multipart_upload=mock.DEFAULT,
+        ) as mocks, mock.patch.object(storage.client, 'put_object') as put_object, \
+                mock.patch.object(MinioUploadWriter, 'upload_retry_delay', 0):
+            mocks['create_multipart_upload'].return_value = 'upload-id'
+            mocks['upload_part'].side_effect = upload_part
+
+            # small file is uploaded at once
+            storage.upload(bucket_name='bucket', path='foo', file=SimpleUploadedFile('bar.txt', b'bar'))
+            put_object.assert_called_once()
+            mocks['create_multipart_upload'].assert_not_called()
+
+            storage.upload(bucket_name='bucket', path='foo', file=SimpleUploadedFile('bar.txt', b'foobarbaz!'))
+            self.assertEqual(
+                sorted((c.kwargs['number'], c.kwargs['data']) for c in mocks['upload_part'].call_args_list),
+                [(1, b'foob'), (2, b'arba'), (2, b'arba'), (3, b'z!')],
+            )
+            mocks['complete_multipart_upload'].assert_called_once_with(
+                bucket_name='bucket',
+                path='foo/bar.txt',
+                upload_id='upload-id',
+                parts=[(1, 'etag1'), (2, 'etag2'), (3, 'etag3')],
+            )
+            mocks['abort_multipart_upload'].assert_not_called()
+
+            # part fails every time
+            mocks['upload_part'].reset_mock()
+            mocks['upload_part'].side_effect = ServerError('Service unavailable')
+            with self.assertRaises(ServerError):
+                storage.upload(bucket_name='bucket', path='foo', file=SimpleUploadedFile('bar.txt', b'foobarbaz!'))
+            mocks['abort_multipart_upload'].assert_called_once_with(
+                bucket_name='bucket', path='foo/bar.txt', upload_id='upload-id',
+            )
+            self.assertEqual(
+                len([c for c in mocks['upload_part'].call_args_list if c.kwargs['number'] == 1]),
+                MinioUploadWriter.upload_part_retries,
+            )
+
+            # client errors are not retried
+            mocks['upload_part'].reset_mock()
+            mocks['abort_multipart_upload'].reset_mock()
+            mocks['upload_part'].side_effect = S3Error(
+                'NoSuchUpload', 'Upload does not exist', 'foo/bar.txt', 'request-id', 'host-id',
+                mock.Mock(status=404),
+            )
+            with self.assertRaises(S3Error):
+                storage.upload(bucket_name='bucket', path='foo', file=SimpleUploadedFile('bar.txt', b'foobarbaz!'))
+            mocks['abort_multipart_upload'].assert_called_once()
+            self.assertEqual(
+                len([c for c in mocks['upload_part'].call_args_list if c.kwargs['number'] == 1]),
+                1,
+            )
+
+
+class MinioStorageProviderTests(TestCase):
+    """MinioStorageProvider tests, no minio server is required."""
+
+    def test_offload_download(self):
+        """Ensure presigned download url is built locally with response headers of node."""
+        library = DataLibraryFactory()
+        node = FileFactory(parent=library.root_dir, name='фото.jpg')
+        options = {'endpoint': 'localhost:9000', 'access_key': 'foo', 'secret_key': 'bar'}
+
+        # disabled by default
+        provider = MinioStorageProvider(library=library, options=options)
+        self.assertIsNone(provider.offload_download(path=node.path, node=node))
+
+        options.update(region='us-east-1', presigned_download='true', presigned_download_expires='60')
+        provider = MinioStorageProvider(library=library, options=options)
+        with mock.patch.object(provider.storage.client, '_url_open') as url_open:
+            response = provider.offload_download(path=node.path, node=node)
+            url_open.assert_not_called()
+
+        self.assertEqual(response.status_code, 302)
+        url = urlparse(response['Location'])
+        query = parse_qs(url.query)
+        self.assertEqual(url.netloc, 'localhost:9000')
+        self.assertEqual(url.path, f'/{library.pk}/{quote(node.name)}')
+        self.assertEqual(query['X-Amz-Expires'], ['60'])
+        self.assertEqual(query['response-content-type'], [node.mimetype.name])
+        self.assertEqual(query['response-content-disposition'], [f"inline; filename*=utf-8''{quote(node.name)}"])
+
+        # quotes are escaped
+        node.name = 'foo "bar".jpg'
+        response = provider.offload_download(path=node.path, node=node)
+        query = parse_qs(urlparse(response['Location']).query)
+        self.assertEqual(query['response-content-disposition'], [r'inline; filename="foo \"bar\".jpg"'])
+
+        # region is required, otherwise it is requested on every download
+        del options['region']
+        with self.assertRaises(ValidationError) as e:
+            MinioStorageProvider(library=library, options=options)
+        self.assertDictEqual(e.exception.message_dict, {'region': ['Region is required for presigned download']})
+
+    def test_upload_writer(self):
+        """Ensure uploaded chunks are sent as multipart upload parts as soon as part is filled."""
+        storage = MinioStorage(client_options={'endpoint': 'localhost:9000'}, upload_part_size=4)
+        with mock.patch.multiple(
+                storage,
+                create_multipart_upload=mock.DEFAULT,
+                upload_part=mock.DEFAULT,
+                complete_multipart_upload=mock.DEFAULT,
+                abort_multipart_upload=mock.DEFAULT,
+        ) as mocks, mock.patch.object(storage.client, 'put_object') as put_object:
+            mocks['create_multipart_upload'].return_value = 'upload-id'
+            mocks['upload_part'].side_effect = lambda number, **kwargs: f'etag{number}'
+
+            # small file
+            writer = MinioUploadWriter(storage=storage, bucket_name='bucket', path='foo.txt')
+            writer.write(b'foo')
+            writer.complete()
+            put_object.assert_called_once()
+            mocks['create_multipart_upload'].assert_not_called()
+
+            writer = MinioUploadWriter(storage=storage, bucket_name='bucket', path='foo.txt')
+            writer.write(b'foo')
+            writer.write(b'barbaz!')
+            self.assertEqual(writer.part_count, 2)
+            writer.complete()
+            self.assertEqual(
+                sorted((c.kwargs['number'], c.kwargs['data']) for c in mocks['upload_part'].call_args_list),
+                [(1, b'foob'), (2, b'arba'), (3, b'z!')],
+            )
+            mocks['complete_multipart_upload'].assert_called_once_with(
+                bucket_name='bucket',
+                path='foo.txt',
+                upload_id='upload-id',
+                parts=[(1, 'etag1'), (2, 'etag2'), (3, 'etag3')],
+            )
+
+            writer = MinioUploadWriter(storage=storage, bucket_name='bucket', path='foo.txt')
+            writer.write(b'foobar')
+            writer.abort()
+            mocks['abort_multipart_upload'].assert_called_once_with(
+                bucket_name='bucket', path='foo.txt', upload_id='upload-id',
+            )
+
+            # part size is increased, so that large file fits into parts limit
+            writer = MinioUploadWriter(storage=storage, bucket_name='bucket', path='foo.txt', size=50000)
+            self.assertEqual(writer.part_size, 5)
+
 
 class DataSourceAdminTest(TestCase):
     def setUp(self) -> None:
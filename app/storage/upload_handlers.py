@@ -0,0 +1,171 @@
+import hashlib
+import typing
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    MemoryFileUploadHandler,
+    StopFutureHandlers,
+    TemporaryFileUploadHandler,
+)
+from django.http import HttpRequest
+
+from storage.data_providers.base import UploadWriter
+from storage.data_providers.utils import get_data_provider
+from storage.models import DataLibrary, Node
+from storage.utils import get_node_by_path
+
+CONTENT_HASH_ALGORITHM = 'sha256'
+
+
+def get_content_hasher():
+    return hashlib.new(CONTENT_HASH_ALGORITHM)
+
+
+class ContentHashMixin:
+    """
+    Computes hash of uploaded file from chunks of request body and sets it to file.content_hash.
+
+    Chunk is hashed by the handler that consumes it, so every byte is hashed once and the file is never read again.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = get_content_hasher()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        chunk = super().receive_data_chunk(raw_data, start)
+        if chunk is None:
+            self.hasher.update(raw_data)
+        return chunk
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class StreamedUploadedFile(UploadedFile):
+    """
+    File, that is already written into provider while request was received.
+
+    It is placed into library with complete(), otherwise it is removed when request is closed.
+    """
+
+    def __init__(self, writer: UploadWriter, name: str, content_type: str, size: int, charset: str):
+        super().__init__(file=None, name=name, content_type=content_type, size=size, charset=charset)
+        self.writer = writer
+        self.completed = False
+
+    def open(self, mode=None):
+        raise ValueError('File is already stored in data provider')
+
+    def complete(self):
+        self.completed = True
+        self.writer.complete()
+
+    def close(self):
+        if not self.completed:
+            self.completed = True
+            self.writer.abort()
+
+
+class ProviderFileUploadHandler(FileUploadHandler):
+    """
+    Writes uploaded file straight into data provider, without temporary file or memory buffer.
+
+    Installed by upload view before request body is parsed. Target directory is resolved from url kwargs
+    when file starts, if it can not be resolved (or provider does not support streaming), file is left
+    to the next handlers and errors are reported by the view as usual.
+    """
+
+    def __init__(self, request: HttpRequest, library_id, path: str, field_name: str = 'file'):
+        super().__init__(request=request)
+        self.library_id = library_id
+        self.path = path
+        self.upload_field_name = field_name
+        self.writer: typing.Optional[UploadWriter] = None
+        self.content_length: typing.Optional[int] = None
+        self.files: typing.List[StreamedUploadedFile] = []
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # file can not be larger than request body, it is enough to choose size of upload parts
+        self.content_length = content_length
+
+    def get_writer(self, file_name: str) -> typing.Optional[UploadWriter]:
+        user = self.request.user
+        if not user.is_authenticated:
+            return None
+
+        try:
+            library = DataLibrary.objects.get(owner=user, id=self.library_id)
+            parent_node = get_node_by_path(
+                library=library,
+                path=self.path,
+                last_node_type=Node.FileTypeChoices.DIRECTORY,
+                # node is checked again, when file is completed
+                lazy=True,
+            )
+            if parent_node.get_children().filter(name=file_name).exists():
+                return None
+            return get_data_provider(library).open_upload_writer(
+                path=parent_node.path or '/',
+                name=file_name,
+                size=self.content_length,
+            )
+        except (DataLibrary.DoesNotExist, Node.DoesNotExist, SuspiciousFileOperation, NotImplementedError):
+            return None
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        self.writer = None
+        super().new_file(field_name, file_name, *args, **kwargs)
+        if field_name == self.upload_field_name:
+            self.writer = self.get_writer(file_name)
+        if self.writer is not None:
+            raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+        self.writer.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+
+        file = StreamedUploadedFile(
+            writer=self.writer,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+        )
+        self.files.append(file)
+        self.writer = None
+        return file
+
+    def upload_interrupted(self):
+        # called by parser, when request body ends before file is complete
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+    def abort(self):
+        """Remove data of files, that are not placed into library: partially received and not completed ones."""
+        self.upload_interrupted()
+        for file in self.files:
+            file.close()
+
+
+class HashingProviderFileUploadHandler(ContentHashMixin, ProviderFileUploadHandler):
+    pass
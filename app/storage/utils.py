@@ -1,20 +1,19 @@
 # todo: write :exception in class/method descriptions
 import typing
-from functools import partial
 
-from django.db import transaction
-from django.db.models import F, Value, TextField
-from django.db.models.functions import Concat
-from django_cte import With
+from django.db import transaction, models, router
+from django.db.models import Q
 
 from storage.data_providers.exceptions import ProviderException
 from storage.data_providers.utils import get_data_provider
 from storage.models import Node, DataLibrary
+from storage.file_cache import file_cache
+from storage.path_cache import path_cache
 
 
 def adapt_path(path: str) -> str:
     """
-    Adapts path to CTE queryset appropriate.
+    Adapts path to Node.path format.
 
     "" -> ""
     "/" -> ""
@@ -30,33 +29,11 @@ def adapt_path(path: str) -> str:
     return '/'.join(['', *path_list])
 
 
-def _make_node_cte(cte, **params):
-    # non-recursive: get root nodes
-    return Node.cte_objects.filter(
-        parent__isnull=True,
-        **params,
-    ).values(
-        'pk',
-        'name',
-        path=F('name'),
-    ).union(
-        # recursive union: get descendants
-        cte.join(Node, parent=cte.col.pk).values(
-            'pk',
-            'name',
-            path=Concat(
-                cte.col.path, Value('/'), F('name'),
-                output_field=TextField(),
-            ),
-        ),
-        all=True,
-    )
-
-
 def get_node_by_path(
         library: DataLibrary,
         path: str,
-        last_node_type: typing.Optional[str] = None
+        last_node_type: typing.Optional[str] = None,
+        lazy: bool = False,
 ) -> Node:
     """
     Get node by path in root directory.
@@ -64,24 +41,48 @@ def get_node_by_path(
     :param library: DataLibrary of node
     :param path: path relative to root directory ("/foo/bar.jpg")
     :param last_node_type: optional, asserts last node (bar.jpg) has specified file_type
+    :param lazy: optional, node may be answered from path cache without query. Only pk, path and file_type
+        of such node are known, other fields are loaded on access. Cached entry may be stale (changed by another
+        process), so lazy node is suitable for lookups (children, etc.), that are checked again later
     :return: Node in requested path
 
     Raises:
          Node.DoesNotExist if node is not found.
     """
-    cte = With.recursive(partial(_make_node_cte, pk=library.root_dir_id))
     path = adapt_path(path)
-    node_cte_qs = (
-        cte.join(Node.cte_objects.all(), pk=cte.col.pk)
-        .with_cte(cte)
-        .annotate(
-            path=cte.col.path,
-        )
-        .filter(path=path)
-        .order_by('path')
-    )
-
-    node = node_cte_qs.get()
+    cached = path_cache.get(library.pk, path)
+    node = None
+
+    if cached is not None:
+        node_id, file_type = cached
+        if lazy:
+            values = {
+                'id': node_id,
+                'root_id': library.root_dir_id if path else None,
+                'path': path,
+                'file_type': file_type,
+            }
+            # values must be in order of model fields, the rest of fields are deferred
+            field_names = [field.attname for field in Node._meta.concrete_fields if field.attname in values]
+            node = Node.from_db(router.db_for_read(Node), field_names, [values[name] for name in field_names])
+        else:
+            # primary key lookup, entry is checked, it may be changed by another process
+            node = Node.objects.filter(pk=node_id).first()
+            if node is None or node.path != path or node.tree_id != library.root_dir_id:
+                path_cache.invalidate(library.pk, path)
+                node = None
+
+    if node is None:
+        try:
+            if path:
+                node = Node.objects.get(root_id=library.root_dir_id, path=path)
+            else:
+                node = Node.objects.get(pk=library.root_dir_id)
+        except Node.DoesNotExist:
+            # node was removed, renamed or moved, may be by another process
+            path_cache.invalidate(library.pk, path)
+            raise
+        path_cache.set(library.pk, path, node_id=node.pk, file_type=node.file_type)
 
     if last_node_type is not None and last_node_type != node.file_type:
         raise Node.DoesNotExist('Incorrect node type')
@@ -89,6 +90,41 @@ def get_node_by_path(
     return node
 
 
+def get_nodes_by_paths(
+        library: DataLibrary,
+        paths: typing.Iterable[str],
+        queryset: typing.Optional[models.QuerySet] = None,
+) -> typing.Tuple[typing.Dict[str, Node], typing.List[str]]:
+    """
+    Get many nodes by their paths in one query.
+
+    :param library: DataLibrary of nodes
+    :param paths: paths relative to root directory
+    :param queryset: optional Node queryset to select from (for select_related, etc.)
+    :return: found nodes by requested paths and list of paths, that do not exist
+    """
+    if queryset is None:
+        queryset = Node.objects.all()
+
+    adapted_paths = {path: adapt_path(path) for path in paths}
+    lookup_paths = set(adapted_paths.values())
+    query = Q(root_id=library.root_dir_id, path__in=lookup_paths - {''})
+    if '' in lookup_paths:
+        query |= Q(pk=library.root_dir_id)
+
+    nodes = {node.path: node for node in queryset.filter(query)}
+
+    found = {}
+    missing = []
+    for path, adapted_path in adapted_paths.items():
+        if adapted_path in nodes:
+            found[path] = nodes[adapted_path]
+        else:
+            missing.append(path)
+
+    return found, missing
+
+
 def remove_node(library: DataLibrary, path: str):
     """
     Removes Node by its path.
@@ -105,7 +141,7 @@ def remove_node(library: DataLibrary, path: str):
     if current_node == library.root_dir:
         raise ProviderException('Can not remove root directory')
 
-    if current_node.is_directory and current_node.get_children_count():
+    if current_node.is_directory and current_node.child_count:
         raise ProviderException(
             f'Can not remove "{current_node.name}": is not empty'
         )
@@ -113,3 +149,6 @@ def remove_node(library: DataLibrary, path: str):
     with transaction.atomic():
         current_node.delete()
         data_provider.rm(path=path)
+
+    path_cache.invalidate(library.pk, adapt_path(path))
+    file_cache.invalidate(library.pk, adapt_path(path))